@@ -1,13 +1,20 @@
 import yaml
+import itertools
 from pathlib import Path
 import numpy as np
 import os 
 
+# Source of Configuration.version, shared so that copies never reuse a version
+_versions = itertools.count(1)
+
 class Configuration(dict):
     """Class to store the configuration variables."""
 
     def __init__(self, config_file="config.yaml"):
         super().__init__()  # initialize as a dictionary
+        # Incremented on every change made through the attributes, set, save and reload, so
+        # values derived from the config can be cached until it changes
+        self.version = 0
         self.config_file = Path(config_file)
         self.reload_config()
         
@@ -18,11 +25,29 @@ class Configuration(dict):
         self.three_roi_enabled = False
         self.fix_center = False
  
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name != "version":
+            self.touch()
+
+    def touch(self):
+        """Mark the configuration as changed, e.g. after editing a section in place."""
+        super().__setattr__("version", next(_versions))
+
     def save(self):
         """Save the current configuration to the config file."""
+        self.touch()
         with open(self.config_file, "w") as f:
             yaml.dump(dict(self), f)
     
+    def update_from(self, other):
+        """Replace the values and runtime settings with those of another configuration, e.g. the
+        copy a worker process receives."""
+        self.clear()
+        self.update(other)
+        self.__dict__.update(vars(other))
+        self.touch()
+
     def get_config(self, section, key):
         """Return the configuration as a dictionary."""
         if section in self.keys():
@@ -40,6 +65,7 @@ class Configuration(dict):
         with open(self.config_file, "r") as f:
             self.clear()
             self.update(yaml.safe_load(f) or {})
+        self.touch()
      
     def set(self, section, key, value):
         """Set a configuration value."""
@@ -139,6 +165,15 @@ class Configuration(dict):
     @property
     def colormap(self):
         return self.get_config("plot", "colormap")
+
+    @property
+    def shot_history(self):
+        """Number of recent shots kept in memory and listed in the shot list."""
+        var = self.get_config("plot", "history")
+        if var:
+            return int(var)
+        else:
+            return 15
     
     ##### Fit Settings #####
     @property
@@ -180,6 +215,110 @@ class Configuration(dict):
     def fix_z0(self, val):
         self["fit"]["fix_z0"] = str(val)
 
+    @property
+    def fit_mode(self):
+        """"least_squares" to fit the 2D Gaussian, "moments" for the closed-form estimate only."""
+        var = self.get_config("fit", "mode")
+        if var in ("least_squares", "moments"):
+            return var
+        else:
+            return "least_squares"
+
+    @property
+    def moments_stride(self):
+        """Distance in pixels between the data points of the moments estimate."""
+        var = self.get_config("fit", "moments_stride")
+        if var:
+            return max(1, int(var))
+        else:
+            return 4
+
+    @property
+    def fit_stride(self):
+        """The strided 2D fit uses every fit_stride-th row."""
+        var = self.get_config("fit", "stride")
+        if var:
+            return max(1, int(var))
+        else:
+            return 5
+
+    @property
+    def fit_pyramid(self):
+        """Number of binned levels of the coarse-to-fine 2D fit, 0 for the strided fit."""
+        var = self.get_config("fit", "pyramid")
+        if var:
+            return max(0, int(var))
+        else:
+            return 0
+
+    @property
+    def fit_xtol(self):
+        """Relative change of the parameters that terminates the 2D fit."""
+        var = self.get_config("fit", "xtol")
+        if var:
+            return float(var)
+        else:
+            return 1e-7
+
+    @property
+    def fit_max_nfev(self):
+        """Maximum number of model evaluations of the 2D fit (per pyramid level)."""
+        var = self.get_config("fit", "max_nfev")
+        if var:
+            return int(var)
+        else:
+            return 100
+
+    @property
+    def fit_processes(self):
+        """Number of worker processes fitting shots, 0 to fit in the processing threads."""
+        var = self.get_config("fit", "processes")
+        if var:
+            return max(0, int(var))
+        else:
+            return 0
+
+    @property
+    def fit_warm_start(self):
+        """If True, the 2D fit is seeded with the converged parameters of the previous shot."""
+        var = self.get_config("fit", "warm_start")
+        if var is not None:
+            return bool(var)
+        else:
+            return False
+
+    @property
+    def fit_cache_enabled(self):
+        """If True, fit results are cached on disk by frames and fit settings."""
+        return bool(self.get_config("cache", "enabled"))
+
+    @property
+    def fit_cache_directory(self):
+        """Directory of the fit result cache."""
+        var = self.get_config("cache", "directory")
+        if var:
+            return Path(var)
+        else:
+            return Path("../Analysis Results/fit_cache")
+
+    @property
+    def fit_cache_max_size(self):
+        """Maximum size of the fit result cache in bytes (configured in MB)."""
+        var = self.get_config("cache", "max_size")
+        if var:
+            return int(float(var) * 2**20)
+        else:
+            return 256 * 2**20
+
+    @property
+    def fit_engine(self):
+        """Solver of the 2D Gaussian fit: "analytic" (analytic Jacobian) or "lmfit"."""
+        var = self.get_config("fit", "engine")
+        if var in ("analytic", "lmfit"):
+            return var
+        else:
+            return "analytic"
+
     @property
     def roi(self):
         """Tuple of (x0, y0, x1, y1) defining the region of interest for fitting."""
@@ -233,6 +372,186 @@ class Configuration(dict):
     def center(self, tup):
         self["fit"]["center"] = list(tup)
     
+    ##### Processing Settings #####
+    @property
+    def precision(self):
+        """Floating point type of the transmission and optical density images."""
+        var = self.get_config("compute", "precision")
+        if var in ("float32", "float64"):
+            return var
+        else:
+            return "float64"
+
+    @property
+    def lut(self):
+        """If True, 8-bit frames are converted with the transmission/optical density lookup table."""
+        return bool(self.get_config("compute", "lut"))
+
+    @property
+    def lut_validate(self):
+        """If True, lookup table results are compared against the floating point computation."""
+        return bool(self.get_config("compute", "lut_validate"))
+
+    @property
+    def roi_first(self):
+        """If True, images are only computed for the enabled ROIs (plus roi_halo pixels)."""
+        return bool(self.get_config("compute", "roi_first"))
+
+    @property
+    def roi_halo(self):
+        """Margin in pixels around the ROIs in ROI-first mode, covers the smoothing filters."""
+        var = self.get_config("compute", "roi_halo")
+        if var is not None:
+            return int(var)
+        else:
+            return 12
+
+    @property
+    def pipeline_workers(self):
+        """Dictionary of the number of worker threads per shot processing stage."""
+        var = self.get_config("pipeline", "workers")
+        if var:
+            return dict(var)
+        else:
+            return {}
+
+    @property
+    def pipeline_queue_size(self):
+        """Maximum number of shots waiting in front of each processing stage."""
+        var = self.get_config("pipeline", "queue_size")
+        if var:
+            return int(var)
+        else:
+            return 4
+
+    @property
+    def log_batch_size(self):
+        """Number of shots written to the HDF5 log file at once."""
+        var = self.get_config("logging", "batch_size")
+        if var:
+            return int(var)
+        else:
+            return 16
+
+    @property
+    def log_flush_interval(self):
+        """Maximum number of seconds before queued shots are written to the HDF5 log file."""
+        var = self.get_config("logging", "flush_interval")
+        if var:
+            return float(var)
+        else:
+            return 5.0
+
+    @property
+    def log_compression(self):
+        """Compression filter of the frames in the HDF5 log file."""
+        var = self.get_config("logging", "compression")
+        if var:
+            return str(var)
+        else:
+            return None
+
+    @property
+    def render_processes(self):
+        """Number of worker processes rendering the PNG exports (0: render in the persist stage)."""
+        var = self.get_config("render", "processes")
+        if var is not None:
+            return int(var)
+        else:
+            return 1
+
+    @property
+    def render_max_pending(self):
+        """Number of queued PNG exports at which the persist stage waits for the renderers."""
+        var = self.get_config("render", "max_pending")
+        if var:
+            return max(1, int(var))
+        else:
+            return 4
+
+    @property
+    def render_policy(self):
+        """Shots exported as PNG: "every" shot, every "nth" shot, "on_demand" only, or shots
+        arriving while the pipeline is "idle"."""
+        var = self.get_config("render", "policy")
+        if var in ("every", "nth", "on_demand", "idle"):
+            return var
+        else:
+            return "every"
+
+    @property
+    def render_every(self):
+        """N of the "nth" render policy."""
+        var = self.get_config("render", "every")
+        if var:
+            return max(1, int(var))
+        else:
+            return 1
+
+    @property
+    def render_dpi(self):
+        """Resolution of the PNG exports."""
+        var = self.get_config("render", "dpi")
+        if var:
+            return int(var)
+        else:
+            return 150
+
+    @property
+    def acquisition_direct(self):
+        """Whether frames grabbed by the camera are processed in memory instead of being saved
+        for the file watcher."""
+        var = self.get_config("acquisition", "direct")
+        if var is not None:
+            return bool(var)
+        else:
+            return False
+
+    @property
+    def acquisition_archive(self):
+        """Whether frames processed in memory are also saved to the Raw Data folder."""
+        var = self.get_config("acquisition", "archive")
+        if var is not None:
+            return bool(var)
+        else:
+            return True
+
+    @property
+    def acquisition_ring_size(self):
+        """Number of frame buffers between the grab loop and the threads saving the frames."""
+        var = self.get_config("acquisition", "ring_size")
+        if var:
+            return max(1, int(var))
+        else:
+            return 32
+
+    @property
+    def acquisition_writers(self):
+        """Number of threads saving the frames of the frame ring."""
+        var = self.get_config("acquisition", "writers")
+        if var:
+            return max(1, int(var))
+        else:
+            return 1
+
+    @property
+    def camera_backend(self):
+        """Camera backend: "spinnaker" (FLIR camera through PySpin) or "simulated"."""
+        var = self.get_config("acquisition", "backend")
+        if var in ("spinnaker", "simulated"):
+            return var
+        else:
+            return "spinnaker"
+
+    @property
+    def simulated_rate(self):
+        """Frames per second of the simulated camera (0: only software triggers)."""
+        var = self.get_config("acquisition", "simulated_rate")
+        if var is not None:
+            return float(var)
+        else:
+            return 3.0
+
     @property
     def logdict(self):
         """Returns dictionary of all relevant config parameters"""
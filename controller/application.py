@@ -1,7 +1,9 @@
 import signal
-import queue
 
+from config import config
 from models.shots import Shot
+from worker.acquisition import ShotFeed
+from utils.threading import EventDispatcher
 
 # import sub controllers
 from .logs import LogController
@@ -12,7 +14,7 @@ from .camera import CameraController
 class MainController:
     def __init__(self, worker, shutdown_cleanup, log_queue):
         self.worker = worker
-        self.event_queue = queue.Queue()
+        self.dispatcher = None
         self.log_queue = log_queue
         self.shutdown_cleanup = shutdown_cleanup
 
@@ -21,9 +23,12 @@ class MainController:
         self.shot_controller = None
         self.sequence_controller = None
         self.camera_controller = CameraController()
+        self.shot_feed = None
 
     def set_view(self, view):
         self.view = view
+        # Runs the events queued by the worker threads on the main thread
+        self.dispatcher = EventDispatcher(self.view)
 
         self.log_controller= LogController(self.view.log, log_queue=self.log_queue)
         self.shot_controller = ShotController(
@@ -39,44 +44,25 @@ class MainController:
             self, self.worker, plot_view=self.view.plot, fit_view=self.view.tab.tof_fit
         )
 
+        # Frames grabbed by the camera go straight into the processing pipeline
+        if config.acquisition_direct:
+            # Frames are archived through the frame ring of the camera controller
+            archive = self.camera_controller.ring if config.acquisition_archive else None
+            self.shot_feed = ShotFeed(self.shot_controller.process_frames, archive=archive)
+            self.camera_controller.frame_sink = self.shot_feed
+
         # Handle window closure or SIGINT from console
         self.view.master.protocol("WM_DELETE_WINDOW", self.quit)
         signal.signal(signal.SIGINT, self.quit)
 
-        # Start polling event queue
-        self.view.after(100, self._poll_event_queue)
-
     def quit(self, *args, **kwargs):
         """Run callback, then shut down Tkinter master."""
         self.shutdown_cleanup()
         self.view.master.destroy()
         self.view.master.quit()
 
-    def queue(self, func, *args, **kwargs):
-        """Add object to event queue (only way to communicate between threads)."""
-        return self.event_queue.put((func, args, kwargs))
-
-    # def _poll_event_queue(self):
-    #     """The plot queue is polled every 100ms for updates."""
-    #     if not self.event_queue.empty():
-    #         obj = self.event_queue.get(block=False)
-    #         if isinstance(obj, tuple):
-    #             func, *args = obj
-    #             func(*args)
-    #     self.view.after(100, self._poll_event_queue)
-
-    def _poll_event_queue(self):
-        """The plot queue is polled every 100ms for updates."""
-        if not self.event_queue.empty():
-            obj = self.event_queue.get(block=False)
-            if isinstance(obj, tuple):
-                if len(obj) == 1:
-                    obj[0]()
-                elif len(obj) == 2:
-                    if isinstance(obj[1], list):
-                        obj[0](*obj[1])
-                    elif isinstance(obj[1], dict):
-                        obj[0](**obj[1])
-                elif len(obj) == 3:
-                    obj[0](*obj[1], **obj[2])
-        self.view.after(100, self._poll_event_queue)
+    def queue(self, func, *args, key=None, rank=None, **kwargs):
+        """Queue func(*args, **kwargs) to run on the main thread (only way to communicate
+        between threads). Only the newest of the events queued with the same key runs, and
+        events ranked below an already queued one are dropped."""
+        return self.dispatcher.put(func, args, kwargs, key=key, rank=rank)
@@ -1,11 +1,13 @@
 from typing import Any
-import PySpin as ps
 import numpy as np
 import time 
 import logging
 from platform import node 
 import os 
 import threading
+from config import config
+from worker.acquisition import FrameRing
+from worker.camera import CameraError, create_backend
 config_name_set = ("ExposureAuto", "ExposureCompensation", "ExposureCompensationAuto",
                    "ExposureMode","ExposureTime", "Gain","GainAuto","TriggerActivation",
                    "TriggerDelay", "TriggerDelayEnable","TriggerMode","TriggerSelector",
@@ -20,10 +22,11 @@ def thread(func):
     return wrapper
 
 class CameraController:
-    def __init__(self) -> None:
+    def __init__(self, backend=None) -> None:
         """
-        The initialization of the camera controller turns on the camera 
-        retrieve the camera info and settings, and then release the camera.
+        The initialization of the camera controller opens the camera session, which is kept 
+        open until close(), and retrieves the camera info and settings. The camera is the 
+        backend given or the one configured (see worker.camera.create_backend).
         """
         self.exposure_time = 50
         self.trigger_source = 'Line0'
@@ -36,20 +39,35 @@ class CameraController:
         self.device_config = {}
         self.camera_config = {}
         self.isavailable = False
+        self.camera = backend if backend is not None else create_backend(config.camera_backend)
+        # Receives the grabbed frames with add(name, idx, frame, fileformat) instead of them 
+        # being saved to self.folder for the file watcher, see worker.acquisition.ShotFeed
+        self.frame_sink = None
+        # Frames saved to disk are written by background threads, see worker.acquisition.FrameRing
+        self.ring = FrameRing(config.acquisition_ring_size, writers=config.acquisition_writers)
+
+        if self.camera is not None and self.camera.open():
+            self.isavailable = True
+            self.device_info()
+            self.camera_config = self.get_all_config()
+
+    @property
+    def is_open(self) -> bool:
+        return self.camera is not None and self.camera.is_open
+
+    def close(self):
+        """Close the camera session and write the frames left in the ring."""
+        if self.camera is not None:
+            self.camera.close()
+        self.ring.close()
+        self.isavailable = False
 
-        cam, cam_list, system = self.find_camera()
-        cam.Init()
-        if cam is not None:
-            self.device_info(cam)
-            nodemap, tldevice_nodemap = self.nodemap(cam)
-            self.camera_config = self.get_all_config(nodemap)
-        
-        self.close(cam, cam_list, system)
-
-    def update_camera_config(self, nodemap):
-        """Update camera config."""
-        for name in self.camera_config.keys():
-            self.camera_config[name] = self.get_config(nodemap, name)
+    def update_camera_config(self, names=None):
+        """Update camera config, of the given node names or all of them."""
+        for name in names if names is not None else list(self.camera_config.keys()):
+            value = self.get_config(name)
+            if value is not None:
+                self.camera_config[name] = value
 
     def retrieve_config(self, name:str) -> Any:
         if name in self.device_config.keys():
@@ -60,218 +78,67 @@ class CameraController:
             logging.info('Config name %s is not available.' % name)
             return None
 
-    def find_camera(self):
-        logging.info('============= find camera =============')
-        system = ps.System.GetInstance()
-        cam_list = system.GetCameras()
-        version = system.GetLibraryVersion()
-        logging.info('Library version: %d.%d.%d.%d' % (version.major, version.minor,version.type, version.build))
-        
-        num_cameras = cam_list.GetSize()
-        logging.info('Number of cameras detected: %i' % num_cameras)
-        if num_cameras == 0:
-            # Clear camera list before releasing system
-            cam_list.Clear()
-            # Release system instance
-            system.ReleaseInstance()
-            logging.info('Not enough cameras!')
-            return None, None, None
-        else:
-            cam = cam_list.GetByIndex(0)
-            self.isavailable = True
-            logging.info('Camera is found.')
-            return cam, cam_list, system
-    
-    def close(self, cam, cam_list, system):
-        if cam is not None:
-            try: 
-                cam.DeInit()
-            except:
-                logging.info('Camera is not available to close.')
-            del cam
-        if cam_list is not None:
-            cam_list.Clear()
-        if system is not None:
-            system.ReleaseInstance()
-        logging.info('Camera is closed.')
-    
-    def nodemap(self, cam) -> Any:
-        """Get nodemap."""
-        if cam is not None:
-            nodemap = cam.GetNodeMap()
-            tldevice_nodemap = cam.GetTLDeviceNodeMap()
-            return nodemap, tldevice_nodemap
-        else:
-            logging.info('Camera is not available.')
-            return None, None
-        
-    def device_info(self, cam) -> bool:
+    def device_info(self) -> bool:
         """Print device info."""
-
-        if cam is not None:
-            nodemap = cam.GetNodeMap()
-        else:
+        if not self.is_open:
             logging.info('Camera is not available.')
             return False
 
         logging.info('============= device info update =============')
-        try:
-            result = True
-            node_device_information = ps.CCategoryPtr(nodemap.GetNode('DeviceInformation'))
-            if ps.IsReadable(node_device_information):
-                features = node_device_information.GetFeatures()
-                for feature in features:
-                    node_feature = ps.CValuePtr(feature)
-                    logging.info('%s: %s' % (node_feature.GetName(),
-                                            node_feature.ToString() if ps.IsReadable(feature) else 'Node not readable'))
-                    
-                    if ps.IsReadable(feature):
-                        self.device_config[node_feature.GetName()] = node_feature.ToString()
-            else:
-                logging.info('Device control information not available.')
-                return False
-        except ps.SpinnakerException as ex:
-            logging.info('Error: %s' % ex)
-            return False
+        self.device_config = self.camera.device_info()
+        for name, value in self.device_config.items():
+            logging.info('%s: %s' % (name, value))
+        return bool(self.device_config)
     
-    def set_config(self, nodemap, nodename, value) -> bool:
+    def set_config(self, nodename, value) -> bool:
         """Set config node."""
-        if nodemap is None:
+        if not self.is_open:
             logging.info('Camera is not available to set configurations.')
             return False
-        
-        node_address = nodemap.GetNode(nodename)
-        if not ps.IsAvailable(node_address):
-            logging.info('Node %s is not available' % nodename)
-            return False
-        else:
-            # check node type
-            if ps.CEnumerationPtr(node_address).IsValid():
-                node = ps.CEnumerationPtr(node_address)
-                node_entry = ps.CEnumEntryPtr(node.GetEntryByName(value))
-                try:
-                    node.SetIntValue(node_entry.GetValue())
-                    logging.info('%s set to %s' % (node.GetName(), value))
-                except:
-                    logging.info('Value %s is not valid.' % value)
-                    return False
-            
-            elif ps.CIntegerPtr(node_address).IsValid():
-                node = ps.CIntegerPtr(node_address)
-                try:
-                    node.SetValue(int(value))
-                    logging.info('%s set to %s' % (node.GetName(), value))
-                except:
-                    logging.info('Value %s is not valid.' % value)
-                    return False
+        return self.camera.set(nodename, value)
             
-            elif ps.CFloatPtr(node_address).IsValid():
-                node = ps.CFloatPtr(node_address)
-                try:
-                    node.SetValue(float(value))
-                    logging.info('%s set to %s' % (node.GetName(), value))
-                except:
-                    logging.info('Value %s is not valid.' % value)
-                    return False
-            
-            elif ps.CBooleanPtr(node_address).IsValid():
-                node = ps.CBooleanPtr(node_address)
-                try:
-                    node.SetValue(bool(value))
-                    logging.info('%s set to %s' % (node.GetName(), value))
-                except:
-                    logging.info('Value %s is not valid.' % value)
-                    return False
-            
-            else:
-                logging.info('Type of node is not supported temporarily.')
-                return False
-            
-    def get_config(self, nodemap, nodename) -> Any:
+    def get_config(self, nodename) -> Any:
         """Get config node."""
-        if nodemap is None:
+        if not self.is_open:
             logging.info('Camera is not available to get configurations.')
             return None
-        
-        node_address = nodemap.GetNode(nodename)
-        if not ps.IsAvailable(node_address):
-            logging.info('Node %s is not available' % nodename)
-            return None
-        else:
-            # check node type
-            if ps.CEnumerationPtr(node_address).IsValid():
-                node = ps.CEnumerationPtr(node_address)
-                node_feature = node.GetCurrentEntry()
-                if ps.IsReadable(node):
-                    node_feature_symbol = node_feature.GetSymbolic()
-                    logging.info('%s: %s' % (node.GetName(), node_feature_symbol))
-                    return node_feature_symbol
-                else:
-                    logging.info('(Enumeration)Unable to get %s' % node.GetName())
-                    return None
-            
-            elif ps.CIntegerPtr(node_address).IsValid():
-                node = ps.CIntegerPtr(node_address)
-                node_feature = node.GetValue()
-                if ps.IsReadable(node):
-                    logging.info('%s: %s' % (node.GetName(), node_feature))
-                    return node_feature
-                else:
-                    logging.info('(Int)Unable to get %s' % node.GetName())
-                    return None
-            
-            elif ps.CFloatPtr(node_address).IsValid():
-                node = ps.CFloatPtr(node_address)
-                node_feature = node.GetValue()
-                if ps.IsReadable(node):
-                    logging.info('%s: %s' % (node.GetName(), node_feature))
-                    return node_feature
-                else:
-                    logging.info('(Float)Unable to get %s' % node.GetName())
-                    return None
-            
-            elif ps.CBooleanPtr(node_address).IsValid():
-                node = ps.CBooleanPtr(node_address)
-                node_feature = node.GetValue()
-                if ps.IsReadable(node):
-                    logging.info('%s: %s' % (node.GetName(), node_feature))
-                    return node_feature
-                else:
-                    logging.info('(Bool)Unable to get %s' % node.GetName())
-                    return None
-                
-            elif ps.CStringPtr(node_address).IsValid():
-                node = ps.CStringPtr(node_address)
-                node_feature = node.GetValue()
-                if ps.IsReadable(node):
-                    logging.info('%s: %s' % (node.GetName(), node_feature))
-                    return node_feature
-                else:
-                    logging.info('(String)Unable to get %s' % node.GetName())
-                    return None 
-            else:
-                logging.info('Type of node is not supported temporarily.')
-                return None
 
-    def get_all_config(self, nodemap) -> dict:
+        value = self.camera.get(nodename)
+        if value is not None:
+            logging.info('%s: %s' % (nodename, value))
+        return value
+
+    def get_all_config(self) -> dict:
         """Get all config nodes."""
-        if nodemap is None:
-            logging.info('Camera is not available to get configurations.')
-            return {}
-        
         config = {}
         for name in config_name_set:
-            result = self.get_config(nodemap, name)
+            result = self.get_config(name)
             if result is not None:
                 config[name] = result
         return config
+
+    def trigger_settings(self) -> dict:
+        """Node settings of the triggered acquisition, in the order they are applied."""
+        return {
+            'GainAuto': 'Off',
+            'TriggerSource': self.trigger_source,
+            'TriggerSelector': 'ExposureStart',
+            'TriggerActivation': 'RisingEdge',
+            'TriggerDelay': self.trigger_delay,
+            'ExposureMode': 'Timed',
+            'ExposureAuto': 'Off',
+            'ExposureTime': self.exposure_time,
+            'AcquisitionMode': 'Continuous',
+            'PixelFormat': self.pixel_format,
+        }
      
     def config_trigger(self, 
-                       nodemap, 
                        exposure_time:float=None, 
                        trigger:str=None, 
-                       trigger_delay:float=None) -> bool:
-        if nodemap is None:
+                       trigger_delay:float=None,
+                       pixel_format:str=None) -> bool:
+        """Configure the trigger and image format. Only the changed settings are written."""
+        if not self.is_open:
             logging.info('Camera is not available to set configurations.')
             return False
         if exposure_time is not None:
@@ -280,56 +147,34 @@ class CameraController:
             self.trigger_source = trigger
         if trigger_delay is not None:
             self.trigger_delay = trigger_delay
-        
-        logging.info('============= config trigger =============')
-        try: 
-            self.set_config(nodemap, 'TriggerMode', 'Off')
-            self.set_config(nodemap, 'GainAuto', 'Off')
-            self.set_config(nodemap, 'TriggerSource', self.trigger_source)
-            self.set_config(nodemap, 'TriggerSelector', 'ExposureStart')
-            self.set_config(nodemap, 'TriggerActivation', 'RisingEdge')
-            self.set_config(nodemap, 'TriggerDelay', self.trigger_delay)
-            self.set_config(nodemap, 'ExposureMode', 'Timed')
-            self.set_config(nodemap, 'ExposureAuto', 'Off')
-            self.set_config(nodemap, 'ExposureTime', self.exposure_time)
-
-            self.set_config(nodemap, 'TriggerMode', 'On')
-            self.set_config(nodemap, 'AcquisitionMode', 'Continuous')
-                                         
-        except ps.SpinnakerException as ex:
-            logging.info('Error: %s' % ex)
-            return False
-
-    def config_fomat(self, nodemap, pixel_format:str=None) -> bool:
-        """Configure image format."""
-        if nodemap is None:
-            logging.info('Camera is not available to set configurations.')
-            return False
-        
         if pixel_format is not None:
             self.pixel_format = pixel_format
         
-        try:
-            self.set_config(nodemap, 'PixelFormat', self.pixel_format)
-            return True
-        except ps.SpinnakerException as ex:
-            logging.info('Error: %s' % ex)
-            return False
-    
-    def reset_cam(self, cam) -> bool:
+        changed = self.camera.configure(self.trigger_settings())
+        if changed:
+            logging.info('============= config trigger =============')
+            # Read back the values the camera settled on (e.g. rounded exposure times)
+            self.update_camera_config(changed + ['TriggerMode'])
+        return True
+
+    def reset_cam(self) -> bool:
         """Reset camera to default settings."""
-        if cam is None:
+        if not self.is_open:
             logging.info('Camera is not available to set configurations.')
             return False
         
         logging.info('Resetting camera to default settings...')
         try:
-            cam.UserSetSelector.SetValue(ps.UserSetSelector_Default)
-            cam.UserSetLoad()
+            self.camera.reset()
             return True
-        except ps.SpinnakerException as ex:
+        except CameraError as ex:
             logging.info('Error: %s' % ex)
             return False
+
+    def begin_acquisition(self) -> None:
+        """Apply the changed settings and start streaming."""
+        self.config_trigger()
+        self.camera.begin_acquisition()
     
     @thread
     def acquisition(self, 
@@ -344,84 +189,94 @@ class CameraController:
         result = False
         # update args
         if pixelformat is not None:
-            self.pixelformat = pixelformat
+            self.pixel_format = pixelformat
         if fileformat is not None:
-            self.fileformat = fileformat
+            self.file_format = fileformat
         if filename is not None:
             self.filename = filename
         if folder is not None:
             self.folder = folder
-        
-        cam, cam_list, system = self.find_camera()
-        if cam is None:
-            logging.info('Camera is not available to set configurations.')
-            return False
-        
-        cam.Init()
-        nodemap, tldevice_nodemap = self.nodemap(cam)
-        if nodemap is None:
+        if tag is not None:
+            self.tag = tag
+
+        if self.camera is None:
             logging.info('Camera is not available to set configurations.')
             return False
-        
-        self.config_trigger(nodemap)
-        self.config_fomat(nodemap)
-        self.update_camera_config(nodemap)
 
-        logging.info('=========== camera acquisition starts ===========')
-        cam.BeginAcquisition()
+        # The session lock keeps acquisitions started from the GUI from overlapping
+        with self.camera.lock:
+            if not self.camera.open():
+                logging.info('Camera is not available to set configurations.')
+                return False
+            self.isavailable = True
 
-        device_serial_number = '' or self.get_config(tldevice_nodemap, 'DeviceSerialNumber')
-        logging.info('Device serial number: %s' % device_serial_number)
-        
-        # Create ImageProcessor instance for post processing images
-        processor = ps.ImageProcessor()
-        # By default, if no specific color processing algorithm is set, the image
-        # processor will default to NEAREST_NEIGHBOR method.
-        processor.SetColorProcessing(ps.SPINNAKER_COLOR_PROCESSING_ALGORITHM_HQ_LINEAR)
-        
-        for i in range(num_images): 
             try:
-                image_result = cam.GetNextImage(1000)
-                if image_result.IsIncomplete():
-                    logging.info('Image incomplete with image status %d ...' % image_result.GetImageStatus())
-                else:
-                    width = image_result.GetWidth()
-                    height = image_result.GetHeight()
-                    logging.info('Grabbed Image %d, width = %d, height = %d' % (i, width, height))
-
-                    # Convert image
-                    if self.pixelformat == "Mono8":
-                        image_converted = processor.Convert(image_result, ps.PixelFormat_Mono8)
-                    elif self.pixelformat == "Mono10":
-                        image_converted = processor.Convert(image_result, ps.PixelFormat_Mono10)
-                    elif self.pixelformat == "Mono12":
-                        image_converted = processor.Convert(image_result, ps.PixelFormat_Mono12)
-                    
-                    # Save image
-                    if not os.path.exists(self.folder):
-                        os.makedirs(self.folder)
-                    
-                    timestr = time.strftime("%Y%m%d")
-                    image_filename = os.path.join(self.folder, timestr + '_' + self.filename + '_' + str(i) + '_' + self.tag + '.{}'.format(self.fileformat))
-                    image_converted.Save(image_filename)
-                    logging.info('Image saved at %s' % image_filename)
+                self.camera.call(self.begin_acquisition)
+            except CameraError as ex:
+                logging.info('Error: %s' % ex)
+                return False
 
-                    # Release image
-                    image_result.Release()
-                    logging.info('Image %d released.' % i)
+            logging.info('=========== camera acquisition starts ===========')
+            logging.info('Device serial number: %s' % self.device_config.get('DeviceSerialNumber', ''))
+            # Shots of the "auto" tag are complete within one acquisition, the start time keeps 
+            # them apart from the shots of earlier acquisitions
+            timestr = time.strftime("%Y%m%d_%H%M%S" if self.tag == 'auto' else "%Y%m%d")
+            try:
+                for i in range(num_images):
+                    result = self._grab(i, wait_time, timestr) or result
+            finally:
+                try:
+                    self.camera.end_acquisition()
+                except CameraError as ex:
+                    logging.info('Error: %s' % ex)
+            if self.frame_sink is None:
+                logging.info('Frame ring: %s' % self.ring.stats)
+        return result
 
-                    # Wait
-                    time.sleep(wait_time)
-                    result = True
+    def shot_image(self, i, timestr) -> tuple:
+        """Shot name and image index (1: atoms, 2: beam, 3: dark) of image i of an acquisition. 
+        The tag is the index of all images, or "auto" to take the images of each shot in turn."""
+        if self.tag == 'auto':
+            return '%s_%s_%d' % (timestr, self.filename, i // 3), i % 3 + 1
+        tag = int(self.tag) if str(self.tag).isdigit() else self.tag
+        return '%s_%s_%d' % (timestr, self.filename, i), tag
 
-            except ps.SpinnakerException as ex:
-                logging.info('Error: %s' % ex)
-                result = False
+    def _grab(self, i, wait_time, timestr) -> bool:
+        """Grab image i of an acquisition and hand it to the frame sink or save it."""
+        try:
+            with self.camera.grab(1000) as frame:
+                height, width = frame.shape
+                logging.info('Grabbed Image %d, width = %d, height = %d' % (i, width, height))
+
+                name, idx = self.shot_image(i, timestr)
+                if self.frame_sink is not None:
+                    # Copied once out of the camera buffer
+                    self.frame_sink.add(name, idx, np.array(frame), self.file_format)
+                    logging.info('Image %s_%s handed to the analysis.' % (name, idx))
+                else:
+                    # The frame is copied into the ring and saved by its writer threads, a slow 
+                    # disk doesn't delay the next grab
+                    image_filename = os.path.join(self.folder, '%s_%s.%s' % (name, idx, self.file_format))
+                    if self.ring.put(image_filename, frame):
+                        logging.info('Image queued for %s' % image_filename)
+                    else:
+                        logging.warning('Frame ring full, dropped image %s' % image_filename)
+            logging.info('Image %d released.' % i)
+
+            # Wait
+            time.sleep(wait_time)
+            return True
 
-        cam.EndAcquisition()
-        
-        self.close(cam, cam_list, system)
-        return result
+        except CameraError as ex:
+            logging.info('Error: %s' % ex)
+            # Timeouts while waiting for a trigger leave the camera connected
+            if not self.camera.connected:
+                try:
+                    if self.camera.reconnect():
+                        self.begin_acquisition()
+                except CameraError as ex:
+                    logging.info('Error: %s' % ex)
+            return False
 
 
 # class CameraController:
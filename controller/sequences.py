@@ -1,8 +1,5 @@
 import logging
-from pathlib import Path
-from datetime import date
 import time
-import h5py
 from utils.threading import mainthread
 from models import sequences
 from config import config
@@ -55,23 +52,26 @@ class SequenceController:
             self.current_atom_opt.add(shot, self._handle_sequence_completion)
 
     def _handle_sequence_completion(self, sequence):
+        log_writer = self.app.shot_controller.log_writer
         if isinstance(sequence, sequences.TimeOfFlight):
             self.app.queue(self.display_tof, sequence)
-            with h5py.File(self._output_log_path(), "a") as logfile:
-                lf = logfile.create_group(f"/tof_sequence/{time.strftime('%H:%M:%S')}")
-                lf.attrs['filename'] = str([shot.name for shot in sequence.shots])
-                lf.create_dataset("atom_number", data=sequence.atom_number)
-                lf.create_dataset("time_sequence", data=sequence.t)
-                lf.attrs['average_T(uK)'] = str(sequence.avg_temp)
-                lf.attrs.update(config.logdict)
+            log_writer.write_group(
+                f"/tof_sequence/{time.strftime('%H:%M:%S')}",
+                datasets={"atom_number": sequence.atom_number, "time_sequence": sequence.t},
+                attrs={
+                    'filename': str([shot.name for shot in sequence.shots]),
+                    'average_T(uK)': str(sequence.avg_temp),
+                    **config.logdict,
+                },
+            )
 
         elif isinstance(sequence, sequences.AtomNumberOptimization):
             self.app.queue(self.display_atom_opt, sequence)
-            with h5py.File(self._output_log_path(), "a") as logfile:
-                lf = logfile.create_group(f"/atomnum_sequence/{time.strftime('%H:%M:%S')}")
-                lf.attrs['filename'] = str([shot.name for shot in sequence.shots])
-                lf.create_dataset("atom_number", data=sequence.atom_number)
-                lf.attrs.update(config.logdict)
+            log_writer.write_group(
+                f"/atomnum_sequence/{time.strftime('%H:%M:%S')}",
+                datasets={"atom_number": sequence.atom_number},
+                attrs={'filename': str([shot.name for shot in sequence.shots]), **config.logdict},
+            )
 
     def _get_shot_selection(self, params):
         selection = self.app.shot_presenter.shotlist_selection
@@ -83,10 +83,3 @@ class SequenceController:
             )
             return False
         return selection
-
-    def _output_log_path(self):
-        """Returns the path to the output log file."""
-        output = Path("../Raw Data/").joinpath(str(date.today()))
-        output.mkdir(parents=True, exist_ok=True)
-        return output.joinpath("000_logging.hdf5")
-
@@ -1,18 +1,24 @@
 import logging
+import itertools
+import traceback
 from os import path
 
 from pathlib import Path
 from datetime import date
 from collections import deque
 from threading import Lock
+from concurrent.futures import CancelledError
 
-import h5py
-import time
-from matplotlib.figure import Figure
+import numpy as np
 
 from utils.threading import mainthread
 from config import config
 from models.shots import Shot
+from models.cache import WarmStartCache, FitResultCache
+from worker.pipeline import Pipeline
+from worker.hdf5log import ShotLogWriter
+from worker.fitpool import FitPool
+from worker.render import RenderPool
 
 class ShotController:
     """Processes the image shot."""
@@ -26,66 +32,179 @@ class ShotController:
         self.settings_view = settings_view
 
         # Stores data for past (maxlen) shots
-        self.recent_shots = deque(maxlen=15)
+        self.recent_shots = deque(maxlen=config.shot_history)
         self.current_shot = None
         self.shotlist_selection = ()
         self.recent_shots_lock = Lock()
+        # Arrival order of the shots, displays of older shots are superseded by newer ones
+        self.arrivals = itertools.count()
+        self.log_writer = ShotLogWriter(
+            _output_log_path,
+            batch_size=config.log_batch_size,
+            flush_interval=config.log_flush_interval,
+            compression=config.log_compression,
+        )
+
+        # Fits run in worker processes if enabled, one fit thread waits for each of them
+        self.fit_pool = None
+        workers = dict(config.pipeline_workers)
+        if config.fit_processes:
+            self.fit_pool = FitPool(config.fit_processes)
+            workers.setdefault("fit", config.fit_processes)
+        self.refit_future = None
+        self.warm_start = WarmStartCache()
+        self.fit_cache = None
+        if config.fit_cache_enabled:
+            self.fit_cache = FitResultCache(
+                config.fit_cache_directory, max_bytes=config.fit_cache_max_size
+            )
+
+        # PNG exports are rendered in worker processes, for the shots selected by the policy
+        self.render_pool = RenderPool(
+            config.render_processes,
+            policy=config.render_policy,
+            every=config.render_every,
+            dpi=config.render_dpi,
+            max_pending=config.render_max_pending,
+        )
+
+        # Shots run through ingest -> compute -> fit -> display -> persist, each stage
+        # with its own worker threads and a bounded queue in front of it
+        self.pipeline = Pipeline(
+            [
+                ("ingest", self._ingest_shot),
+                ("compute", self._compute_shot),
+                ("fit", self._fit_shot),
+                ("display", self._display_shot),
+                ("persist", self._persist_shot),
+            ],
+            workers=workers,
+            maxsize=config.pipeline_queue_size,
+            on_error=self._on_pipeline_error,
+        )
+        self.pipeline.start()
     
     ##### Non-GUI methods #####
-    def process_shot(self, name, paths):
-        """Process the shot."""
+    def process_shot(self, name, paths, release=None):
+        """Queue the shot for processing. Blocks while the processing pipeline is saturated.
+        release(paths, failed) is called once the images have been read."""
         logging.info("\n-------------------------------")
         logging.info("1: PROCESSING SHOT %s", name)
-        
-        # Initialize the shot
-        shot = Shot(name, paths)
+        self.pipeline.submit((name, paths, release, next(self.arrivals)))
+
+    def process_frames(self, name, frames):
+        """Queue a shot of (atom, beam, dark) frames that are already in memory, e.g. grabbed
+        by the camera. Blocks while the processing pipeline is saturated."""
+        logging.info("\n-------------------------------")
+        logging.info("1: PROCESSING SHOT %s (in memory)", name)
+        self.pipeline.submit((name, tuple(frames), None, next(self.arrivals)))
+
+    def stop(self):
+        """Finish processing the queued shots, stop the pipeline and close the log file."""
+        self.pipeline.stop(timeout=10)
+        if self.fit_pool:
+            self.fit_pool.shutdown()
+        self.render_pool.shutdown()
+        self.log_writer.close()
+
+    def _ingest_shot(self, job):
+        """Pipeline stage: read the images (or take the in-memory frames) into a new shot."""
+        name, paths, release, arrival = job
+        try:
+            if all(isinstance(frame, np.ndarray) for frame in paths):
+                shot = Shot.from_arrays(name, *paths)
+            else:
+                shot = Shot(name, paths)
+        except Exception:
+            if release:
+                release(paths, failed=True)
+            raise
+        shot.arrival = arrival
+
+        if release:
+            release(paths, failed=False)
+        return shot
+
+    def _compute_shot(self, shot):
+        """Pipeline stage: compute the transmission and display the absorption image."""
+        logging.debug("Processed optical density: %s", shot.optical_density.shape)
+        # A new shot supersedes the pending refit of the previous one
+        self.cancel_refit()
         # Update the current shot
         self.current_shot = shot
         # Update the recent shot list 
         self._update_recent_shots(shot)
         # Update the main controller queue 
         # Display the absorption image
-        self.main_controller.queue(self.display_shot, shot)
+        self.queue_display(shot)
+        return shot
 
+    def _fit_shot(self, shot):
+        """Pipeline stage: fit the shot."""
         if config.fit:
-            shot.run_fit(config)
-            self.main_controller.queue(self.display_shot, shot)  # Display fit overlay
+            self._run_fit(shot)
+        return shot
+
+    def _run_fit(self, shot, key=None):
+        """Fits the shot, in a worker process if the fit pool is enabled. The 2D fit is seeded
+        from the previous shot if warm starts are enabled. Results of unchanged shots and fit
+        settings are restored from the fit cache."""
+        cache_key = None
+        if self.fit_cache is not None:
+            cache_key = self.fit_cache.key(shot, config)
+            results = self.fit_cache.get(cache_key)
+            if results is not None:
+                logging.info("Restoring the fit of shot %s from the fit cache", shot.name)
+                shot.run_fit(config, results=results)
+                return
+
+        seed = self.warm_start.seed(config) if config.fit_warm_start else None
+        if self.fit_pool is None:
+            shot.run_fit(config, seed=seed)
+        else:
+            results = self.fit_pool.submit(shot, config, key=key, seed=seed).result()
+            shot.run_fit(config, results=results)
 
-        # Save to png output
-        figure = Figure(figsize=(8, 5))
-        shot.plot(figure)
-        figure.savefig(_output_path(name), dpi=150)
+        if config.fit_warm_start:
+            self.warm_start.record(config, shot)
+        if cache_key is not None:
+            self.fit_cache.put(cache_key, shot)
 
-        # Saves fit params to log file
-        cmnts = self.settings_view.get_comment()
-        logging.info("Updating logging.csv for shot %s with comment %s " % (name, cmnts))
+    def _display_shot(self, shot):
+        """Pipeline stage: display the fit overlay and add the shot to the running sequences."""
+        if shot.fit:
+            self.queue_display(shot)  # Display fit overlay
 
-        # Checks if log file already exists, if not creates a new one
-        with h5py.File(_output_log_path(name), "a") as logfile:
-            lf = logfile.create_group(str(time.strftime('%H:%M:%S'))) # creates group based on 24hr timestamp
-            lf.create_dataset("atom", data = shot.data)
-            lf.create_dataset("beam", data = shot.beam)
-            lf.create_dataset("dark", data = shot.dark)
-            lf.attrs['filename'] = str(name)
-            lf.attrs['atom_number'] = shot.atom_number
+        # Check if ToF or optimization
+        self.main_controller.sequence_controller.add_shot(shot)
+        return shot
 
-            for label, value in config.logdict.items(): # Appends config snapshot
-                lf.attrs[label] = value
+    def _persist_shot(self, shot):
+        """Pipeline stage: export the png and append the shot to the log file."""
+        name = shot.name
 
-            if config.roi_enabled: # only appends if roi is enabled
-                lf.attrs["roi"] = config.roi
-                lf.attrs['fit_vars'] = shot.fit.best_values
+        # Save to png output, unless the render policy skips the shot
+        idle = not any(self.pipeline.backlog.values())
+        self.render_pool.submit(shot, _output_path(name), config, idle=idle)
 
-            if config.three_roi_enabled: # only appends value if threeroi is enabled
-                lf.attrs['a_b_ratio'] = shot.three_roi_atom_number["a_b_ratio"]
-                lf.attrs["threeroi"] = config.threeroi
+        # Saves fit params to log file
+        cmnts = self.settings_view.get_comment()
+        logging.info("Queueing shot %s for the logging file with comment %s" % (name, cmnts))
 
-            lf.attrs["comments"] = cmnts
+        values = shot.log_values(config)
 
-            logging.info("Logging file updated for shot %s" % name)
+        self.log_writer.append(
+            name,
+            frames=(shot.data, shot.beam, shot.dark),
+            values=values,
+            config_snapshot=config.logdict,
+            comments=cmnts,
+        )
 
-        # Check if ToF or optimization
-        self.main_controller.sequence_controller.add_shot(shot)
+    def _on_pipeline_error(self, stage, item, exc):
+        name = item[0] if isinstance(item, tuple) else item.name
+        logging.error("Processing shot %s failed in stage %s", name, stage)
+        logging.error("".join(traceback.format_exception(type(exc), exc, exc.__traceback__)))
 
     def _update_recent_shots(self, shot):
         """Update the new shot in the recent shots list."""
@@ -97,6 +216,10 @@ class ShotController:
             else:
                 self.recent_shots.append(shot)
 
+    def queue_display(self, shot):
+        """Queue the display of the shot, superseding the pending displays of older shots."""
+        self.main_controller.queue(self.display_shot, shot, key="display_shot", rank=shot.arrival)
+
     ##### GUI methods #####
     @mainthread
     def display_shot(self, shot):
@@ -128,16 +251,35 @@ class ShotController:
     def update_shotlist_selection(self, indexes):
         self.shotlist_selection = tuple(self.recent_shots[idx] for idx in indexes)
 
+    def export_shots(self):
+        """Export the selected shots (or the current shot) as PNG, regardless of the render
+        policy."""
+        for shot in self.shotlist_selection or (self.current_shot,):
+            if shot is not None:
+                self.render_pool.export(shot, _output_path(shot.name), config)
+
     def refit_current_shot(self):
-        self.worker.submit(self.refit_shot, self.current_shot)
+        self.cancel_refit()
+        self.refit_future = self.worker.submit(self.refit_shot, self.current_shot)
+
+    def cancel_refit(self):
+        """Cancel the refit that is waiting for the worker or the fit pool."""
+        if self.refit_future is not None:
+            self.refit_future.cancel()
+        if self.fit_pool:
+            self.fit_pool.cancel("refit")
 
     def refit_shot(self, shot):
         shot.clear_fit()
-        self.main_controller.queue(self.display_shot, shot)
+        self.queue_display(shot)
 
         if config.fit:
-            shot.run_fit(config)
-            self.main_controller.queue(self.display_shot, shot)
+            try:
+                self._run_fit(shot, key="refit")
+            except CancelledError:
+                logging.info("Refit of shot %s superseded", shot.name)
+                return
+            self.queue_display(shot)
 
 def _output_path(name):
     """Move processed images to "Analysis Results" folder by date"""
@@ -145,7 +287,7 @@ def _output_path(name):
     output.mkdir(parents=True, exist_ok=True)
     return output.joinpath(f"{name}.png")
 
-def _output_log_path(name):
+def _output_log_path():
     """Sets the path directory for generating a log file in hdf5 format in the raw data folder"""
     output = Path("../Raw Data/").joinpath(str(date.today()))
     output.mkdir(parents=True, exist_ok=True)
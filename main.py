@@ -65,6 +65,10 @@ class App():
         self.worker.shutdown(wait=False)
         self.file_watcher.stop()
         self.file_watcher.join(3)
+        self.controller.camera_controller.close()
+        if self.controller.shot_feed is not None:
+            self.controller.shot_feed.close()
+        self.controller.shot_controller.stop()
 
     def on_closing(self):
         """Callback for when the GUI is closed."""
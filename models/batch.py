@@ -0,0 +1,193 @@
+"""
+Batches of shots stored as stacked arrays
+"""
+import logging
+
+import numpy as np
+from boltons.cacheutils import cachedproperty
+
+from config import config
+from models.shots import Shot, compute_images, roi_window, atoms_per_od
+from utils.bitmap import read_frame
+from utils.fitting import gaussian_2D_moments
+from utils.integral import summed_area_table, box_sums, box_areas
+
+
+class ShotBatch:
+    """N shots with frames of the same shape, stored as contiguous (N, H, W) arrays. Images,
+    atom numbers, ROI counts and moment estimates are computed for all shots in vectorized
+    passes, and shot() returns Shot objects sharing the frames and images of the batch.
+    Memory grows with N (three float images per shot), so large data sets are processed in
+    batches of a few dozen shots."""
+
+    def __init__(self, names, data, beam, dark, boxes=()):
+        """
+        Args: names: shot names
+            data, beam, dark: (N, H, W) frame arrays
+            boxes: extra (x0, y0, x1, y1) regions the computed window covers in ROI-first mode"""
+        self.names = list(names)
+        self.data, self.beam, self.dark = (
+            np.ascontiguousarray(frames) for frames in (data, beam, dark)
+        )
+        if self.data.ndim != 3 or not self.data.shape == self.beam.shape == self.dark.shape:
+            raise ValueError("Frames must be (N, H, W) arrays of the same shape")
+        if len(self.names) != len(self.data):
+            raise ValueError(f"{len(self.names)} names for {len(self.data)} shots")
+
+        # (x0, y0, x1, y1) of the region the per-pixel images are computed for
+        self.window = roi_window(config, self.width, self.height, boxes)
+
+    @classmethod
+    def from_paths(cls, shots, boxes=()):
+        """Reads the frames of (name, (atom path, beam path, dark path)) shots into a batch."""
+        shots = list(shots)
+        first = read_frame(shots[0][1][0])
+        frames = np.empty((3, len(shots), *first.shape), dtype=first.dtype)
+        for idx, (name, paths) in enumerate(shots):
+            for pos, path in enumerate(paths):
+                frame = first if idx == pos == 0 else read_frame(path)
+                if frame.shape != first.shape:
+                    raise ValueError(f"{path} has shape {frame.shape}, expected {first.shape}")
+                frames[pos, idx] = frame
+
+        logging.info("Read %i shots into a batch", len(shots))
+        return cls([name for name, _ in shots], *frames, boxes=boxes)
+
+    @classmethod
+    def from_shots(cls, shots, boxes=()):
+        """Stacks the frames of the shots into a batch."""
+        return cls(
+            [shot.name for shot in shots],
+            *(
+                np.stack([getattr(shot, key) for shot in shots])
+                for key in ("data", "beam", "dark")
+            ),
+            boxes=boxes,
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def height(self):
+        return self.data.shape[1]
+
+    @property
+    def width(self):
+        return self.data.shape[2]
+
+    @property
+    def origin(self):
+        """(x, y) of the top left pixel of the computed window"""
+        return self.window[0], self.window[1]
+
+    @cachedproperty
+    def absorption_images(self):
+        """Tuple of the (N, h, w) transmission, absorption and optical density stacks of the
+        computed window, smoothed within each shot only."""
+        x0, y0, x1, y1 = self.window
+        frames = (frames[:, y0:y1, x0:x1] for frames in (self.data, self.beam, self.dark))
+        return compute_images(*frames, threshold=Shot.threshold, sigma=(0, 1, 1))
+
+    @property
+    def transmission(self):
+        return self.absorption_images[0]
+
+    @property
+    def absorption(self):
+        return self.absorption_images[1]
+
+    @property
+    def optical_density(self):
+        return self.absorption_images[2]
+
+    @cachedproperty
+    def od_integral(self):
+        """(N, h + 1, w + 1) summed-area tables of the optical density."""
+        return summed_area_table(self.optical_density)
+
+    def atom_numbers(self, roi=None):
+        """Returns the (N,) atom numbers within the ROI, by default within the computed window
+        (the atom number of a shot without a fit)."""
+        if roi is None:
+            return atoms_per_od(config) * np.sum(self.optical_density, axis=(1, 2))
+        return self.roi_counts([roi])[:, 0]
+
+    def roi_counts(self, rois, background=None):
+        """Returns the (N, R) atom numbers within each of the R (x0, y0, x1, y1) ROIs, minus the
+        mean count per pixel of the background ROI if given. ROIs are clipped to the window."""
+        rois = np.asarray(rois, dtype=int).reshape(-1, 4)
+        counts = atoms_per_od(config) * box_sums(self.od_integral, rois, self.origin)
+        if background is not None:
+            counts -= self.roi_background(background)[:, None] * box_areas(rois)
+        return counts
+
+    def roi_background(self, roi):
+        """Returns the (N,) mean atom numbers per pixel within the (x0, y0, x1, y1) ROI."""
+        count = atoms_per_od(config) * box_sums(self.od_integral, roi, self.origin)[:, 0]
+        return count / box_areas(roi)[0]
+
+    def moments(self, cfg=config):
+        """Returns the moments estimates of all shots as a dictionary of (N,) parameter arrays,
+        with the data, ROI, center and stride ShotFitMoments uses for cfg."""
+        options = Shot.fit_options(cfg)
+        images = self.optical_density if options["fit_density"] else self.absorption
+
+        x0, y0, x1, y1 = self.window
+        if options["roi"]:
+            rx0, ry0, rx1, ry1 = options["roi"]
+            x0, y0, x1, y1 = max(x0, rx0), max(y0, ry0), min(x1, rx1), min(y1, ry1)
+        ox, oy = self.origin
+        step = cfg.moments_stride
+        data = images[:, y0 - oy : y1 - oy : step, x0 - ox : x1 - ox : step]
+
+        values = gaussian_2D_moments(
+            data, x0, y0, step, fix_theta=options["fix_theta"], fix_z0=options["fix_z0"]
+        )
+        if options["center"]:
+            x, y = options["center"]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                values["x0"], values["y0"] = np.full(len(self), x), np.full(len(self), y)
+        return values
+
+    def log_values(self, cfg=config, shots=None):
+        """Returns the log table dictionaries of the shots (see Shot.log_values). The atom
+        numbers of unfitted shots and the three-ROI ratios are taken from the batch results,
+        fitted shots (of shots(), in the same order) contribute their fit values."""
+        shots = shots if shots is not None else [None] * len(self)
+        atom_numbers = self.atom_numbers()
+        ratios = None
+        if cfg.three_roi_enabled and cfg.threeroi:
+            roia, roib, roibg = (cfg.threeroi[idx : idx + 4] for idx in (0, 4, 8))
+            counts = self.roi_counts([roia, roib], background=roibg)
+            ratios = (counts[:, 0] - counts[:, 1]) / (counts[:, 0] + counts[:, 1])
+
+        rows = []
+        for idx, shot in enumerate(shots):
+            if shot is not None and shot.fit:
+                values = {"atom_number": shot.atom_number}
+                values.update(shot.fit.best_values)
+            else:
+                values = {"atom_number": atom_numbers[idx]}
+
+            if cfg.roi_enabled:
+                values["roi_enabled"] = True
+                values["roi"] = cfg.roi
+            if ratios is not None:
+                values["three_roi_enabled"] = True
+                values["a_b_ratio"] = ratios[idx]
+                values["threeroi"] = cfg.threeroi
+            rows.append(values)
+        return rows
+
+    def shot(self, idx):
+        """Returns the idx-th shot, sharing the frames and computed images of the batch."""
+        shot = Shot.from_arrays(self.names[idx], self.data[idx], self.beam[idx], self.dark[idx])
+        shot.window = self.window
+        shot.__dict__["absorption_images"] = tuple(
+            images[idx] for images in self.absorption_images
+        )
+        return shot
+
+    def shots(self):
+        return [self.shot(idx) for idx in range(len(self))]
@@ -0,0 +1,263 @@
+"""
+Caches of fit results: warm starts across consecutive shots and an on-disk result cache
+"""
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+def fit_settings(cfg):
+    """Returns a hashable tuple of the config settings the fit results depend on."""
+    settings = (
+        cfg.fit_mode,
+        cfg.fit_2D,
+        cfg.roi if cfg.roi_enabled and cfg.roi else None,
+        cfg.center if cfg.fix_center and cfg.center else None,
+        cfg.fit_optical_density,
+        cfg.fix_theta,
+        cfg.fix_z0,
+        cfg.fit_engine,
+        cfg.fit_stride,
+        cfg.fit_pyramid,
+        cfg.fit_xtol,
+        cfg.fit_max_nfev,
+        cfg.moments_stride,
+        cfg.lut,
+        cfg.precision,
+        # The computed window, which the 1D fits use, depends on the ROIs in ROI-first mode
+        cfg.roi_first and cfg.roi_halo,
+        cfg.roi_first and cfg.three_roi_enabled and cfg.threeroi,
+    )
+    return tuple(tuple(value) if isinstance(value, list) else value for value in settings)
+
+
+class WarmStartCache:
+    """Remembers the converged 2D fit parameters of the last shot of a stream, per ROI and fit
+    configuration, to seed the fit of the next shot. Consecutive shots of the same cloud have
+    nearly identical parameters, so a seeded fit converges in a few evaluations.
+
+    Statistics: hits (seeded fits that converged), misses (no seed for the configuration) and
+    fallbacks (seeds rejected or diverged, refitted from the moments estimate), with the model
+    evaluations of seeded and unseeded fits."""
+
+    # A seed is rejected if the moments estimate moved by more than this many sigmas, or its
+    # widths or amplitude changed by more than this factor
+    max_shift = 0.5
+    max_ratio = 1.5
+    # A seeded fit diverged if its reduced chi-square grew by more than this factor
+    max_redchi_ratio = 4.0
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.nfev = {"hit": 0, "miss": 0, "fallback": 0}
+
+    @staticmethod
+    def key(cfg):
+        """Returns the cache key of the fit configuration."""
+        return fit_settings(cfg)
+
+    def seed(self, cfg):
+        """Returns the {"values", "estimate", "redchi"} seed for the fit configuration, or
+        None."""
+        with self.lock:
+            return self.entries.get(self.key(cfg))
+
+    def record(self, cfg, shot):
+        """Stores the converged 2D fit of the shot as the next seed and counts its outcome."""
+        if shot.fit_2D is None or shot.warm_start is None:
+            return
+
+        result = shot.fit_2D.result
+        with self.lock:
+            self.entries[self.key(cfg)] = {
+                "values": dict(shot.fit_2D.best_values),
+                "estimate": dict(shot.fit_moments.best_values),
+                "redchi": result.redchi,
+            }
+            if shot.warm_start == "hit":
+                self.hits += 1
+            elif shot.warm_start == "miss":
+                self.misses += 1
+            else:
+                self.fallbacks += 1
+            self.nfev[shot.warm_start] += result.nfev
+
+        logging.info(
+            "Warm start %s in %i evaluations: %s", shot.warm_start, result.nfev, self.stats
+        )
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @property
+    def stats(self):
+        """Dictionary of the hit/miss/fallback counts and mean evaluations per outcome."""
+        counts = {"hit": self.hits, "miss": self.misses, "fallback": self.fallbacks}
+        stats = dict(counts)
+        for outcome, count in counts.items():
+            stats[f"{outcome}_nfev"] = self.nfev[outcome] / count if count else None
+        return stats
+
+    @classmethod
+    def accepts(cls, seed, estimate):
+        """Returns False if the moments estimate of the shot jumped away from the one of the
+        seed's shot."""
+        values = seed["estimate"]
+        sigma = max(values["sx"], values["sy"])
+        if abs(estimate["x0"] - values["x0"]) > cls.max_shift * sigma:
+            return False
+        if abs(estimate["y0"] - values["y0"]) > cls.max_shift * sigma:
+            return False
+
+        for key in ("sx", "sy", "A"):
+            if values[key] <= 0 or estimate[key] <= 0:
+                return False
+            ratio = estimate[key] / values[key]
+            if not 1 / cls.max_ratio <= ratio <= cls.max_ratio:
+                return False
+        return True
+
+    @classmethod
+    def converged(cls, seed, result, max_nfev):
+        """Returns False if the seeded fit diverged from the seed's residual."""
+        if result.nfev >= max_nfev:
+            return False
+        return result.redchi <= cls.max_redchi_ratio * seed["redchi"]
+
+
+class FitResultCache:
+    """On-disk cache of the fit results of shots (see Shot.fit_results), addressed by a hash of
+    the raw frames and of the fit settings, so refits and reanalysis of unchanged shots don't
+    rerun the fits. Each entry also stores the best values, covariance and fit report. The
+    least recently used entries are evicted once the cache exceeds max_bytes. The total size is
+    kept as a running count, the directory is only scanned once and when it grows too large."""
+
+    suffix = ".pkl"
+
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Total bytes of the entries, scanned on the first put
+        self.size = None
+
+    @staticmethod
+    def key(shot, cfg):
+        """Returns the hex digest of the shot's frames and the fit settings."""
+        digest = hashlib.blake2b(digest_size=20)
+        for frame in (shot.data, shot.beam, shot.dark):
+            frame = np.ascontiguousarray(frame)
+            digest.update(repr((frame.shape, frame.dtype.str)).encode())
+            digest.update(frame.data)
+        digest.update(repr(fit_settings(cfg)).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached fit results, or None."""
+        path = self.directory / f"{key}{self.suffix}"
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            entry = None
+        except Exception:
+            logging.exception("Dropping unreadable fit cache entry %s", path.name)
+            self._remove(path)
+            entry = None
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry and entry["results"]
+
+    def put(self, key, shot):
+        """Stores the fit results of the shot."""
+        results = shot.fit_results()
+        entry = {
+            "name": shot.name,
+            "results": results,
+            "best_values": shot.fit.best_values if shot.fit else None,
+            "covar": getattr(shot.fit.result, "covar", None) if shot.fit else None,
+            "report": "\n".join(_fit_reports(results)),
+        }
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        entry_size = os.path.getsize(f.name)
+
+        path = self.directory / f"{key}{self.suffix}"
+        with self.lock:
+            if self.size is None:
+                self.size = sum(entry[1] for entry in self._entries())
+            self.size -= _file_size(path)  # replaced entry
+            os.replace(f.name, path)
+            self.size += entry_size
+            full = self.size > self.max_bytes
+        if full:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        with self.lock:
+            # Rescanning also picks up the entries of other processes sharing the directory
+            entries = self._entries()
+            size = sum(entry[1] for entry in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                size -= entry_size
+            self.size = size
+
+    def _entries(self):
+        """Returns the (modification time, size, path) of the entries."""
+        entries = []
+        for path in self.directory.glob(f"*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        with self.lock:
+            size = _file_size(path)
+            path.unlink(missing_ok=True)
+            if self.size is not None:
+                self.size -= size
+
+    @property
+    def stats(self):
+        return {"hit": self.hits, "miss": self.misses}
+
+
+def _file_size(path):
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _fit_reports(results):
+    for key, result in results.items():
+        for part in result if isinstance(result, tuple) else (result,):
+            if hasattr(part, "fit_report"):
+                yield f"[[{key}]]\n{part.fit_report()}"
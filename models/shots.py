@@ -1,11 +1,12 @@
 """Shot-related objects (holds raw and calculated image data for a shot)"""
+import copy
 import logging
 import functools
+import threading
 
 from abc import ABC, abstractmethod
 from typing import Tuple, Optional
 
-import imageio
 import numpy as np
 import matplotlib.colors as colors
 import matplotlib.gridspec as gridspec
@@ -19,32 +20,146 @@ from lmfit import Model
 from lmfit.models import GaussianModel
 
 from config import config
-from utils.fitting import ravel, gaussian_2D
+from utils.fitting import (
+    ravel,
+    block_mean,
+    gaussian_2D,
+    gaussian_2D_moments,
+    grid_coordinates,
+    Gaussian2DFitter,
+    Gaussian2DResult,
+)
+from models.cache import WarmStartCache
 from utils.geometry import clipped_endpoints
+from utils.bitmap import read_frame
+from utils.imaging import absorption_images, absorption_images_lut
+from utils.integral import summed_area_table, box_sums, box_areas
+
+# Mahalanobis bound of the sigma mask
+SIGMA_MASK_BOUND = chi2.ppf(0.886, df=2)
+
+
+def derived(func):
+    """Property that is computed once per config version and shot version (i.e. until the
+    config changes, the shot is refitted or its window grows)."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def getter(self):
+        shot = getattr(self, "shot", self)
+        key = (config.version, shot.version)
+        memo = self.__dict__.setdefault("_derived", {})
+        if name in memo and memo[name][0] == key:
+            return memo[name][1]
+
+        value = func(self)
+        memo[name] = (key, value)
+        return value
+
+    return property(getter)
+
+
+def compute_images(data, beam, dark, threshold, sigma=1):
+    """Returns the (transmission, absorption, optical density) images of the frames at the
+    configured precision, with the lookup tables for 8-bit frames if enabled."""
+    frames = (data, beam, dark)
+    options = {"threshold": threshold, "sigma": sigma, "dtype": config.precision}
+    if not (config.lut and all(frame.dtype == np.uint8 for frame in frames)):
+        return absorption_images(*frames, **options)
+
+    images = absorption_images_lut(*frames, **options)
+    if config.lut_validate:
+        reference = absorption_images(*frames, **options)
+        logging.info(
+            "LUT max. deviation - transmission: %.3g, absorption: %.3g, OD: %.3g",
+            *(np.max(np.abs(img - ref)) for img, ref in zip(images, reference)),
+        )
+    return images
+
+
+def roi_window(cfg, width, height, boxes=()):
+    """Returns the (x0, y0, x1, y1) window to compute the images of a width x height frame for.
+    In ROI-first mode this is the bounding box of the enabled ROIs (and of the extra boxes) plus
+    a halo for the smoothing filters, otherwise the full frame."""
+    frame = (0, 0, width, height)
+    if not cfg.roi_first:
+        return frame
+
+    boxes = [tuple(int(value) for value in box) for box in boxes]
+    if cfg.roi_enabled and cfg.roi:
+        boxes.append(cfg.roi)
+    if cfg.three_roi_enabled and cfg.threeroi:
+        boxes.extend(cfg.threeroi[idx : idx + 4] for idx in (0, 4, 8))
+    if not boxes:
+        return frame
+
+    halo = cfg.roi_halo
+    x0, y0 = (max(0, min(box[i] for box in boxes) - halo) for i in (0, 1))
+    x1 = min(width, max(box[2] for box in boxes) + halo)
+    y1 = min(height, max(box[3] for box in boxes) + halo)
+    return x0, y0, x1, y1
+
+
+def _covers(window, box):
+    """Whether the (x0, y0, x1, y1) window contains the box"""
+    return (
+        window[0] <= box[0] and window[1] <= box[1] and window[2] >= box[2] and window[3] >= box[3]
+    )
+
+
+def atoms_per_od(cfg):
+    """Number of atoms per pixel and unit of optical density."""
+    # light and camera parameters
+    sigma_0 = (3 / (2 * np.pi)) * np.square(cfg.wavelength)  # cross-section
+    sigma = sigma_0 * np.reciprocal(
+        1 + np.square(cfg.detuning / (cfg.linewidth / 2))
+    )  # off resonance
+    area = np.square(cfg.physical_scale * 1e-3)  # pixel area in SI units
+    return area / sigma
 
 
 class Shot:
     """A single shot (3 bmp) sequence"""
 
+    # If the light data is below some threshold, we assume that any
+    # atom data at this location is invalid and treat as if no transmission.
+    # The threshold value was selected experimentally
+    threshold = 7
+
     def __init__(self, name, bmp_paths):
         logging.info("Reading image data into arrays")
-        bmps = []
-        for path in bmp_paths:
-            bmp = imageio.imread(path, mode="L")
-            bmp = bmp.astype("int16")  # prevent underflow
-            bmps.append(bmp)
-
-        self.data = bmps[0]
-        self.beam = bmps[1]
-        self.dark = bmps[2]
+        # Frames are kept as uint8, differences are computed in int16 to prevent underflow
+        bmps = [read_frame(path) for path in bmp_paths]
+        self._load(name, *bmps)
+
+    @classmethod
+    def from_arrays(cls, name, data, beam, dark):
+        """Returns a shot of (atom, beam, dark) frames that are already in memory."""
+        shot = cls.__new__(cls)
+        shot._load(name, data, beam, dark)
+        return shot
+
+    def _load(self, name, data, beam, dark):
+        self.data = data
+        self.beam = beam
+        self.dark = dark
         self.shape = self.data.shape
         self.name = name
+        # Index of the shot in the processing stream, set by the shot controller
+        self.arrival = None
+
+        # (x0, y0, x1, y1) of the region the per-pixel images are computed for. It only grows,
+        # the lock keeps it consistent with the images while it grows
+        self.window = self.compute_window(config)
+        self.lock = threading.RLock()
 
         self.fit_2D = None
         self.fit_1D = None
-
-        # Warm transmission cache and log shape to debug
-        logging.debug("Processed transmission: %s", self.transmission.shape)
+        self.fit_moments = None
+        # Outcome of the warm start of the 2D fit: "hit", "miss" (no seed) or "fallback"
+        self.warm_start = None
+        # Incremented when the fits or the window change, invalidates the derived properties
+        self.version = 0
 
     def __eq__(self, other):
         return self.name == other.name and np.array_equal(
@@ -61,62 +176,194 @@ class Shot:
         """Pixel width of each BMP"""
         return self.shape[1]
 
+    @property
+    def origin(self):
+        """(x, y) of the top left pixel of the computed window"""
+        return self.window[0], self.window[1]
+
     @property
     def meshgrid(self):
-        """Returns a meshgrid with the shot dimensions. The meshgrid is an (x, y) tuple of
-        numpy matrices whose pairs reference every coordinate in the image."""
-        y, x = np.mgrid[0 : self.height, 0 : self.width]
+        """Returns a meshgrid with the computed window dimensions. The meshgrid is an (x, y) tuple
+        of numpy matrices whose pairs reference every coordinate in the window (in full frame
+        coordinates)."""
+        x0, y0, x1, y1 = self.window
+        y, x = np.mgrid[y0:y1, x0:x1]
         return x, y
 
-    @cachedproperty
+    def compute_window(self, cfg, boxes=()):
+        """Returns the (x0, y0, x1, y1) window to compute the images for (see roi_window)."""
+        return roi_window(cfg, self.width, self.height, boxes)
+
+    def ensure_window(self, cfg, boxes=()):
+        """Grows the computed window to cover the enabled ROIs of cfg and the extra boxes,
+        recomputing the images if it changes. Only growing it takes the lock."""
+        wanted = self.compute_window(cfg, boxes)
+        if _covers(self.window, wanted):
+            return
+
+        with self.lock:
+            if not _covers(self.window, wanted):
+                self.window = tuple(min(a, b) for a, b in zip(wanted[:2], self.window[:2])) + (
+                    tuple(max(a, b) for a, b in zip(wanted[2:], self.window[2:]))
+                )
+                self.__dict__.pop("absorption_images", None)
+                self.version += 1
+
+    def crop(self, image, roi):
+        """Returns the (x0, y0, x1, y1) region in full frame coordinates of a window image."""
+        x0, y0, x1, y1 = roi
+        ox, oy = self.origin
+        return image[max(0, y0 - oy) : max(0, y1 - oy), max(0, x0 - ox) : max(0, x1 - ox)]
+
+    @property
+    def absorption_images(self):
+        """Tuple of the (transmission, absorption, optical density) images, computed in one pass
+        at the configured precision and cached until the window grows."""
+        images = self.__dict__.get("absorption_images")
+        if images is not None:
+            return images
+
+        with self.lock:
+            images = self.__dict__.get("absorption_images")
+            if images is None:
+                logging.info("Performing background subtraction")
+                x0, y0, x1, y1 = self.window
+                frames = (self.data, self.beam, self.dark)
+                images = self.__dict__["absorption_images"] = compute_images(
+                    *(frame[y0:y1, x0:x1] for frame in frames), threshold=self.threshold
+                )
+        return images
+
+    @property
     def transmission(self):
         """Returns the beam and dark-field compensated transmission image. Dark-field is subtracted
         from both the atom image and the beam image, and the atom image is divided by the beam
         image, giving the transmission t^2. The values should optimally lie in the range of [0, 1]
         but can realistically be in the range of [-0.1, 1.5] due to noise and beam variation across
         images."""
-        logging.info("Performing background subtraction")
-        atoms = np.subtract(self.data, self.dark)
-        light = np.subtract(self.beam, self.dark)
-
-        # If the light data is below some threshold, we assume that any
-        # atom data at this location is invalid and treat as if no transmission.
-        # The threshold value was selected experimentally
-        threshold = 7
-        transmission = np.divide(atoms, light, where=light > threshold)
-        transmission[light <= threshold] = 1
-        np.clip(transmission, a_min=0, a_max=1, out=transmission)
-
-        return transmission
+        return self.absorption_images[0]
 
     @property
     def absorption(self):
         """Raw absorption data"""
-        return 1 - self.transmission
+        return self.absorption_images[1]
 
-    @cachedproperty
+    @property
     def optical_density(self):
-        smoothed_transmission = gaussian_filter(self.transmission, sigma=1)
-        od = -np.log(smoothed_transmission, where=smoothed_transmission > 0)
-        return od
+        return self.absorption_images[2]
 
     @property
     def fit(self):
         # if self.fit_2D is None:
         #     return self.fit_1D
+        if self.fit_2D is None:
+            return self.fit_moments
         return self.fit_2D
 
-    def run_fit(self, cfg):
+    def run_fit(self, cfg, results=None, seed=None):
+        """Fits the shot as set by the config. If results (see fit_results) are given, e.g. from
+        a fit in another process, the fits are restored from them instead of being run. The fits
+        run on a snapshot of the shot, as the window may grow in another thread meanwhile.
+        seed: WarmStartCache seed of the 2D fit"""
         self.clear_fit()
-
-        if cfg.fit_2D:
-            return self.run_fit_2D(cfg)
+        self.ensure_window(cfg)
+        view = self.snapshot()
+
+        results = results or {}
+        if cfg.fit_mode == "moments":
+            fit = view.run_fit_moments(cfg, result=results.get("fit_moments"))
+        elif cfg.fit_2D:
+            view.warm_start = results.get("warm_start")
+            fit = view.run_fit_2D(
+                cfg,
+                result=results.get("fit_2D"),
+                guess_result=results.get("fit_moments"),
+                seed=seed,
+            )
+        else:
+            fit = view.run_fit_1D_summed(cfg, result=results.get("fit_1D"))
+
+        for key in ("fit_moments", "fit_2D", "fit_1D"):
+            shot_fit = getattr(view, key)
+            if shot_fit is not None:
+                shot_fit.shot = self
+            setattr(self, key, shot_fit)
+        self.warm_start = view.warm_start
+        self.version += 1
+        return fit
+
+    def snapshot(self):
+        """Returns a copy of the shot sharing its frames, with the current window and the images
+        computed for it. Unlike the shot, the copy doesn't change when the window grows."""
+        with self.lock:
+            images = self.absorption_images
+            view = copy.copy(self)
+        view.__dict__["absorption_images"] = images
+        view._derived = {}
+        return view
+
+    def fit_results(self):
+        """Returns a picklable dictionary of the results of the fits that were run."""
+        results = {}
+        for key in ("fit_moments", "fit_2D", "fit_1D"):
+            shot_fit = getattr(self, key)
+            if shot_fit is None:
+                continue
+            result = shot_fit.result
+            if key == "fit_2D" and not isinstance(result, Gaussian2DResult):
+                result = Gaussian2DResult.from_model_result(result)
+            results[key] = result
+        results["warm_start"] = self.warm_start
+        return results
+
+    def run_fit_2D(self, cfg, result=None, guess_result=None, seed=None):
+        """Fits the 2D Gaussian starting from the moments estimate, or from the seed of a
+        previous shot if the estimate didn't jump away from it. A seeded fit that diverges is
+        rerun from the moments estimate, or from the peak if the estimate found no cloud."""
+        self.run_fit_moments(cfg, result=guess_result)
+        options = dict(
+            self.fit_options(cfg),
+            engine=cfg.fit_engine,
+            stride=cfg.fit_stride,
+            pyramid=cfg.fit_pyramid,
+            xtol=cfg.fit_xtol,
+            max_nfev=cfg.fit_max_nfev,
+        )
+        if result is not None:
+            self.fit_2D = ShotFit2D(self, **options, result=result)
+            return self.fit_2D
+
+        if seed is None:
+            self.warm_start = "miss"
+        elif not WarmStartCache.accepts(seed, self.fit_moments.best_values):
+            self.warm_start = "fallback"
         else:
-            return self.run_fit_1D_summed(cfg)
+            # Shots jitter in position and atom number, while the shape of the cloud and the
+            # offset are stable: those are taken from the seed
+            guess = dict(seed["values"])
+            guess.update({key: self.fit_moments.best_values[key] for key in ("A", "x0", "y0")})
+            self.fit_2D = ShotFit2D(self, **options, guess=guess, warm=True)
+            if WarmStartCache.converged(seed, self.fit_2D.result, cfg.fit_max_nfev):
+                self.warm_start = "hit"
+                return self.fit_2D
+            logging.info("Warm-started fit diverged, refitting from the moments estimate")
+            self.warm_start = "fallback"
+
+        # Without a cloud in the estimate (A = 0 at the center), the fit starts from the peak
+        estimate = self.fit_moments.best_values
+        guess = estimate if estimate["A"] > 0 else None
+        self.fit_2D = ShotFit2D(self, **options, guess=guess)
+        return self.fit_2D
 
-    def run_fit_2D(self, cfg):
-        self.run_fit_1D_summed(cfg)
+    def run_fit_moments(self, cfg, result=None):
+        self.fit_moments = ShotFitMoments(
+            self, **self.fit_options(cfg), result=result, step=cfg.moments_stride
+        )
+        return self.fit_moments
 
+    @staticmethod
+    def fit_options(cfg):
+        """Returns the ShotFit keyword arguments set by the config."""
         roi = None
         if cfg.roi_enabled and cfg.roi:
             roi = cfg.roi
@@ -125,25 +372,25 @@ class Shot:
         if cfg.fix_center and cfg.center:
             center = cfg.center
 
-        self.fit_2D = ShotFit2D(
-            self,
-            fit_density=cfg.fit_optical_density,
-            roi=roi,
-            center=center,
-            fix_theta=cfg.fix_theta,
-            fix_z0=cfg.fix_z0,
-            guess=self.fit_1D.best_values,
-        )
-        return self.fit_2D
-
-    def run_fit_1D_summed(self, cfg):
-        self.fit_1D = ShotFit1DSummed(self, fit_density=cfg.fit_optical_density)
+        return {
+            "fit_density": cfg.fit_optical_density,
+            "roi": roi,
+            "center": center,
+            "fix_theta": cfg.fix_theta,
+            "fix_z0": cfg.fix_z0,
+        }
+
+    def run_fit_1D_summed(self, cfg, result=None):
+        self.fit_1D = ShotFit1DSummed(self, fit_density=cfg.fit_optical_density, result=result)
         return self.fit_1D
 
     def clear_fit(self):
         self.fit_2D = None
         self.fit_1D = None
-        
+        self.fit_moments = None
+        self.warm_start = None
+        self.version += 1
+
     @property
     def atom_density(self):
         pass
@@ -159,27 +406,54 @@ class Shot:
    
     # In this script, optical density is equal to the optical depth 
     @property
+    def atoms_per_od(self):
+        """Number of atoms per pixel and unit of optical density."""
+        return atoms_per_od(config)
+
+    @derived
+    def od_integral(self):
+        """(origin, summed-area table) of the optical density over the computed window. The
+        origin is read with the images, as the window may grow in another thread."""
+        with self.lock:
+            origin, density = self.origin, self.optical_density
+        return origin, summed_area_table(density)
+
+    def roi_counts(self, rois, background=None):
+        """Returns the atom numbers within each (x0, y0, x1, y1) ROI, in constant time per ROI.
+        Args: rois: (N, 4) array-like of ROIs in full frame coordinates
+            background: optional ROI whose mean count per pixel is subtracted from the ROIs
+        The window is grown to cover the ROIs in ROI-first mode."""
+        rois = np.asarray(rois, dtype=int).reshape(-1, 4)
+        boxes = rois if background is None else np.vstack([rois, background])
+        self.ensure_window(config, boxes)
+        origin, table = self.od_integral
+        counts = self.atoms_per_od * box_sums(table, rois, origin)
+        if background is not None:
+            counts -= self.roi_background(background) * box_areas(rois)
+        return counts
+
+    def roi_background(self, roi):
+        """Returns the mean atom number per pixel within the (x0, y0, x1, y1) ROI."""
+        self.ensure_window(config, [roi])
+        origin, table = self.od_integral
+        count = self.atoms_per_od * box_sums(table, roi, origin)[0]
+        return count / box_areas(roi)[0]
+
+    @derived
     def atom_number(self):
         """Calculates the total atom number from the transmission ROI values."""
-        # light and camera parameters
-        sigma_0 = (3 / (2 * np.pi)) * np.square(config.wavelength)  # cross-section
-        
-        sigma = sigma_0 * np.reciprocal(
-            1 + np.square(config.detuning / (config.linewidth / 2))
-        )  # off resonance
-        area = np.square(config.physical_scale * 1e-3)  # pixel area in SI units
+        atoms_per_od = self.atoms_per_od
 
         density = self.optical_density
         scale = 1
         if self.fit:
             if self.fit.roi:
-                x0, y0, x1, y1 = self.fit.roi
-                density = density[x0:x1, y0:y1]
+                density = self.crop(density, self.fit.roi)
             else:
                 density = density[self.fit.sigma_mask]
                 scale = 0.866
 
-        return (area / sigma) * np.sum(density) / scale  # Divide by 1.5-sigma area
+        return atoms_per_od * np.sum(density) / scale  # Divide by 1.5-sigma area
     
     @property
     def saturated_od(self):
@@ -192,7 +466,7 @@ class Shot:
 
         saturated_od = np.log(1 + (n * sigma) / (config.physical_scale * 1e-3) ** 2)
 
-    @property
+    @derived
     def three_roi_atom_number(self):
         """Calculates the atom number within each of the 3 ROIs (A, B and background(BG)) and ratio of A and B from the transmission values.
         Outputs a dict that contains
@@ -201,21 +475,10 @@ class Shot:
         background count per pixel in ROI BG: roic_count
         """
         if config.three_roi_enabled and config.threeroi:
-            # light and camera parameters
-            sigma_0 = (3 / (2 * np.pi)) * np.square(config.wavelength)  # cross-section
-            sigma = sigma_0 * np.reciprocal(
-                1 + np.square(config.detuning / (config.linewidth / 2))
-            )  # off resonance
-            area = np.square(config.physical_scale * 1e-3)  # pixel area in SI units
-
-            density = self.optical_density
-            scale = 1
+            roia, roib, roibg = (config.threeroi[idx : idx + 4] for idx in (0, 4, 8))
 
-            x0, y0, x1, y1, x2, y2, x3, y3, x4, y4, x5, y5 = config.threeroi # gets roi from config file
-
-            roibg_count = ((area/sigma) * np.sum(density[x4:x5, y4:y5]) / scale )/((x5 - x4) * (y5 - y4)) # averaged bg count per pixel
-            roia_count = (area/sigma) * np.sum(density[x0:x1, y0:y1]) / scale - roibg_count * (x1 - x0) * (y1 - y0)
-            roib_count = (area/sigma) * np.sum(density[x2:x3, y2:y3]) / scale - roibg_count * (x3 - x2) * (y3 - y2)
+            roia_count, roib_count = self.roi_counts([roia, roib], background=roibg)
+            roibg_count = self.roi_background(roibg)  # averaged bg count per pixel
 
             a_b_ratio = (roia_count - roib_count)/(roia_count + roib_count)
 
@@ -229,95 +492,248 @@ class Shot:
         else:
             pass
 
-    def plot(self, fig, *args, **kwargs):
-        fig.clf()
-
-        if config.fit_optical_density:
+    def log_values(self, cfg):
+        """Returns the dictionary of the columns of the shot in the HDF5 log table."""
+        values = {"atom_number": self.atom_number}
+        if self.fit:
+            values.update(self.fit.best_values)
+
+        if cfg.roi_enabled:  # only appends if roi is enabled
+            values["roi_enabled"] = True
+            values["roi"] = cfg.roi
+
+        if cfg.three_roi_enabled:  # only appends value if threeroi is enabled
+            values["three_roi_enabled"] = True
+            values["a_b_ratio"] = self.three_roi_atom_number["a_b_ratio"]
+            values["threeroi"] = cfg.threeroi
+        return values
+
+    def plot_data(self, cfg):
+        """Returns a dictionary of what the shot figure shows: the image with its norm, extent
+        and window, the (box, color) ROIs and, with a fit, its slice lines, horizontal and
+        vertical (index, data, model) profiles and best values."""
+        if cfg.fit_optical_density:
             nmax = 6.0
             img = self.optical_density
         else:
             nmax = 1.0
             img = self.absorption
 
-        norm = (-0.1, nmax)
-        color_norm = colors.Normalize(*norm)
+        wx0, wy0, wx1, wy1 = self.window
+        data = {
+            "image": img,
+            "norm": (-0.1, nmax),
+            "extent": (wx0 - 0.5, wx1 - 0.5, wy1 - 0.5, wy0 - 0.5),
+            "window": self.window,
+            "rois": [],
+            "fit": None,
+        }
 
-        ratio = [1, 9]
-        gs = gridspec.GridSpec(2, 2, width_ratios=ratio, height_ratios=ratio)
-
-        image = fig.add_subplot(gs[1, 1])
-        im = image.imshow(img, cmap=config.colormap, norm=color_norm)
-        fig.colorbar(im, ax=image, fraction=0.046, pad=0.04)
-        if config.roi_enabled and config.roi:
-            x0, y0, x1, y1 = config.roi
-            roi = patches.Rectangle(
-                (x0, y0), x1 - x0, y1 - y0, linewidth=1, edgecolor="r", facecolor="none"
-            )
-            image.add_patch(roi)
+        if cfg.roi_enabled and cfg.roi:
+            data["rois"].append((cfg.roi, "r"))
 
-        if config.three_roi_enabled and config.threeroi:
-            x0, y0, x1, y1, x2, y2, x3, y3, x4, y4, x5, y5 = config.threeroi
-            roia = patches.Rectangle(
-                (x0, y0), x1 - x0, y1 - y0, linewidth=1, edgecolor="r", facecolor="none"
-            )
-            image.add_patch(roia)
-            roib = patches.Rectangle(
-                (x2, y2), x3 - x2, y3 - y2, linewidth=1, edgecolor="b", facecolor="none"
-            )
-            image.add_patch(roib)
-            roic = patches.Rectangle(
-                (x4, y4), x5 - x4, y5 - y4, linewidth=1, edgecolor="g", facecolor="none"
-            )
-            image.add_patch(roic)
+        if cfg.three_roi_enabled and cfg.threeroi:
+            for idx, color in zip((0, 4, 8), "rbg"):
+                data["rois"].append((cfg.threeroi[idx : idx + 4], color))
 
         if self.fit:
-            x, y = self.meshgrid
             (xs_h, ys_h, z_h), (xs_v, ys_v, z_v) = self.fit.best_fit_lines
+            data["fit"] = {
+                "slices": self.fit.slice_coordinates,
+                "horizontal": (np.arange(z_h.shape[0]), z_h, self.fit.eval(x=xs_h, y=ys_h)),
+                "vertical": (np.arange(z_v.shape[0]), z_v, self.fit.eval(x=xs_v, y=ys_v)),
+                "best_values": dict(self.fit.best_values),
+            }
+        return data
 
-            image.plot(*self.fit.slice_coordinates[0], "-", linewidth=0.3)
-            image.plot(*self.fit.slice_coordinates[1], "-", linewidth=0.3)
-
-            # These plots are already clipped, but this gets rid of the extra padding
-            image.set_xlim([0, self.width])
-            image.set_ylim([self.height, 0])
-
-            h_x = np.arange(z_h.shape[0])
-            h_y = self.fit.eval(x=xs_h, y=ys_h)
-            v_y = np.arange(z_v.shape[0])
-            v_x = self.fit.eval(x=xs_v, y=ys_v)
-
-            hor = fig.add_subplot(gs[0, 1])
-            hor.plot(h_x, z_h, "ko", markersize=0.2)
-            hor.plot(h_x, h_y, "r", linewidth=0.5)
-            hor.set_ylim(*norm)
-            hor.get_xaxis().set_visible(False)
-
-            ver = fig.add_subplot(gs[1, 0])
-            ver.plot(z_v, v_y, "ko", markersize=0.2)
-            ver.plot(v_x, v_y, "r", linewidth=0.5)
-            ver.set_xlim(*norm)
-            ver.invert_xaxis()
-            ver.invert_yaxis()
-            ver.get_yaxis().set_visible(False)
-
-            try:
-                image.contour(
-                    self.fit.eval(x=x, y=y).reshape(self.shape),
-                    levels=self.fit.contour_levels,
-                    cmap=config.colormap,
-                    linewidths=1,
-                    norm=color_norm,
-                )
-            except ValueError as err:
-                logging.error(
-                    "Plotting contour levels failed: %s. Likely because no clear gaussian",
-                    self.fit.contour_levels,
-                )
-                logging.error(err)
-
+    def plot(self, fig, *args, **kwargs):
+        ShotPlot(fig).update(self, config)
         return fig
 
 
+class ShotPlot:
+    """Figure of a shot whose axes and artists are created once and then updated in place with
+    the data of each shot. The layout is only rebuilt when the norm, extent, colormap or the
+    presence of a fit change, and the fit contour is only recomputed when the fit parameters
+    change. Animated artists are left out of regular draws, so that they can be blitted onto
+    the static background of the figure (see viewer.plots.MplFigure)."""
+
+    # Pixel step of the grid the contour of the fit is evaluated on
+    contour_step = 4
+
+    def __init__(self, fig, animated=False):
+        self.fig = fig
+        self.animated = animated
+        self.reset()
+
+    def reset(self):
+        """Forget the artists, e.g. after the figure was cleared for another plot."""
+        self.layout = None
+        self.image = None
+        self.rois = []
+        self.fit_lines = []
+        self.contour = None
+        self.contour_key = None
+
+    @property
+    def artists(self):
+        """The artists that change from shot to shot."""
+        artists = [self.image, *self.rois, *self.fit_lines, self.contour]
+        return [artist for artist in artists if artist is not None]
+
+    def update(self, shot, cfg):
+        """Show the shot. Returns True if the layout was rebuilt, which requires a full draw."""
+        return self.show(shot.plot_data(cfg), cfg.colormap)
+
+    def show(self, data, cmap):
+        """Show the plot data of a shot (see Shot.plot_data), e.g. in a process without the
+        shot. Returns True if the layout was rebuilt."""
+        layout = (data["norm"], data["extent"], cmap, data["fit"] is not None)
+        rebuilt = layout != self.layout
+        if rebuilt:
+            self._build(data, cmap)
+            self.layout = layout
+
+        self.image.set_data(self._reduce(data["image"]))
+        self._update_rois(data["rois"])
+        if data["fit"]:
+            self._update_fit(data, cmap)
+        return rebuilt
+
+    def _build(self, data, cmap):
+        self.fig.clf()
+        self.reset()
+
+        ratio = [1, 9]
+        gs = gridspec.GridSpec(2, 2, width_ratios=ratio, height_ratios=ratio)
+        norm = data["norm"]
+
+        self.axes = self.fig.add_subplot(gs[1, 1])
+        self.image = self.axes.imshow(
+            data["image"],
+            cmap=cmap,
+            norm=colors.Normalize(*norm),
+            extent=data["extent"],
+            animated=self.animated,
+        )
+        self.fig.colorbar(self.image, ax=self.axes, fraction=0.046, pad=0.04)
+
+        # Animated plots show the image block-averaged to about the screen resolution, which
+        # is much cheaper to draw than resampling the full frame on every shot
+        self.block = 1
+        if self.animated:
+            height, width = data["image"].shape
+            self.axes.apply_aspect()
+            self.block = max(1, int(width / self.axes.get_window_extent().width))
+        if self.block > 1:
+            rows, cols = height // self.block, width // self.block
+            left, _, _, top = data["extent"]
+            self.image.set_extent(
+                (left, left + cols * self.block, top + rows * self.block, top)
+            )
+            self.image.set_interpolation("nearest")
+
+        if data["fit"]:
+            wx0, wy0, wx1, wy1 = data["window"]
+            slices = [
+                self.axes.plot([], [], "-", linewidth=0.3, animated=self.animated)[0]
+                for _ in range(2)
+            ]
+            # Gets rid of the padding around the image
+            self.axes.set_xlim([wx0, wx1])
+            self.axes.set_ylim([wy1, wy0])
+
+            self.hor = self.fig.add_subplot(gs[0, 1])
+            hor_data = self.hor.plot([], [], "ko", markersize=0.2, animated=self.animated)[0]
+            hor_model = self.hor.plot([], [], "r", linewidth=0.5, animated=self.animated)[0]
+            self.hor.set_ylim(*norm)
+            self.hor.get_xaxis().set_visible(False)
+
+            self.ver = self.fig.add_subplot(gs[1, 0])
+            ver_data = self.ver.plot([], [], "ko", markersize=0.2, animated=self.animated)[0]
+            ver_model = self.ver.plot([], [], "r", linewidth=0.5, animated=self.animated)[0]
+            self.ver.set_xlim(norm[1], norm[0])
+            self.ver.get_yaxis().set_visible(False)
+
+            self.fit_lines = [*slices, hor_data, hor_model, ver_data, ver_model]
+
+    def _reduce(self, image):
+        if self.block > 1:
+            return block_mean(image, self.block)
+        return image
+
+    def _update_rois(self, rois):
+        for patch in self.rois:
+            patch.remove()
+        self.rois = []
+        for (x0, y0, x1, y1), color in rois:
+            patch = patches.Rectangle(
+                (x0, y0),
+                x1 - x0,
+                y1 - y0,
+                linewidth=1,
+                edgecolor=color,
+                facecolor="none",
+                animated=self.animated,
+            )
+            self.axes.add_patch(patch)
+            self.rois.append(patch)
+
+    def _update_fit(self, data, cmap):
+        fit = data["fit"]
+        for line, coordinates in zip(self.fit_lines[:2], fit["slices"]):
+            line.set_data(*coordinates)
+
+        # The axes of the profiles along the lines are hidden, so their limits follow the data
+        hor_data, hor_model, ver_data, ver_model = self.fit_lines[2:]
+        idx, values, model = fit["horizontal"]
+        hor_data.set_data(idx, values)
+        hor_model.set_data(idx, model)
+        self.hor.set_xlim(0, max(len(idx) - 1, 1))
+
+        idx, values, model = fit["vertical"]
+        ver_data.set_data(values, idx)
+        ver_model.set_data(model, idx)
+        self.ver.set_ylim(max(len(idx) - 1, 1), 0)
+
+        key = (tuple(fit["best_values"].items()), data["window"])
+        if key != self.contour_key:
+            self.contour_key = key
+            self._update_contour(data, cmap)
+
+    def _update_contour(self, data, cmap):
+        if self.contour is not None:
+            self.contour.remove()
+            self.contour = None
+
+        # The shot fits are 2D Gaussians, drawn at their 1.5, 1 and 0.5-sigma levels
+        values = data["fit"]["best_values"]
+        scale = np.array([1.5, 1.0, 0.5])
+        levels = gaussian_2D(
+            values["x0"] + scale * values["sx"], values["y0"] + scale * values["sy"], **values
+        )
+
+        wx0, wy0, wx1, wy1 = data["window"]
+        step = self.contour_step
+        y, x = np.mgrid[wy0:wy1:step, wx0:wx1:step]
+        try:
+            self.contour = self.axes.contour(
+                x,
+                y,
+                gaussian_2D(x, y, **values),
+                levels=levels,
+                cmap=cmap,
+                linewidths=1,
+                norm=colors.Normalize(*data["norm"]),
+            )
+            self.contour.set_animated(self.animated)
+        except ValueError as err:
+            logging.error(
+                "Plotting contour levels failed: %s. Likely because no clear gaussian", levels
+            )
+            logging.error(err)
+
+
 class ShotFit(ABC):
     def __init__(
         self,
@@ -328,7 +744,9 @@ class ShotFit(ABC):
         fix_theta: bool = True,
         fix_z0: bool = False,
         guess: Optional[dict] = None,
+        result=None,
     ):
+        """result: result of the same fit run elsewhere, skips the fit"""
         self.shot = shot
         self.fit_density = fit_density
         self.roi = roi
@@ -337,9 +755,10 @@ class ShotFit(ABC):
         self.vary_z0 = not fix_z0
         self.guess = guess
 
-        self.result = None
+        self.result = result
 
-        self.fit()
+        if self.result is None:
+            self.fit()
 
     @classmethod
     def save_result(cls, func):
@@ -353,15 +772,23 @@ class ShotFit(ABC):
 
         return wrapper
 
+    @property
+    def region(self):
+        """(x0, y0, x1, y1) of the fitted pixels: the ROI clipped to the computed window."""
+        if not self.roi:
+            return self.shot.window
+
+        wx0, wy0, wx1, wy1 = self.shot.window
+        x0, y0, x1, y1 = self.roi
+        return max(x0, wx0), max(y0, wy0), min(x1, wx1), min(y1, wy1)
+
     @property
     def meshgrid(self):
         """Returns a meshgrid with the shot ROI dimensions. The meshgrid is an (x, y) tuple of
         numpy matrices whose pairs reference every coordinate in the image."""
+        x, y = self.shot.meshgrid
         if self.roi:
-            x0, y0, x1, y1 = self.roi
-            y, x = np.mgrid[y0:y1, x0:x1]
-        else:
-            y, x = self.shot.meshgrid
+            x, y = self.shot.crop(x, self.roi), self.shot.crop(y, self.roi)
         return x, y
 
     @cachedproperty
@@ -381,8 +808,7 @@ class ShotFit(ABC):
     @property
     def fit_data_roi(self):
         if self.roi:
-            x0, y0, x1, y1 = self.roi
-            return self.fit_data[y0:y1, x0:x1]
+            return self.shot.crop(self.fit_data, self.roi)
 
         return self.fit_data
 
@@ -395,6 +821,9 @@ class ShotFit(ABC):
         if self.roi:
             x += self.roi[0]
             y += self.roi[1]
+        else:
+            x += self.shot.origin[0]
+            y += self.shot.origin[1]
 
         logging.info("Finding transmission peak - x: %i, y: %i, z: %i", x, y, z)
         return x, y, z
@@ -411,36 +840,41 @@ class ShotFit(ABC):
         contour_levels = self.eval(x=x, y=y).reshape((3, 3))
         return np.diag(contour_levels)
 
-    @property
+    @derived
     def sigma_mask(self):
-        """Returns a numpy mask of pixels within the 2-sigma limit of the model (no ROI)"""
+        """Returns a numpy mask of the computed window pixels within the 2-sigma limit of the
+        model (no ROI)"""
         bp_2D = self.best_values
         x0, y0, a, b, theta = (bp_2D[k] for k in ("x0", "y0", "sx", "sy", "theta"))
-        y, x = np.ogrid[0 : self.shot.height, 0 : self.shot.width]
+        wx0, wy0, wx1, wy1 = self.shot.window
+        y, x = np.ogrid[wy0:wy1, wx0:wx1]
 
         # https://math.stackexchange.com/a/434482
         maj_axis = np.square((x - x0) * np.cos(theta) - (y - y0) * np.sin(theta))
         min_axis = np.square((x - x0) * np.sin(theta) + (y - y0) * np.cos(theta))
-        bound = chi2.ppf(0.886, df=2)
-
-        array = np.zeros(self.shot.shape, dtype="bool")
-        array[maj_axis / np.square(a) + min_axis / np.square(b) <= bound] = True
-        return array
+        return maj_axis / np.square(a) + min_axis / np.square(b) <= SIGMA_MASK_BOUND
 
     @cachedproperty
     def slice_coordinates(self):
+        """Returns the endpoints of the horizontal and vertical lines through the fit center,
+        clipped to the computed window."""
         params = self.best_values
-        x_c = params["x0"]
-        y_c = params["y0"]
+        wx0, wy0, wx1, wy1 = self.shot.window
+        width, height = wx1 - wx0, wy1 - wy0
+        x_c = params["x0"] - wx0
+        y_c = params["y0"] - wy0
         m = np.tan(params["theta"])
 
-        x0_h, y0_h = clipped_endpoints(0, x_c, y_c, m, self.shot.height)
-        x1_h, y1_h = clipped_endpoints(self.shot.width, x_c, y_c, m, self.shot.height)
+        x0_h, y0_h = clipped_endpoints(0, x_c, y_c, m, height)
+        x1_h, y1_h = clipped_endpoints(width, x_c, y_c, m, height)
 
-        y0_v, x0_v = clipped_endpoints(0, y_c, x_c, -m, self.shot.width)
-        y1_v, x1_v = clipped_endpoints(self.shot.height, y_c, x_c, -m, self.shot.width)
+        y0_v, x0_v = clipped_endpoints(0, y_c, x_c, -m, width)
+        y1_v, x1_v = clipped_endpoints(height, y_c, x_c, -m, width)
 
-        return ((x0_h, x1_h), (y0_h, y1_h)), ((x0_v, x1_v), (y0_v, y1_v))
+        return (
+            ((x0_h + wx0, x1_h + wx0), (y0_h + wy0, y1_h + wy0)),
+            ((x0_v + wx0, x1_v + wx0), (y0_v + wy0, y1_v + wy0)),
+        )
 
     @cachedproperty
     def best_fit_lines(self):
@@ -457,8 +891,9 @@ class ShotFit(ABC):
             np.linspace(min(x_v), max(x_v), v_length, endpoint=False),
             np.linspace(min(y_v), max(y_v), v_length, endpoint=False),
         )
-        h_data = self.fit_data_raw[ys_h.astype("int"), xs_h.astype("int")]
-        v_data = self.fit_data_raw[ys_v.astype("int"), xs_v.astype("int")]
+        ox, oy = self.shot.origin
+        h_data = self.fit_data_raw[ys_h.astype("int") - oy, xs_h.astype("int") - ox]
+        v_data = self.fit_data_raw[ys_v.astype("int") - oy, xs_v.astype("int") - ox]
         return (xs_h, ys_h, h_data), (xs_v, ys_v, v_data)
 
     @abstractmethod
@@ -478,20 +913,75 @@ class ShotFit(ABC):
 class ShotFit2D(ShotFit):
     """2D Gaussian fit"""
 
+    def __init__(
+        self,
+        *args,
+        engine="analytic",
+        stride=5,
+        pyramid=0,
+        xtol=1e-7,
+        max_nfev=100,
+        warm=False,
+        **kwargs,
+    ):
+        """
+        Args: engine: "analytic" to fit with the analytic Jacobian, "lmfit" for lmfit's Model
+            stride: the strided fit uses every stride-th row of the ROI
+            pyramid: number of binned levels (2x2, 4x4, ...) of the coarse-to-fine fit,
+                0 for the strided fit
+            xtol: relative change of the parameters that terminates the fit
+            max_nfev: maximum number of model evaluations (per level)
+            warm: the guess is the fit of a previous shot, the pyramid starts at full resolution
+                within the window of the guess"""
+        self.engine = engine
+        self.stride = stride
+        self.pyramid = pyramid
+        self.xtol = xtol
+        self.max_nfev = max_nfev
+        self.warm = warm
+        super().__init__(*args, **kwargs)
+
     @ShotFit.save_result
     def fit(self):
         """Fits a 2D Gaussian against the absorption."""
         logging.info("Running 2D fit...")
+        guess, bounds, vary = self.initial_params()
 
-        x_mg, y_mg = self.shot.meshgrid
-        model = Model(ravel(gaussian_2D), independent_vars=["x", "y"])
+        logging.info(
+            "Using guess: x0=%.2f, y0=%.2f, sx=%.2f, sy=%.2f, A=%.2f",
+            *(guess[k] for k in ("x0", "y0", "sx", "sy", "A")),
+        )
+        if self.pyramid and self.engine != "lmfit":
+            result = self._fit_pyramid(guess, bounds, vary)
+        elif self.engine == "lmfit":
+            result = self._fit_lmfit(guess, bounds, vary)
+        else:
+            result = self._fit_analytic(guess, bounds, vary)
+        logging.info(result.fit_report())
+        return result
 
+    def initial_params(self):
+        """Returns the (guess, bounds, vary) dictionaries of the fit parameters."""
         if self.roi:
             x0, y0, x1, y1 = self.roi
         else:
-            x0, y0, x1, y1 = 0, 0, self.shot.width, self.shot.height
+            x0, y0, x1, y1 = self.shot.window
 
         x_c, y_c, x_s, y_s, A, vary_center = None, None, 100, 100, 0.5, True
+        theta, z0 = 0, 0
+        if self.guess:
+            x_c, y_c, x_s, y_s, A = (
+                self.guess["x0"],
+                self.guess["y0"],
+                self.guess["sx"],
+                self.guess["sy"],
+                self.guess["A"],
+            )
+            if self.vary_theta:
+                theta = self.guess.get("theta", 0)
+            if self.vary_z0:
+                z0 = self.guess.get("z0", 0)
+
         if self.center:
             x, y = self.center
             if x < x0 or x > x1 or y < y0 or y > y1:
@@ -503,61 +993,148 @@ class ShotFit2D(ShotFit):
             else:
                 x_c, y_c = self.center
                 vary_center = False
-        elif self.roi:
+        elif self.roi and not self.guess:
             x_c, y_c = (x1 + x0) / 2, (y1 + y0) / 2
 
-        if not x_c and not y_c:
-            if self.guess:
-                x_c, y_c, x_s, y_s, A = (
-                    self.guess["x0"],
-                    self.guess["y0"],
-                    self.guess["sx"],
-                    self.guess["sy"],
-                    self.guess["A"],
-                )
-            else:
-                x_c, y_c, A = self.peak
+        if x_c is None and y_c is None:
+            x_c, y_c, A = self.peak
 
         if self.fit_density:
             max_A = 6
         else:
             max_A = 1.5
 
-        model.set_param_hint("A", value=A, min=0, max=max_A)
-        model.set_param_hint("x0", value=x_c, min=x0, max=x1, vary=vary_center)
-        model.set_param_hint("y0", value=y_c, min=y0, max=y1, vary=vary_center)
-
-        model.set_param_hint("sx", min=1, max=self.shot.width)
-        model.set_param_hint("sy", min=1, max=self.shot.height)
-        model.set_param_hint(
-            "theta", min=-np.pi / 4, max=np.pi / 4, vary=self.vary_theta
+        guess = {"A": A, "x0": x_c, "y0": y_c, "sx": x_s, "sy": y_s, "theta": theta, "z0": z0}
+        bounds = {
+            "A": (0, max_A),
+            "x0": (x0, x1),
+            "y0": (y0, y1),
+            "sx": (1, self.shot.width),
+            "sy": (1, self.shot.height),
+            "theta": (-np.pi / 4, np.pi / 4),
+            "z0": (-1, 1),
+        }
+        vary = {
+            "x0": vary_center,
+            "y0": vary_center,
+            "theta": self.vary_theta,
+            "z0": self.vary_z0,
+        }
+        return guess, bounds, vary
+
+    def _fit_lmfit(self, guess, bounds, vary):
+        """Fits with lmfit's Model, using finite difference Jacobians."""
+        x_mg, y_mg = self.meshgrid
+        model = Model(ravel(gaussian_2D), independent_vars=["x", "y"])
+        for name, (lower, upper) in bounds.items():
+            model.set_param_hint(name, min=lower, max=upper, vary=vary.get(name, True))
+
+        return model.fit(
+            np.ravel(self.fit_data_roi[:: self.stride]),
+            x=x_mg[:: self.stride],
+            y=y_mg[:: self.stride],
+            **guess,
+            # scale_covar=False,
+            fit_kws={"maxfev": self.max_nfev, "xtol": self.xtol},
         )
-        model.set_param_hint("z0", min=-1, max=1, vary=self.vary_z0)
 
-        logging.info(
-            "Using guess: x0=%.2f, y0=%.2f, sx=%.2f, sy=%.2f, A=%.2f",
-            x_c,
-            y_c,
-            x_s,
-            y_s,
-            A,
+    def _fit_analytic(self, guess, bounds, vary):
+        """Fits with the analytic Jacobian on cached coordinate arrays."""
+        x, y = grid_coordinates(*self.region, row_stride=self.stride)
+        fitter = Gaussian2DFitter(x, y, self.fit_data_roi[:: self.stride])
+        return fitter.fit(guess, bounds=bounds, vary=vary, xtol=self.xtol, max_nfev=self.max_nfev)
+
+    def _fit_pyramid(self, guess, bounds, vary):
+        """Coarse-to-fine fit: the block means of the whole region are fitted at the coarsest
+        level, each finer level and finally the full resolution data only within a window of
+        the previous fit."""
+        rx0, ry0, _, _ = self.region
+        window = self.region
+        levels = range(self.pyramid, -1, -1)
+        if self.warm:
+            window, levels = self.cloud_window(guess, margin=1), [0]
+
+        values = guess
+        for level in levels:
+            factor = 2 ** level
+            x0, y0, x1, y1 = window
+            data = block_mean(self.fit_data_roi[y0 - ry0 : y1 - ry0, x0 - rx0 : x1 - rx0], factor)
+            rows, cols = data.shape
+            if min(rows, cols) < 8 and level > 0:
+                continue
+
+            # Block means are located at the center of their blocks
+            x, y = grid_coordinates(x0, y0, x0 + cols * factor, y0 + rows * factor, factor, factor)
+            fitter = Gaussian2DFitter(x + (factor - 1) / 2, y + (factor - 1) / 2, data)
+            result = fitter.fit(
+                values, bounds=bounds, vary=vary, xtol=self.xtol, max_nfev=self.max_nfev
+            )
+            logging.info("Pyramid level %ix%i: %i evaluations", factor, factor, result.nfev)
+            values = result.best_values
+            window = self.cloud_window(values, margin=factor)
+        return result
+
+    def cloud_window(self, values, margin=0):
+        """Returns the (x0, y0, x1, y1) region within 4 sigma (plus margin) of the cloud, clipped
+        to the fitted region."""
+        rx0, ry0, rx1, ry1 = self.region
+        radius = 4 * max(values["sx"], values["sy"]) + margin
+        x0 = int(np.clip(values["x0"] - radius, rx0, rx1 - 1))
+        y0 = int(np.clip(values["y0"] - radius, ry0, ry1 - 1))
+        x1 = int(np.clip(values["x0"] + radius + 1, x0 + 1, rx1))
+        y1 = int(np.clip(values["y0"] + radius + 1, y0 + 1, ry1))
+        return x0, y0, x1, y1
+
+    def eval(self, *, x, y):
+        """Evaluates the fit at the given coordinates (proxy for ModelResult)."""
+        return self.result.eval(x=x, y=y)
+
+    @property
+    def best_values(self):
+        return self.result.best_values
+
+
+class ShotFitMoments(ShotFit):
+    """2D Gaussian parameters estimated in closed form from the weighted moments of the image."""
+
+    def __init__(self, *args, step=4, **kwargs):
+        """step: distance in pixels between the data points used along both axes"""
+        self.step = step
+        super().__init__(*args, **kwargs)
+
+    @ShotFit.save_result
+    def fit(self):
+        """Estimates the 2D Gaussian from the unsmoothed data, which doesn't widen the cloud."""
+        logging.info("Running moments fit...")
+        x0, y0, x1, y1 = self.region
+        data = self.fit_data_raw
+        if self.roi:
+            data = self.shot.crop(data, self.roi)
+        data = data[:: self.step, :: self.step]
+
+        values = gaussian_2D_moments(
+            data, x0, y0, self.step, fix_theta=not self.vary_theta, fix_z0=not self.vary_z0
         )
-        result = model.fit(
-            np.ravel(self.fit_data[::5]),
-            x=x_mg[::5],
-            y=y_mg[::5],
-            sx=x_s,
-            sy=y_s,
-            theta=0,
-            z0=0,
-            # scale_covar=False,
-            fit_kws={"maxfev": 100, "xtol": 1e-7},
+        if self.center:
+            x, y = self.center
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                values["x0"], values["y0"] = x, y
+
+        result = Gaussian2DResult(
+            best_values=values,
+            init_values=dict(values),
+            vary=dict.fromkeys(values, False),
+            covar=None,
+            nfev=0,
+            chisqr=np.nan,
+            ndata=data.size,
+            message="Estimated from image moments",
         )
         logging.info(result.fit_report())
         return result
 
     def eval(self, *, x, y):
-        """Evaluates the fit at the given coordinates (proxy for ModelResult)."""
+        """Evaluates the estimate at the given coordinates (proxy for ModelResult)."""
         return self.result.eval(x=x, y=y)
 
     @property
@@ -572,15 +1149,16 @@ class ShotFit1DSummed(ShotFit):
     def fit(self):
         logging.info("Running 1D summed fit...")
 
-        x_mg, y_mg = np.arange(self.shot.width), np.arange(self.shot.height)
+        x0, y0, x1, y1 = self.shot.window
+        x_mg, y_mg = np.arange(x0, x1), np.arange(y0, y1)
         x_data, y_data = (
             np.sum(self.fit_data, axis=0),
             np.ravel(np.sum(self.fit_data, axis=1)),
         )
         model = GaussianModel()
 
-        x_result = model.fit(x_data, x=x_mg, center=self.shot.width / 2)
-        y_result = model.fit(y_data, x=y_mg, center=self.shot.height / 2)
+        x_result = model.fit(x_data, x=x_mg, center=(x0 + x1) / 2)
+        y_result = model.fit(y_data, x=y_mg, center=(y0 + y1) / 2)
 
         return x_result, y_result
 
@@ -588,7 +1166,8 @@ class ShotFit1DSummed(ShotFit):
         """Evaluates the fit at the given coordinates (proxy for ModelResult)."""
         x = self.result[0].eval(x=x)
         y = self.result[1].eval(x=y)
-        scale = self.shot.width * self.shot.height
+        x0, y0, x1, y1 = self.shot.window
+        scale = (x1 - x0) * (y1 - y0)
         return np.sqrt(np.multiply(np.square(x), np.square(y))) / scale
 
     @property
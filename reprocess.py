@@ -0,0 +1,255 @@
+"""
+Headless reprocessing of the shots in a Raw Data folder, e.g. with new ROIs or fit settings:
+
+    python reprocess.py 2024-05-01 --roi 500 300 900 600 --fit 2D
+
+Chunks of shots are analysed as batches in parallel worker processes, their PNGs are saved and
+their results are appended to an HDF5 log file. The default output folder is named after the
+analysis settings, so each set of settings gets its own PNGs and log file. Shots already in the
+log file are skipped, so an interrupted run resumes where it stopped.
+"""
+import os
+import sys
+import signal
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from itertools import repeat
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from config import config
+from models.batch import ShotBatch
+from models.cache import FitResultCache, fit_settings
+from worker.hdf5log import ShotLogWriter, logged_names
+from worker.render import render_plot
+from worker.watcher import find_shots
+
+RAW_DATA = Path("../Raw Data/")
+ANALYSIS_RESULTS = Path("../Analysis Results/")
+LOG_FORMAT = "%(asctime)s - %(processName)s - %(message)s"
+
+# Fit result cache of the worker process, see _init_worker
+_fit_cache = None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reprocess the shots of a Raw Data folder without the GUI."
+    )
+    parser.add_argument(
+        "folder", help='date folder under "../Raw Data/" (e.g. 2024-05-01) or path of a folder'
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help='folder of the PNGs (default: "../Analysis Results/<folder>/reprocessed-<settings>")',
+    )
+    parser.add_argument(
+        "--log", type=Path, help="HDF5 log file (default: <output>/000_logging.hdf5)"
+    )
+    parser.add_argument("--config", type=Path, help="config file (default: config.yaml)")
+    parser.add_argument(
+        "--processes", type=int, default=os.cpu_count(), help="number of worker processes"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=8, help="number of shots analysed at once per worker"
+    )
+    parser.add_argument(
+        "--fit", choices=("none", "1D", "2D"), default="2D", help="fit of the shots"
+    )
+    parser.add_argument(
+        "--roi", type=int, nargs=4, metavar=("X0", "Y0", "X1", "Y1"), help="fit ROI"
+    )
+    parser.add_argument(
+        "--three-roi", type=int, nargs=12, metavar="X", help="ROIs A, B and background"
+    )
+    parser.add_argument("--center", type=int, nargs=2, metavar=("X", "Y"), help="fit center")
+    parser.add_argument("--no-png", dest="png", action="store_false", help="skip the PNGs")
+    parser.add_argument("--comment", default="reprocessed", help="comment of the log rows")
+    return parser.parse_args(argv)
+
+
+def configure(args):
+    """Apply the command line settings to the config, without saving them."""
+    if args.config:
+        config.reload_config(args.config)
+
+    config.fit = args.fit != "none"
+    config.fit_2D = args.fit == "2D"
+    if args.roi:
+        config.roi = args.roi
+        config.roi_enabled = True
+    if args.three_roi:
+        config.threeroi = args.three_roi
+        config.three_roi_enabled = True
+    if args.center:
+        config.center = args.center
+        config.fix_center = True
+
+
+def settings_tag(cfg):
+    """Returns a short digest of the settings the logged results depend on."""
+    three_roi = tuple(cfg.threeroi) if cfg.three_roi_enabled and cfg.threeroi else None
+    digest = hashlib.blake2b(digest_size=4)
+    digest.update(repr((cfg.fit, fit_settings(cfg), three_roi)).encode())
+    return digest.hexdigest()
+
+
+def raw_data_folder(folder):
+    """Returns the folder, looked up under the Raw Data folder if it isn't a path."""
+    path = Path(folder)
+    if not path.is_dir() and (RAW_DATA / folder).is_dir():
+        path = RAW_DATA / folder
+    if not path.is_dir():
+        raise FileNotFoundError(f"No folder {folder}")
+    return path
+
+
+def reprocess(folder, output, log_path, processes, png=True, comment="", batch_size=8):
+    """Analyses the shots in the folder that are not in the log file yet. Returns the number of
+    failed shots."""
+    shots = find_shots(folder)
+    done = logged_names(log_path)
+    jobs = [(name, paths) for name, paths in shots if name not in done]
+    logging.info(
+        "Reprocessing %i of %i shot(s) in %s (%i already logged)",
+        len(jobs), len(shots), folder, len(shots) - len(jobs),
+    )
+    if not jobs:
+        if shots:
+            logging.warning(
+                "Every shot is already in %s, nothing is reprocessed. Use another --output or "
+                "--log to reprocess them.", log_path,
+            )
+        return 0
+
+    png_dir = None
+    if png:
+        png_dir = output
+        png_dir.mkdir(parents=True, exist_ok=True)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+
+    writer = ShotLogWriter(
+        lambda: log_path,
+        batch_size=config.log_batch_size,
+        flush_interval=config.log_flush_interval,
+        compression=config.log_compression,
+    )
+    executor = ProcessPoolExecutor(
+        max_workers=max(1, processes),
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(config, logging.getLogger().level),
+    )
+    batch_size = max(1, batch_size)
+    chunks = [jobs[idx : idx + batch_size] for idx in range(0, len(jobs), batch_size)]
+    failed = 0
+    num = 0
+    try:
+        for results in executor.map(_process_chunk, chunks, repeat(png_dir)):
+            for name, frames, values in results:
+                num += 1
+                if values is None:
+                    failed += 1
+                    continue
+
+                writer.append(name, frames, values, config.logdict, comments=comment)
+                logging.info("Reprocessed shot %s (%i/%i)", name, num, len(jobs))
+    except KeyboardInterrupt:
+        logging.warning("Interrupted, the remaining shots are processed by the next run")
+        raise
+    finally:
+        # Running shots finish before the interpreter exits, but are only logged by the next run
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+
+    return failed
+
+
+def _init_worker(cfg, level):
+    """Runs in every worker process: applies the config of the main process. Interrupts are
+    left to the main process, which lets the running shots finish."""
+    global _fit_cache
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=level, format=LOG_FORMAT, datefmt="%Y-%m-%d %H:%M:%S")
+    config.update_from(cfg)
+    if config.fit_cache_enabled:
+        _fit_cache = FitResultCache(config.fit_cache_directory, config.fit_cache_max_size)
+
+
+def _process_chunk(shots, png_dir):
+    """Runs in a worker process: analyses a chunk of (name, paths) shots as a batch and saves
+    their PNGs. Returns the (name, frames, log values) of the shots, with None values for the
+    failed ones. The frames are sent back for the log file, so they are only read once."""
+    try:
+        batch = ShotBatch.from_paths(shots)
+    except Exception:
+        if len(shots) == 1:
+            logging.exception("Reprocessing shot %s failed", shots[0][0])
+            return [(shots[0][0], None, None)]
+        # e.g. frames of different shapes, the shots are analysed one by one
+        logging.exception("Reading the batch of shots %s to %s failed", shots[0][0], shots[-1][0])
+        return [result for shot in shots for result in _process_chunk([shot], png_dir)]
+
+    analysed = []
+    for shot in batch.shots():
+        try:
+            if config.fit:
+                _run_fit(shot)
+            if png_dir is not None:
+                path = str(png_dir / f"{shot.name}.png")
+                render_plot(shot.plot_data(config), config.colormap, path, config.render_dpi)
+            analysed.append(shot)
+        except Exception:
+            logging.exception("Reprocessing shot %s failed", shot.name)
+            analysed.append(None)
+
+    try:
+        rows = batch.log_values(config, analysed)
+    except Exception:
+        logging.exception("Reprocessing shots %s to %s failed", shots[0][0], shots[-1][0])
+        rows = [None] * len(batch)
+
+    return [
+        (name, (batch.data[idx], batch.beam[idx], batch.dark[idx]), values if shot else None)
+        for idx, (name, shot, values) in enumerate(zip(batch.names, analysed, rows))
+    ]
+
+
+def _run_fit(shot):
+    """Fits the shot, restoring the results of unchanged shots and settings from the fit cache.
+    Shots are processed out of order, so there are no warm starts."""
+    if _fit_cache is None:
+        shot.run_fit(config)
+        return
+
+    key = _fit_cache.key(shot, config)
+    results = _fit_cache.get(key)
+    if results is not None:
+        shot.run_fit(config, results=results)
+    else:
+        shot.run_fit(config)
+        _fit_cache.put(key, shot)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, datefmt="%Y-%m-%d %H:%M:%S")
+    configure(args)
+
+    folder = raw_data_folder(args.folder)
+    output = args.output or ANALYSIS_RESULTS / folder.name / f"reprocessed-{settings_tag(config)}"
+    log_path = args.log or output / "000_logging.hdf5"
+
+    failed = reprocess(
+        folder, output, log_path, args.processes, args.png, args.comment, args.batch_size
+    )
+    if failed:
+        logging.error("%i shot(s) failed", failed)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""
+Fits of the sample shot in data/ with the shipped configuration
+"""
+from pathlib import Path
+
+import pytest
+
+from config import config
+from models.shots import Shot
+
+SAMPLE = Path(__file__).resolve().parent.parent / "data"
+# Atom number of the 2D fit of the sample shot before the fit was optimized
+ATOM_NUMBER = 8.357e7
+
+
+@pytest.fixture
+def shot(monkeypatch):
+    monkeypatch.setattr(config, "fit", True)
+    monkeypatch.setattr(config, "fit_2D", True)
+    return Shot("Raw_20190522-105317", sorted(SAMPLE.glob("Raw_20190522-105317_*.bmp")))
+
+
+def test_moments_estimate_finds_the_cloud(shot):
+    estimate = shot.run_fit_moments(config).best_values
+    assert estimate["A"] > 0
+    assert estimate["sx"] > 10 and estimate["sy"] > 10
+
+
+def test_2D_fit_matches_the_baseline(shot):
+    fit = shot.run_fit(config)
+    assert fit is shot.fit_2D
+    assert fit.best_values["A"] > 0.5
+    assert shot.atom_number == pytest.approx(ATOM_NUMBER, rel=0.02)
@@ -0,0 +1,74 @@
+"""
+Fast reader for uncompressed 8-bit BMP images
+"""
+import struct
+
+import imageio
+import numpy as np
+
+# Signature, file size, reserved, reserved, pixel data offset
+FILE_HEADER = struct.Struct("<2sIHHI")
+# Header size, width, height, planes, bits per pixel, compression, image size,
+# horizontal resolution, vertical resolution, colors used, important colors
+INFO_HEADER = struct.Struct("<IiiHHIIiiII")
+
+GRAYSCALE_PALETTE = np.repeat(np.arange(256, dtype=np.uint8), 4).reshape(256, 4)
+
+
+def read_frame(path, mmap=False):
+    """Returns the 8-bit grayscale image at path as a uint8 array.
+
+    Uncompressed 8-bit BMPs with a grayscale palette are a fixed header followed by the raw
+    rows, so the pixel data is exposed as a view of a single read (or of a read-only memory
+    map if mmap). Any other image is decoded with imageio."""
+    layout = _bmp_layout(path)
+    if layout is None:
+        return imageio.imread(path, mode="L")
+
+    offset, width, height, stride = layout
+    rows = abs(height)
+    if mmap:
+        raw = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(rows, stride))
+    else:
+        raw = np.fromfile(path, dtype=np.uint8, count=rows * stride, offset=offset)
+        raw = raw.reshape(rows, stride)
+
+    # Rows are padded to 4 bytes and stored bottom-up unless the height is negative
+    image = raw[:, :width]
+    if height > 0:
+        image = image[::-1]
+    return image
+
+
+def _bmp_layout(path):
+    """Returns (pixel offset, width, height, row stride) if the file is an uncompressed 8-bit
+    BMP with a grayscale palette, otherwise None."""
+    with open(path, "rb") as f:
+        header = f.read(FILE_HEADER.size + INFO_HEADER.size)
+        if len(header) < FILE_HEADER.size + INFO_HEADER.size:
+            return None
+
+        signature, file_size, _, _, offset = FILE_HEADER.unpack_from(header)
+        if signature != b"BM":
+            return None
+
+        info = INFO_HEADER.unpack_from(header, FILE_HEADER.size)
+        info_size, width, height, _, bit_count, compression, _, _, _, colors, _ = info
+        if info_size < INFO_HEADER.size or bit_count != 8 or compression != 0 or width <= 0:
+            return None
+
+        colors = colors or 256
+        f.seek(FILE_HEADER.size + info_size)
+        palette = np.frombuffer(f.read(4 * colors), dtype=np.uint8)
+        if palette.size != 4 * colors:
+            return None
+        palette = palette.reshape(colors, 4)
+        if not np.array_equal(palette[:, :3], GRAYSCALE_PALETTE[:colors, :3]):
+            return None
+
+        stride = (width + 3) & ~3
+        f.seek(0, 2)
+        if f.tell() < offset + stride * abs(height):
+            return None
+
+    return offset, width, height, stride
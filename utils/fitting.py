@@ -34,3 +34,389 @@ def gaussian_2D(x, y, A, x0, y0, sx, sy, theta=0, z0=0):
         a * np.square(x - x0) + 2 * b * (x - x0) * (y - y0) + c * np.square(y - y0)
     )
     return A * np.exp(-quadratic) + z0
+
+
+GAUSSIAN_2D_PARAMS = ("A", "x0", "y0", "sx", "sy", "theta", "z0")
+
+
+def gaussian_2D_jacobian(x, y, A, x0, y0, sx, sy, theta=0, z0=0):
+    """Returns the partial derivatives of gaussian_2D with respect to
+    (A, x0, y0, sx, sy, theta, z0) as a list of arrays with the shape of x and y."""
+    cos_sq = np.square(np.cos(theta))
+    sin_sq = np.square(np.sin(theta))
+    sin2th = np.sin(2 * theta)
+    cos2th = np.cos(2 * theta)
+    sx_sq = np.square(sx)
+    sy_sq = np.square(sy)
+
+    a = cos_sq / (2 * sx_sq) + sin_sq / (2 * sy_sq)
+    b = sin2th / (4 * sy_sq) - sin2th / (4 * sx_sq)
+    c = sin_sq / (2 * sx_sq) + cos_sq / (2 * sy_sq)
+
+    dx = x - x0
+    dy = y - y0
+    dx_sq = np.square(dx)
+    dxdy = dx * dy
+    dy_sq = np.square(dy)
+
+    exp = np.exp(-(a * dx_sq + 2 * b * dxdy + c * dy_sq))
+    amp = A * exp
+
+    # Derivatives of a, b and c with respect to sx, sy and theta
+    sx_cu = sx_sq * sx
+    sy_cu = sy_sq * sy
+    d_theta = (1 / sy_sq - 1 / sx_sq) / 2
+
+    return [
+        exp,
+        amp * 2 * (a * dx + b * dy),
+        amp * 2 * (b * dx + c * dy),
+        amp * (cos_sq * dx_sq - sin2th * dxdy + sin_sq * dy_sq) / sx_cu,
+        amp * (sin_sq * dx_sq + sin2th * dxdy + cos_sq * dy_sq) / sy_cu,
+        -amp * d_theta * (sin2th * dx_sq + 2 * cos2th * dxdy - sin2th * dy_sq),
+        np.ones_like(exp),
+    ]
+
+
+def gaussian_2D_moments(data, x0=0, y0=0, step=1, fix_theta=False, fix_z0=False):
+    """Estimates the gaussian_2D parameters of an image in closed form from its weighted moments.
+
+    The offset z0 is the clipped mean of the image border. A first pass takes the moments of the
+    pixels more than 2 noise deviations above the offset; a second pass takes the unthresholded
+    moments within 3 sigma of the first estimate, corrected for the truncation.
+    Args: data: 2D image, e.g. a strided view of the ROI, or an (N, H, W) stack of images
+        x0, y0: coordinates of data[..., 0, 0]
+        step: distance in pixels between neighbouring data points
+        fix_theta: if True, theta is 0
+        fix_z0: if True, z0 is 0
+    Returns a dictionary of (A, x0, y0, sx, sy, theta, z0), floats for an image and arrays of
+    length N for a stack."""
+    data = np.asarray(data, dtype=float)
+    single = data.ndim == 2
+    if single:
+        data = data[np.newaxis]
+    num, rows, cols = data.shape
+    xs = x0 + step * np.arange(cols)
+    ys = y0 + step * np.arange(rows)
+
+    edge = max(1, min(rows, cols) // 20)
+    border = np.concatenate(
+        [
+            data[:, :edge].reshape(num, -1),
+            data[:, -edge:].reshape(num, -1),
+            data[:, :, :edge].reshape(num, -1),
+            data[:, :, -edge:].reshape(num, -1),
+        ],
+        axis=1,
+    )
+    # Clipped mean and deviation: robust against atoms at the border, and unlike the median
+    # unbiased for one-sided noise (absorption is clipped at 0)
+    spread = 3 * np.std(border, axis=1, keepdims=True)
+    inliers = np.abs(border - np.median(border, axis=1, keepdims=True)) <= spread
+    mean = np.sum(border * inliers, axis=1) / np.sum(inliers, axis=1)
+    deviation = np.square(border - mean[:, None]) * inliers
+    noise = np.sqrt(np.sum(deviation, axis=1) / np.sum(inliers, axis=1))
+    z0 = np.zeros(num) if fix_z0 else mean
+
+    weights = data - z0[:, None, None]
+    first_pass = np.where(weights > 2 * noise[:, None, None], weights, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moments = _image_moments(first_pass, xs, ys)
+        found = moments[0] > 0
+
+        # Second pass: all pixels within a Mahalanobis radius of 3 of the previous pass
+        radius_sq = 9
+        for _ in range(2):
+            total, cx, cy, mxx, myy, mxy = (value[:, None, None] for value in moments)
+            det = mxx * myy - mxy ** 2
+            valid = found & (det[:, 0, 0] > 0)
+            dx = xs[None, None, :] - cx
+            dy = ys[None, :, None] - cy
+            distance = (myy * np.square(dx) - 2 * mxy * dx * dy + mxx * np.square(dy)) / det
+            second_pass = _image_moments(np.where(distance <= radius_sq, weights, 0), xs, ys)
+            valid &= second_pass[0] > 0
+            second_pass = _untruncated(second_pass, radius_sq)
+            moments = tuple(np.where(valid, new, old) for new, old in zip(second_pass, moments))
+
+    total, cx, cy, mxx, myy, mxy = moments
+    if fix_theta:
+        theta, sx_sq, sy_sq = np.zeros(num), mxx, myy
+    else:
+        # Covariance of gaussian_2D: mxx - myy = (sx^2 - sy^2) cos(2 theta),
+        # mxy = -(sx^2 - sy^2) sin(2 theta) / 2
+        theta = 0.5 * np.arctan2(-2 * mxy, mxx - myy)
+        half_sum = (mxx + myy) / 2
+        half_diff = np.hypot((mxx - myy) / 2, mxy)
+        sx_sq, sy_sq = half_sum + half_diff, half_sum - half_diff
+        # Keep theta within (-pi/4, pi/4]
+        swap = np.abs(theta) > np.pi / 4
+        theta = np.where(swap, theta - np.sign(theta) * np.pi / 2, theta)
+        sx_sq, sy_sq = np.where(swap, sy_sq, sx_sq), np.where(swap, sx_sq, sy_sq)
+
+    with np.errstate(invalid="ignore"):
+        sx, sy = np.sqrt(np.fmax(sx_sq, 1.0)), np.sqrt(np.fmax(sy_sq, 1.0))
+    values = {
+        "A": total * step ** 2 / (2 * np.pi * sx * sy),
+        "x0": cx,
+        "y0": cy,
+        "sx": sx,
+        "sy": sy,
+        "theta": theta,
+        "z0": z0,
+    }
+    # Without a cloud above the noise, the estimate is an empty Gaussian at the center
+    empty = {"A": 0.0, "x0": np.mean(xs), "y0": np.mean(ys), "sx": 1.0, "sy": 1.0, "theta": 0.0}
+    for key, value in empty.items():
+        values[key] = np.where(found, values[key], value)
+
+    if single:
+        return {key: float(value[0]) for key, value in values.items()}
+    return values
+
+
+def _untruncated(moments, radius_sq):
+    """Corrects the moments of a 2D Gaussian truncated at a Mahalanobis radius sqrt(radius_sq),
+    which keeps 1 - exp(-r^2/2) of the mass and 1 - r^2/2 exp(-r^2/2) / (1 - exp(-r^2/2)) of
+    the variance."""
+    total, cx, cy, mxx, myy, mxy = moments
+    mass = 1 - np.exp(-radius_sq / 2)
+    variance = 1 - radius_sq / 2 * np.exp(-radius_sq / 2) / mass
+    return total / mass, cx, cy, mxx / variance, myy / variance, mxy / variance
+
+
+def _image_moments(weights, xs, ys):
+    """Returns the (total, cx, cy, mxx, myy, mxy) arrays of an (N, H, W) stack of weights on the
+    xs/ys grid."""
+    col_sums = np.sum(weights, axis=1)
+    row_sums = np.sum(weights, axis=2)
+    total = np.sum(col_sums, axis=1)
+
+    cx = col_sums @ xs / total
+    cy = row_sums @ ys / total
+    dx, dy = xs - cx[:, None], ys - cy[:, None]
+    mxx = np.sum(col_sums * np.square(dx), axis=1) / total
+    myy = np.sum(row_sums * np.square(dy), axis=1) / total
+    mxy = np.einsum("nh,nhw,nw->n", dy, weights, dx) / total
+    return total, cx, cy, mxx, myy, mxy
+
+
+def block_mean(image, factor):
+    """Returns the image (or the (..., H, W) stack of images) binned into the means of
+    factor x factor blocks. Rows and columns that don't fill a block are dropped."""
+    if factor == 1:
+        return image
+    *lead, height, width = image.shape
+    rows, cols = height // factor, width // factor
+    # Summing the strided views of the block offsets is several times faster than reducing
+    # over the block axes of a reshaped view
+    dtype = image.dtype if image.dtype.kind == "f" else np.float64
+    total = np.zeros((*lead, rows, cols), dtype=dtype)
+    for dy in range(factor):
+        for dx in range(factor):
+            total += image[..., dy : rows * factor : factor, dx : cols * factor : factor]
+    total /= factor * factor
+    return total
+
+
+@functools.lru_cache(maxsize=8)
+def grid_coordinates(x0, y0, x1, y1, row_stride=1, col_stride=1):
+    """Returns read-only raveled (x, y) coordinates of the pixels in the (x0, y0, x1, y1) region,
+    keeping every row_stride-th row and col_stride-th column. Cached, as consecutive shots
+    are fitted on the same grid."""
+    y, x = np.mgrid[y0:y1:row_stride, x0:x1:col_stride]
+    x, y = np.ravel(x).astype(float), np.ravel(y).astype(float)
+    x.flags.writeable = False
+    y.flags.writeable = False
+    return x, y
+
+
+class Gaussian2DResult:
+    """Result of a Gaussian2DFitter fit, providing the parts of lmfit's ModelResult interface used
+    for shots (best_values, eval and fit_report)."""
+
+    def __init__(self, best_values, init_values, vary, covar, nfev, chisqr, ndata, message):
+        self.best_values = best_values
+        self.init_values = init_values
+        self.vary = vary
+        self.covar = covar
+        self.nfev = nfev
+        self.chisqr = chisqr
+        self.ndata = ndata
+        self.message = message
+
+    @classmethod
+    def from_model_result(cls, result):
+        """Returns the Gaussian2DResult of an lmfit ModelResult of gaussian_2D, which unlike the
+        ModelResult can be pickled."""
+        return cls(
+            best_values=dict(result.best_values),
+            init_values=dict(result.init_values),
+            vary={name: result.params[name].vary for name in GAUSSIAN_2D_PARAMS},
+            covar=result.covar,
+            nfev=result.nfev,
+            chisqr=result.chisqr,
+            ndata=result.ndata,
+            message=result.message,
+        )
+
+    @property
+    def nvarys(self):
+        return sum(self.vary.values())
+
+    @property
+    def redchi(self):
+        return self.chisqr / max(1, self.ndata - self.nvarys)
+
+    @property
+    def stderr(self):
+        """Dictionary of the standard errors of the varied parameters (None if unknown)."""
+        names = [name for name in GAUSSIAN_2D_PARAMS if self.vary[name]]
+        errors = dict.fromkeys(GAUSSIAN_2D_PARAMS)
+        if self.covar is not None:
+            errors.update(zip(names, np.sqrt(np.abs(np.diag(self.covar)))))
+        return errors
+
+    def eval(self, *, x, y):
+        """Evaluates the fitted model at the given coordinates (raveled)."""
+        return np.ravel(gaussian_2D(x, y, **self.best_values))
+
+    def fit_report(self):
+        if not self.nfev:
+            values = ", ".join(f"{k}={v:.5g}" for k, v in self.best_values.items())
+            return f"{self.message}: {values}"
+
+        lines = [
+            "[[Fit Statistics]]",
+            f"    # function evals   = {self.nfev}",
+            f"    # data points      = {self.ndata}",
+            f"    # variables        = {self.nvarys}",
+            f"    chi-square         = {self.chisqr:.8g}",
+            f"    reduced chi-square = {self.redchi:.8g}",
+            f"    message            = {self.message}",
+            "[[Variables]]",
+        ]
+        stderr = self.stderr
+        for name in GAUSSIAN_2D_PARAMS:
+            value = self.best_values[name]
+            if not self.vary[name]:
+                lines.append(f"    {name + ':':7} {value:.8g} (fixed)")
+            elif stderr[name] is None:
+                lines.append(f"    {name + ':':7} {value:.8g} (init = {self.init_values[name]:.7g})")
+            else:
+                lines.append(
+                    f"    {name + ':':7} {value:.8g} +/- {stderr[name]:.5g} "
+                    f"(init = {self.init_values[name]:.7g})"
+                )
+        return "\n".join(lines)
+
+
+class Gaussian2DFitter:
+    """Least-squares fit of gaussian_2D with the analytic Jacobian. A bounded Levenberg-Marquardt
+    solver works on the small normal equations (J^T J), so an iteration costs one model and one
+    Jacobian evaluation instead of a finite difference evaluation per parameter."""
+
+    def __init__(self, x, y, data):
+        """
+        Args: x, y: coordinates of the data points (any shape, raveled)
+            data: data points with the same size as x and y"""
+        self.x = np.ravel(x)
+        self.y = np.ravel(y)
+        self.data = np.ravel(data).astype(float)
+
+    def fit(self, guess, bounds=None, vary=None, xtol=1e-7, ftol=1e-10, max_nfev=100):
+        """Runs the fit and returns a Gaussian2DResult.
+        Args: guess: dictionary of initial values for all of GAUSSIAN_2D_PARAMS
+            bounds: dictionary of (min, max) tuples per parameter (default unbounded)
+            vary: dictionary of booleans per parameter, False keeps it at its guess
+            xtol: relative change of the parameters that terminates the fit
+            ftol: relative change of the chi-square that terminates the fit
+            max_nfev: maximum number of model evaluations"""
+        bounds = bounds or {}
+        vary = {name: bool((vary or {}).get(name, True)) for name in GAUSSIAN_2D_PARAMS}
+        names = [name for name in GAUSSIAN_2D_PARAMS if vary[name]]
+        columns = [GAUSSIAN_2D_PARAMS.index(name) for name in names]
+        lower = np.array([bounds.get(name, (-np.inf, np.inf))[0] for name in names], float)
+        upper = np.array([bounds.get(name, (-np.inf, np.inf))[1] for name in names], float)
+
+        # Initial values are clipped into the bounds
+        init_values = {name: float(guess[name]) for name in GAUSSIAN_2D_PARAMS}
+        p = np.clip([init_values[name] for name in names], lower, upper)
+        init_values.update(zip(names, p))
+
+        def params(p):
+            values = dict(init_values)
+            values.update(zip(names, p))
+            return values
+
+        def residual(p):
+            return gaussian_2D(self.x, self.y, **params(p)) - self.data
+
+        def jacobian(p):
+            derivatives = gaussian_2D_jacobian(self.x, self.y, **params(p))
+            return np.array([derivatives[idx] for idx in columns])
+
+        fun = residual(p)
+        chisqr = fun @ fun
+        nfev, damping, message = 1, 1e-3, "Maximum number of function evaluations reached"
+        jac = jacobian(p) if names else None
+
+        while names and nfev < max_nfev:
+            hessian = jac @ jac.T
+            gradient = jac @ fun
+            scale = np.diag(hessian) + np.finfo(float).eps
+
+            # Increase the damping until the step lowers the chi-square
+            while nfev < max_nfev:
+                try:
+                    step = np.linalg.solve(hessian + damping * np.diag(scale), -gradient)
+                except np.linalg.LinAlgError:
+                    step = None
+                if step is not None:
+                    p_new = np.clip(p + step, lower, upper)
+                    fun_new = residual(p_new)
+                    chisqr_new = fun_new @ fun_new
+                    nfev += 1
+                    if chisqr_new < chisqr:
+                        break
+                damping *= 10
+                if damping > 1e12:
+                    break
+            else:
+                break
+
+            if damping > 1e12:
+                message = "Chi-square cannot be reduced further"
+                break
+
+            dp, dchisqr = p_new - p, chisqr - chisqr_new
+            p, fun, chisqr = p_new, fun_new, chisqr_new
+            jac = jacobian(p)
+            damping = max(damping / 10, 1e-12)
+
+            if np.all(np.abs(dp) <= xtol * (xtol + np.abs(p))):
+                message = "Parameter change below xtol"
+                break
+            if dchisqr <= ftol * chisqr:
+                message = "Chi-square change below ftol"
+                break
+
+        if not names:
+            message = "No parameters to vary"
+
+        covar = None
+        if jac is not None and self.data.size > len(names):
+            try:
+                covar = np.linalg.inv(jac @ jac.T) * chisqr / (self.data.size - len(names))
+            except np.linalg.LinAlgError:
+                pass
+
+        return Gaussian2DResult(
+            best_values={name: float(value) for name, value in params(p).items()},
+            init_values=init_values,
+            vary=vary,
+            covar=covar,
+            nfev=nfev,
+            chisqr=float(chisqr),
+            ndata=self.data.size,
+            message=message,
+        )
@@ -0,0 +1,129 @@
+"""
+Absorption imaging kernels
+"""
+import threading
+import functools
+
+import numpy as np
+
+from scipy.ndimage import gaussian_filter
+
+
+class BufferPool:
+    """Scratch buffers that are reused between calls, one set per thread and (name, shape, dtype)."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self, name, shape, dtype):
+        """Returns an uninitialized scratch buffer."""
+        buffers = getattr(self.local, "buffers", None)
+        if buffers is None:
+            buffers = self.local.buffers = {}
+
+        key = (name, tuple(shape), np.dtype(dtype))
+        if key not in buffers:
+            buffers[key] = np.empty(shape, dtype=dtype)
+        return buffers[key]
+
+    def clear(self):
+        """Release the buffers of the calling thread."""
+        self.local.buffers = {}
+
+
+buffer_pool = BufferPool()
+
+
+def absorption_images(data, beam, dark, *, threshold=7, sigma=1, dtype="float64", pool=None):
+    """Computes the transmission, absorption and optical density images in one pass.
+
+    Dark-field is subtracted from the atom and beam images and the atom image is divided by the
+    beam image, giving the transmission. Where the beam is at or below the threshold, the atom
+    data is treated as invalid and the transmission is set to 1. The transmission is clipped to
+    [0, 1], the absorption is 1 - transmission and the optical density is -ln of the transmission
+    smoothed with a Gaussian of width sigma (0 where the smoothed transmission is 0).
+
+    Intermediates are written into scratch buffers from the pool (default: the shared per-thread
+    pool), so only the three returned images are allocated."""
+    pool = pool or buffer_pool
+    dtype = np.dtype(dtype)
+    shape = np.shape(data)
+
+    atoms = pool.get("atoms", shape, "int16")
+    light = pool.get("light", shape, "int16")
+    valid = pool.get("valid", shape, "bool")
+    np.subtract(data, dark, out=atoms, dtype="int16")
+    np.subtract(beam, dark, out=light, dtype="int16")
+    np.greater(light, threshold, out=valid)
+
+    transmission = np.ones(shape, dtype=dtype)
+    np.divide(atoms, light, out=transmission, where=valid, dtype=dtype)
+    np.clip(transmission, 0, 1, out=transmission)
+
+    absorption = np.subtract(1, transmission, dtype=dtype)
+
+    smoothed = pool.get("smoothed", shape, dtype)
+    gaussian_filter(transmission, sigma=sigma, output=smoothed)
+    np.greater(smoothed, 0, out=valid)
+
+    optical_density = np.zeros(shape, dtype=dtype)
+    np.log(smoothed, out=optical_density, where=valid)
+    np.negative(optical_density, out=optical_density)
+
+    return transmission, absorption, optical_density
+
+
+@functools.lru_cache(maxsize=4)
+def absorption_lut(threshold=7, dtype="float64"):
+    """Returns read-only (transmission, optical density) lookup tables for 8-bit frames, indexed by
+    (atoms - dark + 255) * 511 + (beam - dark + 255).
+
+    The transmission follows absorption_images: 1 where the beam is at or below the threshold,
+    otherwise atoms / beam clipped to [0, 1]. The optical density is -ln of that transmission,
+    where a transmission of 0 is floored to half a count (-ln(0.5 / beam)) to keep it finite."""
+    counts = np.arange(-255, 256)
+    atoms, light = np.meshgrid(counts, counts, indexing="ij")
+    valid = light > threshold
+
+    transmission = np.ones(atoms.shape)
+    np.divide(atoms, light, out=transmission, where=valid)
+    np.clip(transmission, 0, 1, out=transmission)
+
+    floor = np.divide(0.5, light, out=np.ones(atoms.shape), where=valid)
+    optical_density = -np.log(np.maximum(transmission, floor))
+
+    tables = []
+    for table in (transmission, optical_density):
+        table = np.ravel(table).astype(dtype)
+        table.flags.writeable = False
+        tables.append(table)
+    return tuple(tables)
+
+
+def absorption_images_lut(data, beam, dark, *, threshold=7, sigma=1, dtype="float64", pool=None):
+    """Lookup-table version of absorption_images for uint8 frames. The transmission and optical
+    density of every pixel are gathered from absorption_lut, which removes the divide and the
+    log. The optical density is then smoothed with a Gaussian of width sigma, i.e. smoothing is
+    applied to the optical density rather than to the transmission before the log."""
+    pool = pool or buffer_pool
+    dtype = np.dtype(dtype)
+    shape = np.shape(data)
+    transmission_lut, od_lut = absorption_lut(threshold, dtype.name)
+
+    index = pool.get("index", shape, "int32")
+    light = pool.get("light", shape, "int16")
+    np.subtract(data, dark, out=index, dtype="int32")
+    index += 255
+    index *= 511
+    np.subtract(beam, dark, out=light, dtype="int16")
+    index += light
+    index += 255
+
+    transmission = np.take(transmission_lut, index)
+    absorption = np.subtract(1, transmission, dtype=dtype)
+
+    od = pool.get("od", shape, dtype)
+    np.take(od_lut, index, out=od)
+    optical_density = gaussian_filter(od, sigma=sigma)
+
+    return transmission, absorption, optical_density
@@ -0,0 +1,37 @@
+"""
+Summed-area tables for constant time rectangle sums
+"""
+import numpy as np
+
+
+def summed_area_table(image, dtype="float64"):
+    """Returns the (H + 1, W + 1) summed-area table of the image, table[y, x] being the sum of
+    image[:y, :x]. Accumulated in float64 by default to keep large sums exact. A stack of
+    (..., H, W) images gives a stack of tables."""
+    *lead, height, width = np.shape(image)
+    table = np.zeros((*lead, height + 1, width + 1), dtype=dtype)
+    np.cumsum(image, axis=-2, dtype=dtype, out=table[..., 1:, 1:])
+    np.cumsum(table[..., 1:, 1:], axis=-1, out=table[..., 1:, 1:])
+    return table
+
+
+def box_sums(table, boxes, origin=(0, 0)):
+    """Returns the sums of the image within each (x0, y0, x1, y1) box, four lookups per box.
+    Args: table: summed-area table of the image, or (..., H + 1, W + 1) stack of tables
+        boxes: (N, 4) array-like of boxes (end exclusive), clipped to the image
+        origin: (x, y) coordinates of the top left pixel of the image
+    Returns an (N,) array, or (..., N) for a stack of tables."""
+    boxes = np.asarray(boxes, dtype=int).reshape(-1, 4)
+    ox, oy = origin
+    height, width = table.shape[-2] - 1, table.shape[-1] - 1
+    x0 = np.clip(boxes[:, 0] - ox, 0, width)
+    y0 = np.clip(boxes[:, 1] - oy, 0, height)
+    x1 = np.clip(boxes[:, 2] - ox, x0, width)
+    y1 = np.clip(boxes[:, 3] - oy, y0, height)
+    return table[..., y1, x1] - table[..., y0, x1] - table[..., y1, x0] + table[..., y0, x0]
+
+
+def box_areas(boxes):
+    """Returns the number of pixels of each (x0, y0, x1, y1) box."""
+    boxes = np.asarray(boxes, dtype=int).reshape(-1, 4)
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
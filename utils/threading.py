@@ -1,8 +1,14 @@
 """
 General threading helpers
 """
+import time
+import logging
 import functools
 import threading
+import traceback
+import itertools
+import tkinter as tk
+from collections import deque
 
 
 def mainthread(func):
@@ -14,3 +20,115 @@ def mainthread(func):
         return func(*args, **kwargs)
 
     return wrapper
+
+
+class EventDispatcher:
+    """Runs callables queued from any thread on the Tk main thread. Queuing wakes Tk with a
+    virtual event, and every wake-up drains the queue for up to budget seconds before letting
+    Tk redraw. The virtual event is generated by a waker thread, so the queuing threads never
+    wait for the main thread. A slow poll catches the events whose wake-up could not be
+    delivered (e.g. before the main loop started). Tk may only be called from other threads if
+    Tcl is threaded, otherwise there is no waker thread and a fast poll runs the events.
+
+    Events queued with a key are coalesced: only the newest event per key runs, and events
+    with a lower rank than one already queued for the key (e.g. the display of an older shot)
+    are dropped."""
+
+    sequence = "<<DispatchEvents>>"
+
+    def __init__(self, widget, budget=0.02, poll_interval=250, fast_poll_interval=20):
+        """
+        Args: widget: Tk widget whose main loop runs the events
+            budget: seconds spent running events before Tk gets to redraw
+            poll_interval: milliseconds between polls of the queue
+            fast_poll_interval: milliseconds between polls if Tcl isn't threaded"""
+        self.widget = widget
+        self.budget = budget
+        self.threaded = _tcl_threaded(widget)
+        self.poll_interval = poll_interval if self.threaded else fast_poll_interval
+
+        self.events = deque()
+        self.latest = {}  # key -> (highest rank, number of the newest event)
+        self.numbers = itertools.count()
+        self.lock = threading.Lock()
+        self.wake_pending = False
+        self.dropped = 0
+
+        self.wake = threading.Event()
+        self.widget.bind(self.sequence, lambda _: self.dispatch())
+        self.widget.after(self.poll_interval, self._poll)
+        if self.threaded:
+            threading.Thread(target=self._wake_loop, name="event-dispatcher", daemon=True).start()
+        else:
+            logging.info("Tcl is not threaded, polling the event queue")
+
+    def put(self, func, args=(), kwargs=None, key=None, rank=None):
+        """Queue func(*args, **kwargs) and wake the main thread. Returns False if the event is
+        superseded by a higher ranked one with the same key."""
+        with self.lock:
+            number = next(self.numbers)
+            if key is not None:
+                latest = self.latest.get(key)
+                if latest is not None and rank is not None and latest[0] is not None:
+                    if rank < latest[0]:
+                        self.dropped += 1
+                        return False
+                if rank is None and latest is not None:
+                    rank = latest[0]  # keep the highest rank seen for the key
+                self.latest[key] = (rank, number)
+
+            self.events.append((number, key, func, args, kwargs or {}))
+            wake = not self.wake_pending
+            self.wake_pending = True
+
+        if wake and self.threaded:
+            self.wake.set()
+        return True
+
+    def dispatch(self):
+        """Run the queued events until the queue is empty or the budget is used up."""
+        deadline = time.perf_counter() + self.budget
+        while time.perf_counter() < deadline:
+            with self.lock:
+                if not self.events:
+                    self.wake_pending = False
+                    return
+                number, key, func, args, kwargs = self.events.popleft()
+                # The rank stays in latest after the event ran, so that a later event of a
+                # lower rank (e.g. the fit overlay of an older shot) is still dropped
+                superseded = key is not None and self.latest[key][1] != number
+                if superseded:
+                    self.dropped += 1
+
+            if not superseded:
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    logging.error(traceback.format_exc())
+
+        # Over budget: let Tk redraw and handle input, then continue
+        self.widget.after(1, self.dispatch)
+
+    def _poll(self):
+        if self.events:
+            self.dispatch()
+        self.widget.after(self.poll_interval, self._poll)
+
+    def _wake_loop(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            try:
+                self.widget.event_generate(self.sequence, when="tail")
+            except (RuntimeError, tk.TclError):
+                pass  # the poll dispatches the events
+
+
+def _tcl_threaded(widget):
+    """Whether the Tcl interpreter of the widget is threaded, so that other threads can call it"""
+    try:
+        return bool(widget.tk.call("info", "exists", "tcl_platform(threaded)")) and bool(
+            int(widget.tk.getvar("tcl_platform(threaded)"))
+        )
+    except (tk.TclError, ValueError):
+        return False
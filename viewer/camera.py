@@ -115,7 +115,8 @@ class CameraTab(ttk.Frame):
         # Tag to represent the image type: 1, 2, 3
         tag_default = tk.StringVar(value=self.exp_config["tag"])
         tk.Label(self.camera_frame, text="Tag:").grid(row=1, column=0, padx=5, pady=5)
-        tag_options = ["1", "2", "3"]
+        # "auto" takes the atom, beam and dark images of each shot in turn
+        tag_options = ["1", "2", "3", "auto"]
         tag_selection = tk.OptionMenu(self.camera_frame, tag_default, *tag_options)
         tag_selection.grid(row=1, column=1, padx=5, pady=5, sticky="snew")
         tag_default.trace_add("write", lambda *args, var=tag_default: self._update_exp_config("tag", var.get()))
@@ -5,6 +5,7 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 from config import config
+from models.shots import Shot, ShotPlot
 
 class MplFigure(ttk.Frame):
     """Main frame for plots"""
@@ -18,9 +19,37 @@ class MplFigure(ttk.Frame):
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(side="top", fill="both", expand=True)
 
+        # Shots are shown by updating the artists of a persistent plot and blitting them onto
+        # the background, which is captured on every full draw (e.g. after a resize)
+        self.shot_plot = ShotPlot(self.figure, animated=True)
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
         # self.toolbar = NavigationToolbar2Tk(canvas, master)
         # self.toolbar.update()
 
     def display(self, obj):
-        obj.plot(self.figure)
-        self.canvas.draw()
+        if isinstance(obj, Shot):
+            if self.shot_plot.update(obj, config) or self.background is None:
+                self.canvas.draw()
+            else:
+                self._blit()
+        else:
+            # Other plots clear the figure, the shot plot is rebuilt for the next shot
+            self.shot_plot.reset()
+            self.background = None
+            obj.plot(self.figure)
+            self.canvas.draw()
+
+    def _on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_artists()
+
+    def _blit(self):
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.figure.bbox)
+
+    def _draw_artists(self):
+        for artist in self.shot_plot.artists:
+            self.figure.draw_artist(artist)
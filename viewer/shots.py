@@ -43,28 +43,54 @@ class ShotList(ttk.Frame):
 
         self.tree.bind("<<TreeviewSelect>>", self._on_treeview_select)
 
+        # Shot name -> ((shot id, shot version, config version), formatted values) of each row
+        self.rows = {}
+
     def refresh(self, shots):
-        self.clear()
+        """Synchronizes the rows with the shots: rows of new shots are inserted, rows of changed
+        shots are updated and rows of evicted shots are removed. The formatted values of a row
+        are only recomputed when its shot or the config changed."""
+        names = [shot.name for shot in shots]
+        current = set(names)
+        evicted = [name for name in self.rows if name not in current]
+        if evicted:
+            self.tree.delete(*evicted)
+            for name in evicted:
+                del self.rows[name]
 
         for shot in shots:
-            if shot.fit:
-                values = (
-                    shot.atom_number,
-                    shot.fit.best_values["sx"] * config.pixel_size,
-                    shot.fit.best_values["sy"] * config.pixel_size,
-                )
-            else:
-                values = (shot.atom_number,)
-            self.tree.insert(
-                "",
-                "end",
-                id=shot.name,
-                text=shot.name,
-                values=tuple(map("{:.4g}".format, values)),
-            )
+            stamp = (id(shot), shot.version, config.version)
+            row = self.rows.get(shot.name)
+            if row is not None and row[0] == stamp:
+                continue
+
+            values = self._format(shot)
+            if row is None:
+                self.tree.insert("", "end", id=shot.name, text=shot.name, values=values)
+            elif row[1] != values:
+                self.tree.item(shot.name, values=values)
+            self.rows[shot.name] = (stamp, values)
+
+        # Rows are appended, so they only need to be reordered if the shots were
+        if list(self.tree.get_children()) != names:
+            for idx, name in enumerate(names):
+                self.tree.move(name, "", idx)
 
     def clear(self):
         self.tree.delete(*self.tree.get_children())
+        self.rows.clear()
+
+    @staticmethod
+    def _format(shot):
+        if shot.fit:
+            values = (
+                shot.atom_number,
+                shot.fit.best_values["sx"] * config.pixel_size,
+                shot.fit.best_values["sy"] * config.pixel_size,
+            )
+        else:
+            values = (shot.atom_number,)
+        return tuple(map("{:.4g}".format, values))
 
     def focus(self, shot):
         self.tree.selection_set(shot.name)
@@ -132,6 +158,9 @@ class ShotFit(ttk.Frame):
         )
         rerun_fit_btn.pack(fill="x", expand=True, padx=5, pady=5)
 
+        export_btn = ttk.Button(options_frame, text="Export PNG", command=self._export)
+        export_btn.pack(fill="x", expand=True, padx=5, pady=5)
+
     @property
     def keys(self):
         return ["N", "A", "x0", "y0", "sx", "sy", "theta", "z0"]
@@ -157,6 +186,9 @@ class ShotFit(ttk.Frame):
     def _rerun_fit(self):
         self.controller.shot_controller.refit_current_shot()
 
+    def _export(self):
+        self.controller.shot_controller.export_shots()
+
 
 class RegionOfInterestControl(ttk.LabelFrame):
     """Creates ROI object for user-defined cropping and processing of cropped image in gaussian fitting."""
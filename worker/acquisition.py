@@ -0,0 +1,207 @@
+"""
+Paths of the frames grabbed by the camera: in memory into the processing pipeline, or through
+a ring of frame buffers to disk
+"""
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from datetime import date
+
+import imageio
+import numpy as np
+
+from worker.watcher import ShotAssembler
+
+
+class ShotFeed:
+    """Groups the frames grabbed by the camera into shots and hands the complete shots to
+    process_frames(name, frames) without going through the disk. Archiving the frames to the
+    Raw Data folder is a side effect running in the background.
+
+    Neither hand-off blocks the caller (the grab loop of the camera): complete shots wait in a
+    queue of max_shots for a feed thread, which waits while the processing pipeline is
+    saturated, and frames are archived through a FrameRing. Both drop (and count) shots or
+    frames rather than holding on to an unbounded backlog when processing or the disk is too
+    slow."""
+
+    def __init__(self, process_frames, *, archive=None, timeout=60.0, max_shots=4):
+        """
+        Args: process_frames: function(name, frames) processing the (atom, beam, dark) frames
+            archive: FrameRing saving the frames to the Raw Data folder, None to not save them
+            timeout: seconds after which an incomplete shot is dropped
+            max_shots: complete shots waiting for processing, further shots are dropped"""
+        self.process_frames = process_frames
+        self.archive = archive
+        self.assembler = ShotAssembler(timeout=timeout)
+        self.shots = queue.Queue(maxsize=max(1, int(max_shots)))
+        self.dropped = 0
+        self.feeder = threading.Thread(target=self._feed_loop, name="shot-feed", daemon=True)
+        self.feeder.start()
+
+    def add(self, name, idx, frame, fileformat="bmp"):
+        """Adds frame idx (1: atoms, 2: beam, 3: dark) of a shot. The frame must not be modified
+        afterwards, it is shared by the shot and the archive."""
+        if self.archive is not None:
+            path = _archive_path(f"{name}_{idx}.{fileformat}")
+            if not self.archive.put(path, frame):
+                logging.warning("Frame ring full, image %s is not archived", path.name)
+
+        frames = self.assembler.add(name, idx, frame)
+        if frames:
+            try:
+                self.shots.put_nowait((name, tuple(frames)))
+            except queue.Full:
+                self.dropped += 1
+                logging.warning("Processing is behind, shot %s is dropped", name)
+
+    def close(self):
+        """Hand over the complete shots. The archive ring is closed by its owner."""
+        self.shots.put(None)
+        self.feeder.join()
+        if len(self.assembler):
+            logging.warning("Dropping %i incomplete shot(s)", len(self.assembler))
+        if self.dropped:
+            logging.warning("%i shot(s) were dropped while processing was behind", self.dropped)
+
+    def _feed_loop(self):
+        while True:
+            shot = self.shots.get()
+            if shot is None:
+                return
+            name, frames = shot
+            try:
+                self.process_frames(name, frames)
+            except Exception:
+                logging.exception("Processing shot %s failed", name)
+
+
+class FrameRing:
+    """A fixed number of preallocated frame buffers between the grab loop of the camera and
+    writer threads that save the frames to disk, in the format given by the file extension.
+    put() copies a frame into the next free slot and never waits for the disk: when every slot
+    still waits to be written, the frame is dropped and counted instead of delaying the next
+    grab.
+
+    Statistics (see stats): occupancy (slots waiting for or being written), frames written,
+    drops, failed writes and the writer lag (seconds from put() until the frame is on disk)."""
+
+    FREE, FILLED, WRITING = range(3)
+
+    def __init__(self, slots=32, writers=1):
+        self.slots = max(1, int(slots))
+        # (slots, height, width) array, allocated for the shape of the first frame
+        self.buffers = None
+        self.state = [self.FREE] * self.slots
+        self.paths = [None] * self.slots
+        self.stamps = [0.0] * self.slots
+        self.head = 0  # next slot to fill
+        self.tail = 0  # next slot to write
+        self.closed = False
+        self.cond = threading.Condition()
+
+        self.written = 0
+        self.drops = 0
+        self.failed = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+        self.threads = [
+            threading.Thread(target=self._write_loop, name=f"frame-writer-{num}", daemon=True)
+            for num in range(max(1, int(writers)))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    @property
+    def occupancy(self):
+        return sum(state != self.FREE for state in self.state)
+
+    @property
+    def stats(self):
+        """Dictionary of the ring occupancy and the writer counters."""
+        with self.cond:
+            return {
+                "occupancy": self.occupancy,
+                "slots": self.slots,
+                "written": self.written,
+                "drops": self.drops,
+                "failed": self.failed,
+                "lag": self.lag,
+                "max_lag": self.max_lag,
+            }
+
+    def put(self, path, frame):
+        """Copies the frame into the ring, to be saved to path. Returns False if the frame was
+        dropped because the ring is full (or closed)."""
+        with self.cond:
+            if self.closed or self.state[self.head] != self.FREE:
+                self.drops += 1
+                return False
+
+            if self.buffers is None or self.buffers.shape[1:] != frame.shape or (
+                self.buffers.dtype != frame.dtype
+            ):
+                # The buffers are only replaced once the frames of the old shape are written
+                if self.occupancy:
+                    self.drops += 1
+                    return False
+                self.buffers = np.empty((self.slots,) + frame.shape, dtype=frame.dtype)
+
+            slot = self.head
+            self.state[slot] = self.WRITING  # reserved, not visible to the writers yet
+            self.head = (slot + 1) % self.slots
+
+        # Copy outside the lock, the writers don't touch a reserved slot
+        np.copyto(self.buffers[slot], frame)
+        with self.cond:
+            self.paths[slot] = path
+            self.stamps[slot] = time.monotonic()
+            self.state[slot] = self.FILLED
+            self.cond.notify()
+        return True
+
+    def close(self):
+        """Write the frames left in the ring and stop the writer threads."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while self.state[self.tail] != self.FILLED and not self.closed:
+                    self.cond.wait()
+                if self.state[self.tail] != self.FILLED:
+                    return
+                slot = self.tail
+                self.state[slot] = self.WRITING
+                self.tail = (slot + 1) % self.slots
+                path = self.paths[slot]
+
+            try:
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                imageio.imwrite(path, self.buffers[slot])
+                failed = False
+            except Exception:
+                logging.exception("Saving image %s failed", path)
+                failed = True
+
+            with self.cond:
+                lag = time.monotonic() - self.stamps[slot]
+                self.state[slot] = self.FREE
+                self.paths[slot] = None
+                if failed:
+                    self.failed += 1
+                else:
+                    self.written += 1
+                    self.lag = lag
+                    self.max_lag = max(self.max_lag, lag)
+
+
+def _archive_path(filename):
+    """Path of an image in the "Raw Data" folder of the day, created by the ring writers"""
+    return Path("../Raw Data/").joinpath(str(date.today()), filename)
@@ -0,0 +1,150 @@
+"""
+Camera backends: the interface of a camera session used by the camera controller
+"""
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from config import config
+
+BACKENDS = ("spinnaker", "simulated")
+
+
+class CameraError(Exception):
+    """Error of a camera backend, e.g. a grab timeout or a disconnected camera."""
+
+
+class CameraBackend(ABC):
+    """Long-lived session with a camera. The backend is opened by open() and kept open until
+    close(). Settings are addressed by GenICam node names and only written to the camera when
+    they differ from the values already applied in this session. Backends implement the
+    connection, the node access and the grabbing of frames."""
+
+    # Command nodes, which run on every write
+    commands = ("TriggerSoftware",)
+
+    def __init__(self):
+        self.applied = {}
+        self.lock = threading.RLock()
+
+    @property
+    @abstractmethod
+    def is_open(self):
+        """Whether the camera was opened (and not closed since)."""
+
+    @property
+    @abstractmethod
+    def connected(self):
+        """Whether the camera is open and still responds, e.g. it wasn't unplugged."""
+
+    @abstractmethod
+    def open(self):
+        """Find and initialize the camera. Returns whether a camera is open."""
+
+    @abstractmethod
+    def close(self):
+        """Stop any acquisition and release the camera."""
+
+    @abstractmethod
+    def device_info(self):
+        """Returns the dictionary of the readable device information nodes."""
+
+    @abstractmethod
+    def begin_acquisition(self):
+        """Start streaming frames."""
+
+    @abstractmethod
+    def end_acquisition(self):
+        """Stop streaming frames, if streaming."""
+
+    @abstractmethod
+    def grab(self, timeout):
+        """Context manager waiting up to timeout milliseconds for the next frame. It yields the
+        frame as 2D uint8 array, which may be a view of the camera buffer that is only valid
+        inside the context. Raises CameraError on timeouts and incomplete frames."""
+
+    @abstractmethod
+    def _read(self, nodename):
+        """Returns the value of a node, or None if it isn't available."""
+
+    @abstractmethod
+    def _write(self, nodename, value):
+        """Writes the value of a node. Returns False if the node or value isn't valid."""
+
+    def reset(self):
+        """Reset the camera to its default settings."""
+        self.applied.clear()
+
+    def reconnect(self):
+        """Close and reopen the camera, e.g. after it was unplugged or power cycled. The
+        settings have to be applied again afterwards."""
+        logging.info("Reconnecting the camera...")
+        with self.lock:
+            self.close()
+            return self.open()
+
+    def call(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs), reconnecting the camera and running it again once if it
+        fails with a camera error while the camera isn't connected anymore."""
+        with self.lock:
+            try:
+                return func(*args, **kwargs)
+            except CameraError as ex:
+                if self.connected or not self.reconnect():
+                    raise
+                logging.info("Error: %s, retrying after reconnecting", ex)
+            return func(*args, **kwargs)
+
+    def get(self, nodename):
+        """Get the value of a node, or None."""
+        if not self.is_open:
+            return None
+        return self._read(nodename)
+
+    def set(self, nodename, value, force=False):
+        """Set a node, unless the value was already applied in this session."""
+        if not force and nodename in self.applied and self.applied[nodename] == value:
+            return True
+        if not self.is_open or not self._write(nodename, value):
+            self.applied.pop(nodename, None)
+            return False
+
+        if nodename not in self.commands:
+            self.applied[nodename] = value
+        logging.info("%s set to %s", nodename, value)
+        return True
+
+    def configure(self, settings):
+        """Apply the settings (in order) that differ from the applied ones. The trigger is
+        turned off while they change, as most nodes can't be written while it is on. Returns
+        the names of the changed nodes."""
+        changed = [
+            name for name, value in settings.items()
+            if name not in self.applied or self.applied[name] != value
+        ]
+        if not changed:
+            return []
+
+        self.set("TriggerMode", "Off", force=True)
+        for name in changed:
+            self.set(name, settings[name], force=True)
+        self.set("TriggerMode", "On", force=True)
+        return changed
+
+
+def create_backend(name):
+    """Returns the camera backend of the name, or None if it can't be used (e.g. PySpin is not
+    installed for the "spinnaker" backend)."""
+    if name == "simulated":
+        from worker.simulated import SimulatedCamera
+
+        return SimulatedCamera(rate=config.simulated_rate)
+    if name != "spinnaker":
+        raise ValueError(f"Unknown camera backend {name}")
+
+    try:
+        from worker.spinnaker import SpinnakerCamera
+    except ImportError:
+        logging.warning("PySpin is not installed, the camera is not available")
+        return None
+    return SpinnakerCamera()
@@ -0,0 +1,139 @@
+"""
+Process pool for shot fits, the frames are handed to the workers through shared memory
+"""
+import sys
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from multiprocessing import get_context, shared_memory, resource_tracker
+
+import numpy as np
+
+# The shared memory block starts with a header, whose first byte is set to cancel the fit
+HEADER = 8
+
+
+class FitPool:
+    """Fits shots in worker processes, so fits use other cores instead of contending for the
+    GIL. The frames of a shot are copied into one shared memory block instead of being pickled
+    and only the fit results are sent back. A fit submitted with a key supersedes the pending
+    fit with the same key (e.g. a refit of an older shot)."""
+
+    def __init__(self, workers=2):
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        self.keyed = {}
+        self.lock = threading.Lock()
+
+    def submit(self, shot, cfg, key=None, seed=None):
+        """Fit the shot with the config (and WarmStartCache seed) in a worker process.
+        Returns a future of the fit results, to be restored with shot.run_fit(cfg, results)."""
+        job = _FitJob((shot.data, shot.beam, shot.dark))
+        try:
+            future = self.executor.submit(
+                _fit_shot, job.block.name, job.shape, job.dtype.str, shot.name, cfg, seed
+            )
+        except Exception:
+            job.release()
+            raise
+        future.add_done_callback(lambda _: job.release())
+        future.job = job
+
+        if key is not None:
+            with self.lock:
+                previous = self.keyed.get(key)
+                self.keyed[key] = future
+            if previous is not None and not previous.done():
+                if _cancel(previous):
+                    logging.info("Pending fit %s superseded", key)
+                else:
+                    logging.info("Fit %s superseded, cancel requested", key)
+        return future
+
+    def cancel(self, key):
+        """Cancel the fit submitted with key. Returns whether it was cancelled: False if no fit
+        with the key is pending or it is already queued for a worker, in which case the worker
+        only skips it if it didn't start it yet (see _cancel)."""
+        with self.lock:
+            future = self.keyed.pop(key, None)
+        return future is not None and _cancel(future)
+
+    def shutdown(self):
+        """Cancel the pending fits and stop the worker processes."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _FitJob:
+    """Shared memory block holding the header and the (atom, beam, dark) frames of a fit."""
+
+    def __init__(self, frames):
+        self.shape, self.dtype = np.shape(frames[0]), np.result_type(*frames)
+        size = HEADER + 3 * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.block = shared_memory.SharedMemory(create=True, size=size)
+        self.block.buf[:HEADER] = bytes(HEADER)
+        buffer = np.ndarray(
+            (3, *self.shape), dtype=self.dtype, buffer=self.block.buf, offset=HEADER
+        )
+        buffer[:] = frames
+        del buffer
+
+        self.released = False
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        """Flag the fit as cancelled, the worker skips it unless it already started."""
+        with self.lock:
+            if not self.released:
+                self.block.buf[0] = 1
+
+    def release(self):
+        with self.lock:
+            if not self.released:
+                self.released = True
+                self.block.close()
+                self.block.unlink()
+
+
+def _cancel(future):
+    """Cancels the fit of the future, returns whether it was cancelled. The executor marks fits
+    as running once they are queued for a worker, so fits that can't be cancelled through the
+    future are flagged in their shared memory instead: the cancel is only requested, and the
+    future raises CancelledError if the worker skips the fit."""
+    if future.cancel():
+        return True
+    future.job.cancel()
+    return False
+
+
+def _attach(block_name):
+    """Attaches to a shared memory block of the main process, which owns and unlinks it. Before
+    Python 3.13 attaching registers the block with the resource tracker, which unlinks it (and
+    warns about a leak) when a worker with its own tracker exits. Unregistering it afterwards
+    instead would drop the registration of the main process where the tracker is shared."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=block_name, track=False)
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=block_name)
+    finally:
+        resource_tracker.register = register
+
+
+def _fit_shot(block_name, shape, dtype, name, cfg, seed):
+    """Runs in a worker process: fits the shot in the shared memory block."""
+    from config import config
+    from models.shots import Shot
+
+    block = _attach(block_name)
+    try:
+        if block.buf[0]:
+            raise CancelledError(f"Fit of shot {name} cancelled")
+        frames = np.array(np.ndarray((3, *shape), dtype=dtype, buffer=block.buf, offset=HEADER))
+    finally:
+        block.close()
+
+    config.update_from(cfg)
+    shot = Shot.from_arrays(name, *frames)
+    shot.run_fit(config, seed=seed)
+    return shot.fit_results()
@@ -0,0 +1,238 @@
+"""
+Long-lived HDF5 log writer
+"""
+import time
+import logging
+import threading
+
+import h5py
+import numpy as np
+
+FIT_KEYS = ("A", "x0", "y0", "sx", "sy", "theta", "z0")
+
+# One row per shot in /shots/table. Fit variables and ratios are NaN if not available.
+TABLE_DTYPE = np.dtype(
+    [
+        ("name", h5py.string_dtype()),
+        ("timestamp", "f8"),
+        ("atom_number", "f8"),
+        *((key, "f8") for key in FIT_KEYS),
+        ("roi_enabled", "?"),
+        ("roi", "i4", (4,)),
+        ("three_roi_enabled", "?"),
+        ("threeroi", "i4", (12,)),
+        ("a_b_ratio", "f8"),
+        ("config", "i4"),  # index of the config snapshot in /config
+        ("frame", "i8"),  # index into /shots/atom, /shots/beam and /shots/dark (-1 if missing)
+        ("comments", h5py.string_dtype()),
+    ]
+)
+FRAMES = ("atom", "beam", "dark")
+
+
+def logged_names(path):
+    """Returns the set of shot names in the table of the HDF5 log file (empty if it does not
+    exist)."""
+    try:
+        logfile = h5py.File(path, "r")
+    except FileNotFoundError:
+        return set()
+
+    with logfile:
+        if "shots/table" not in logfile:
+            return set()
+        names = logfile["shots/table"].fields("name")[:]
+    return {name.decode() if isinstance(name, bytes) else name for name in names}
+
+
+class ShotLogWriter:
+    """Keeps the HDF5 log file open and appends shots in batches. Frames go to chunked,
+    compressed datasets that grow along the shot axis, per-shot scalars to a table and config
+    snapshots are only stored when they change. Pending shots are written once batch_size of
+    them are queued or every flush_interval seconds."""
+
+    def __init__(self, path_func, batch_size=16, flush_interval=5.0, compression="lzf"):
+        """
+        Args: path_func: function returning the path of the log file, checked at every flush
+                so that a new file is started when it changes (e.g. on a new day)
+            batch_size: number of pending shots that triggers a flush
+            flush_interval: maximum number of seconds a shot stays pending
+            compression: h5py compression filter of the frame datasets"""
+        self.path_func = path_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compression = compression
+
+        self.path = None
+        self.logfile = None
+        self.config_index = None
+        self.config_snapshot = None
+
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.file_lock = threading.Lock()
+
+        self.closed = threading.Event()
+        self.timer = threading.Thread(target=self._flush_periodically, daemon=True)
+        self.timer.start()
+
+    def append(self, name, frames, values, config_snapshot, comments=""):
+        """Queue a shot for writing.
+        Args: name: shot name
+            frames: (atom, beam, dark) images
+            values: dictionary of table columns (e.g. atom_number, x0, roi)
+            config_snapshot: dictionary of config parameters at the time of the shot
+            comments: user comments"""
+        record = (name, time.time(), frames, dict(values), dict(config_snapshot), comments)
+        with self.pending_lock:
+            self.pending.append(record)
+            full = len(self.pending) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def write_group(self, name, datasets=None, attrs=None):
+        """Immediately write a group of datasets and attributes (e.g. sequence results). A
+        suffix is added to the name if the group already exists."""
+        with self.file_lock:
+            logfile = self._open()
+            unique, num = name, 1
+            while unique in logfile:
+                unique = f"{name}_{num}"
+                num += 1
+
+            group = logfile.create_group(unique)
+            for key, data in (datasets or {}).items():
+                group.create_dataset(key, data=data)
+            group.attrs.update(attrs or {})
+            logfile.flush()
+        return unique
+
+    def flush(self):
+        """Write all pending shots to the log file. If writing fails (e.g. the disk is full or
+        the file is locked), the shots stay pending for the next flush and the error is
+        raised."""
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+
+        with self.file_lock:
+            try:
+                self._write(pending)
+            except Exception:
+                with self.pending_lock:
+                    self.pending[:0] = pending
+                raise
+
+        logging.info("Logging file updated with %i shot(s)", len(pending))
+
+    def close(self):
+        """Flush the pending shots and close the log file."""
+        self.closed.set()
+        try:
+            self.flush()
+        finally:
+            with self.file_lock:
+                if self.logfile is not None:
+                    self.logfile.close()
+                    self.logfile = None
+
+    def _write(self, pending):
+        """Append the pending shot records to the log file."""
+        logfile = self._open()
+        frame_idx = self._write_frames(logfile, [record[2] for record in pending])
+
+        rows = np.zeros(len(pending), dtype=TABLE_DTYPE)
+        for row, (name, timestamp, _, values, snapshot, comments), idx in zip(
+            rows, pending, frame_idx
+        ):
+            row["name"] = name
+            row["timestamp"] = timestamp
+            row["config"] = self._config_index(logfile, snapshot)
+            row["frame"] = idx
+            row["comments"] = comments
+            for key in ("atom_number", "a_b_ratio", *FIT_KEYS):
+                row[key] = values.get(key, np.nan)
+            for key in ("roi_enabled", "three_roi_enabled"):
+                row[key] = bool(values.get(key, False))
+            for key, size in (("roi", 4), ("threeroi", 12)):
+                row[key] = values.get(key) or (-1,) * size
+
+        table = logfile["shots/table"]
+        num = table.shape[0]
+        table.resize((num + len(rows),))
+        table[num:] = rows
+        logfile.flush()
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Flushing the logging file failed")
+
+    def _open(self):
+        """Returns the open log file, (re)opening it if the path changed."""
+        path = self.path_func()
+        if self.logfile is None or path != self.path:
+            if self.logfile is not None:
+                self.logfile.close()
+                self.logfile = None
+            self.path = path
+            self.logfile = h5py.File(path, "a")
+            self.config_index = None
+            self.config_snapshot = None
+            self.logfile.require_group("config")
+            if "shots/table" not in self.logfile:
+                self.logfile.create_dataset(
+                    "shots/table",
+                    shape=(0,),
+                    maxshape=(None,),
+                    dtype=TABLE_DTYPE,
+                    chunks=(256,),
+                )
+        return self.logfile
+
+    def _write_frames(self, logfile, frames):
+        """Append the (atom, beam, dark) frames of a batch. Returns the frame index of each
+        shot, or -1 if the frames don't match the shape of the datasets."""
+        shape = np.shape(frames[0][0])
+        if "shots/atom" not in logfile:
+            for key in FRAMES:
+                logfile.create_dataset(
+                    f"shots/{key}",
+                    shape=(0, *shape),
+                    maxshape=(None, *shape),
+                    dtype=np.asarray(frames[0][0]).dtype,
+                    chunks=(1, *shape),
+                    compression=self.compression,
+                )
+
+        frame_shape = logfile["shots/atom"].shape[1:]
+        matching = [all(np.shape(f) == frame_shape for f in shot) for shot in frames]
+        if not all(matching):
+            logging.error("Frame shape differs from %s, frames not logged", frame_shape)
+
+        num = logfile["shots/atom"].shape[0]
+        idx = np.cumsum(matching) - 1 + num
+        count = int(sum(matching))
+        if count:
+            for pos, key in enumerate(FRAMES):
+                dataset = logfile[f"shots/{key}"]
+                dataset.resize(num + count, axis=0)
+                dataset[num:] = np.stack(
+                    [shot[pos] for shot, ok in zip(frames, matching) if ok]
+                )
+        return np.where(matching, idx, -1)
+
+    def _config_index(self, logfile, snapshot):
+        """Returns the index of the config snapshot in /config, storing it if it changed."""
+        if snapshot != self.config_snapshot:
+            configs = logfile["config"]
+            self.config_index = len(configs)
+            group = configs.create_group(str(self.config_index))
+            for label, value in snapshot.items():
+                group.attrs[label] = value if value is not None else "None"
+            self.config_snapshot = snapshot
+        return self.config_index
@@ -0,0 +1,128 @@
+"""
+Multi-stage processing pipeline with bounded queues between the stages
+"""
+import time
+import queue
+import logging
+import threading
+import traceback
+
+_STOP = object()
+
+
+class Stage:
+    """A pipeline stage: a bounded input queue consumed by a pool of worker threads."""
+
+    def __init__(self, name, func, workers=1, maxsize=4):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.threads = []
+
+
+class Pipeline:
+    """Runs items through a chain of stages. Every stage function takes an item and returns the
+    item handed to the next stage, or None to stop processing it. Puts block while the next
+    queue is full, so a slow stage throttles its upstream stages (backpressure) instead of
+    growing the backlog without bound."""
+
+    def __init__(self, stages, *, workers=None, maxsize=4, on_error=None):
+        """
+        Args: stages: list of (name, func) tuples in processing order
+            workers: dict of the number of worker threads per stage name (default 1)
+            maxsize: maximum number of items waiting in front of each stage
+            on_error: function(stage name, item, exception) called when a stage raises"""
+        workers = workers or {}
+        self.stages = [
+            Stage(name, func, workers=workers.get(name, 1), maxsize=maxsize)
+            for name, func in stages
+        ]
+        self.on_error = on_error
+
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        """Start the worker threads of every stage."""
+        for idx, stage in enumerate(self.stages):
+            next_stage = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+            for num in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._run,
+                    args=(stage, next_stage),
+                    name=f"pipeline-{stage.name}-{num}",
+                    daemon=True,
+                )
+                thread.start()
+                stage.threads.append(thread)
+        self.running = True
+
+    def submit(self, item, block=True, timeout=None):
+        """Add an item to the first stage. Blocks while the first stage is saturated."""
+        if not self.running:
+            raise RuntimeError("Pipeline is not running")
+
+        with self.in_flight_lock:
+            self.in_flight += 1
+        try:
+            self.stages[0].queue.put(item, block=block, timeout=timeout)
+        except queue.Full:
+            self._done()
+            raise
+
+    def stop(self, timeout=None):
+        """Let the queued items finish, then stop the worker threads stage by stage. Gives up
+        waiting after timeout seconds in total (None: wait until every stage has stopped)."""
+        self.running = False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for stage in self.stages:
+            try:
+                for _ in stage.threads:
+                    stage.queue.put(_STOP, timeout=_remaining(deadline))
+            except queue.Full:
+                logging.warning("Pipeline stage %s did not stop in time", stage.name)
+                return
+            for thread in stage.threads:
+                thread.join(_remaining(deadline))
+            stage.threads.clear()
+
+    @property
+    def idle(self):
+        """True if no item is queued or being processed."""
+        return self.in_flight == 0
+
+    @property
+    def backlog(self):
+        """Dictionary of the number of items waiting in front of each stage."""
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def _run(self, stage, next_stage):
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                break
+
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                result = None
+                if self.on_error:
+                    self.on_error(stage.name, item, e)
+                else:
+                    logging.error(traceback.format_exc())
+
+            if result is None or next_stage is None:
+                self._done()
+            else:
+                next_stage.queue.put(result)
+
+    def _done(self):
+        with self.in_flight_lock:
+            self.in_flight -= 1
+
+
+def _remaining(deadline):
+    """Seconds left until the monotonic deadline, None if there is none"""
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
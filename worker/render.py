@@ -0,0 +1,115 @@
+"""
+Process pool for the PNG exports of shots
+"""
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future
+from multiprocessing import get_context
+
+POLICIES = ("every", "nth", "on_demand", "idle")
+
+
+class RenderPool:
+    """Renders the PNG exports of shots in worker processes. Workers receive the plot data of
+    a shot (see Shot.plot_data: the displayed image, ROIs, fit profiles and best values) rather
+    than the shot, and draw it with a ShotPlot. Which shots submit() exports is set by the
+    policy:
+        "every": every shot
+        "nth": every nth shot
+        "on_demand": none, shots are only exported through export()
+        "idle": shots submitted while no shots wait for processing and no export is pending
+    submit() waits while max_pending exports are queued, so a stream of shots faster than the
+    workers is throttled instead of queuing plot data without bound. With no workers, shots are
+    rendered in the calling thread."""
+
+    def __init__(self, workers=1, policy="every", every=1, dpi=150, max_pending=4):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown render policy {policy}")
+
+        self.policy = policy
+        self.every = max(1, int(every))
+        self.dpi = dpi
+        self.executor = None
+        if workers:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=get_context("spawn")
+            )
+
+        self.max_pending = max(1, int(max_pending))
+        self.submitted = 0
+        self.pending = 0
+        self.cond = threading.Condition()
+
+    def submit(self, shot, path, cfg, idle=True):
+        """Export the shot to path if the policy selects it. idle tells whether no other shots
+        wait for processing. Returns the future of the export, or None if it is skipped."""
+        with self.cond:
+            self.submitted += 1
+            if self.policy == "on_demand":
+                return None
+            if self.policy == "nth" and (self.submitted - 1) % self.every:
+                return None
+            if self.policy == "idle" and (not idle or self.pending):
+                logging.debug("Skipping the export of shot %s, the pipeline is busy", shot.name)
+                return None
+
+            while self.pending >= self.max_pending:
+                self.cond.wait()
+            self.pending += 1
+        return self._export(shot, path, cfg)
+
+    def export(self, shot, path, cfg):
+        """Export the shot to path regardless of the policy and of the pending exports. Returns
+        the future of the export."""
+        with self.cond:
+            self.pending += 1
+        return self._export(shot, path, cfg)
+
+    def _export(self, shot, path, cfg):
+        try:
+            args = (shot.plot_data(cfg), cfg.colormap, str(path), self.dpi)
+        except Exception:
+            self._release()
+            raise
+
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(render_plot(*args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self.executor.submit(render_plot, *args)
+        future.add_done_callback(lambda f: self._done(f, shot.name))
+        return future
+
+    def shutdown(self, wait=True):
+        """Finish the pending exports (unless not wait) and stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _release(self):
+        with self.cond:
+            self.pending -= 1
+            self.cond.notify()
+
+    def _done(self, future, name):
+        self._release()
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logging.error("Exporting shot %s failed: %s", name, future.exception())
+        else:
+            logging.info("Exported shot %s to %s", name, future.result())
+
+
+def render_plot(data, cmap, path, dpi):
+    """Draws the plot data of a shot and saves it as a PNG. Runs in the render workers, and in
+    the reprocessing workers so that their PNGs match."""
+    from matplotlib.figure import Figure
+    from models.shots import ShotPlot
+
+    figure = Figure(figsize=(8, 5))
+    ShotPlot(figure).show(data, cmap)
+    figure.savefig(path, dpi=dpi)
+    return path
@@ -0,0 +1,262 @@
+"""
+Simulated camera backend, standing in for a FLIR camera on machines without the hardware
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from worker.camera import CameraBackend, CameraError
+
+# Device information nodes
+DEVICE_INFO = {
+    "DeviceVendorName": "Simulated",
+    "DeviceModelName": "Simulated camera",
+    "DeviceSerialNumber": "SIM-0000",
+    "DeviceVersion": "1.0",
+}
+
+# Node values after open() and reset()
+DEFAULT_NODES = {
+    "AcquisitionMode": "Continuous",
+    "BlackLevel": 0.0,
+    "BlackLevelAuto": "Off",
+    "ExposureAuto": "Off",
+    "ExposureCompensation": 0.0,
+    "ExposureCompensationAuto": False,
+    "ExposureMode": "Timed",
+    "ExposureTime": 50.0,
+    "Gain": 0.0,
+    "GainAuto": "Off",
+    "Height": 964,
+    "OffsetX": 0,
+    "OffsetY": 0,
+    "PixelFormat": "Mono8",
+    "TriggerActivation": "RisingEdge",
+    "TriggerDelay": 0.0,
+    "TriggerDelayEnable": False,
+    "TriggerMode": "Off",
+    "TriggerSelector": "FrameStart",
+    "TriggerSource": "Software",
+    "Width": 1288,
+}
+
+# Valid entries of the enumeration nodes that are checked
+ENUM_ENTRIES = {
+    "PixelFormat": ("Mono8", "Mono10", "Mono12"),
+    "TriggerMode": ("Off", "On"),
+    "TriggerSource": ("Line0", "Line1", "Line2", "Line3", "Software"),
+}
+
+# Nodes that can't be written while streaming
+STREAM_LOCKED = ("Width", "Height", "OffsetX", "OffsetY", "PixelFormat")
+
+
+class SimulatedCamera(CameraBackend):
+    """Camera emitting absorption imaging shots: the frames cycle through atoms, beam and dark
+    (tags 1, 2, 3), so the "auto" tag assembles them into shots. The probe beam is a wide
+    Gaussian with interference fringes, the atoms a Gaussian cloud of fluctuating position,
+    size and optical density, with photon shot noise on the beam and read noise on every
+    frame. The intensity scales with ExposureTime.
+
+    While streaming, a software trigger fires at rate frames per second (0: only explicit
+    triggers). Writing the TriggerSoftware node (or calling trigger()) fires an additional
+    one. The same node names as the Spinnaker backend can be read and written."""
+
+    # Beam counts at the center for the default exposure time, and the dark level
+    beam_counts = 180.0
+    dark_level = 2.0
+    read_noise = 1.0
+    fringe_contrast = 0.05
+    fringe_period = 40.0
+
+    def __init__(self, rate=3.0, seed=None):
+        super().__init__()
+        self.rate = float(rate)
+        self.rng = np.random.default_rng(seed)
+        self.nodes = None
+        self.streaming = False
+        self.frame_count = 0
+        self.triggers = 0
+        self.trigger_cond = threading.Condition()
+        self.trigger_thread = None
+        self.shot = None
+        self._grid = None
+
+    @property
+    def is_open(self):
+        return self.nodes is not None
+
+    @property
+    def connected(self):
+        return self.is_open
+
+    def open(self):
+        with self.lock:
+            if self.nodes is None:
+                self.nodes = dict(DEFAULT_NODES)
+                logging.info("Simulated camera is open, triggering at %.3g Hz", self.rate)
+            return True
+
+    def close(self):
+        with self.lock:
+            self.end_acquisition()
+            self.nodes = None
+            self.applied.clear()
+
+    def device_info(self):
+        return dict(DEVICE_INFO) if self.is_open else {}
+
+    def begin_acquisition(self):
+        if not self.is_open:
+            raise CameraError("Camera is not open")
+        with self.trigger_cond:
+            if self.streaming:
+                raise CameraError("Camera is already streaming")
+            self.streaming = True
+            self.frame_count = 0
+            self.triggers = 0
+
+        if self.rate > 0:
+            self.trigger_thread = threading.Thread(
+                target=self._trigger_loop, name="simulated-trigger", daemon=True
+            )
+            self.trigger_thread.start()
+
+    def end_acquisition(self):
+        with self.trigger_cond:
+            self.streaming = False
+            self.trigger_cond.notify_all()
+        if self.trigger_thread is not None:
+            self.trigger_thread.join()
+            self.trigger_thread = None
+
+    def trigger(self):
+        """Fire a software trigger."""
+        with self.trigger_cond:
+            if self.streaming:
+                self.triggers += 1
+                self.trigger_cond.notify()
+
+    @contextmanager
+    def grab(self, timeout):
+        deadline = time.monotonic() + timeout / 1000
+        with self.trigger_cond:
+            while self.streaming and not self.triggers:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CameraError("Timeout waiting for a trigger")
+                self.trigger_cond.wait(remaining)
+            if not self.streaming:
+                raise CameraError("Camera is not streaming")
+            self.triggers -= 1
+            kind = self.frame_count % 3
+            self.frame_count += 1
+
+        yield self.frame(kind)
+
+    def reset(self):
+        with self.lock:
+            if self.is_open:
+                self.nodes = dict(DEFAULT_NODES)
+        super().reset()
+
+    def frame(self, kind):
+        """Returns a frame of the kind 0 (atoms), 1 (beam) or 2 (dark). The atoms frame starts
+        a new shot, whose beam frame shares its fringes up to a small phase jitter."""
+        height, width = int(self.nodes["Height"]), int(self.nodes["Width"])
+        if self._grid is None or self._grid[0].shape != (height, width):
+            self._grid = np.mgrid[0:height, 0:width].astype(np.float32)
+        y, x = self._grid
+
+        if kind == 0 or self.shot is None:
+            self.shot = self._new_shot(width, height)
+        shot = self.shot
+
+        counts = np.full((height, width), self.dark_level, dtype=np.float32)
+        if kind < 2:
+            beam = self._beam(x, y, width, height, shot["phase"] + 0.1 * kind * shot["jitter"])
+            if kind == 0:
+                od = shot["od"] * np.exp(
+                    -((x - shot["x0"]) ** 2) / (2 * shot["sx"] ** 2)
+                    - ((y - shot["y0"]) ** 2) / (2 * shot["sy"] ** 2)
+                )
+                beam *= np.exp(-od)
+            counts += self.rng.poisson(beam).astype(np.float32)
+
+        counts += self.rng.normal(0, self.read_noise, counts.shape).astype(np.float32)
+        return np.clip(np.rint(counts), 0, 255).astype(np.uint8)
+
+    def _new_shot(self, width, height):
+        """Random parameters of the cloud and fringes of a shot."""
+        rng = self.rng
+        return {
+            "x0": width / 2 + rng.normal(0, 5),
+            "y0": height / 2 + rng.normal(0, 5),
+            "sx": max(5.0, rng.normal(width / 20, 2)),
+            "sy": max(5.0, rng.normal(height / 20, 2)),
+            "od": max(0.05, rng.normal(1.0, 0.05)),
+            "phase": rng.uniform(0, 2 * np.pi),
+            "jitter": rng.normal(),
+        }
+
+    def _beam(self, x, y, width, height, phase):
+        """Mean beam counts: a Gaussian profile with fringes, scaled by the exposure time."""
+        exposure = float(self.nodes["ExposureTime"]) / DEFAULT_NODES["ExposureTime"]
+        gain = 10 ** (float(self.nodes["Gain"]) / 20)
+        waist = 0.6 * max(width, height)
+        profile = np.exp(-((x - width / 2) ** 2 + (y - height / 2) ** 2) / (2 * waist**2))
+        fringes = 1 + self.fringe_contrast * np.sin(
+            2 * np.pi * (0.8 * x + 0.6 * y) / self.fringe_period + phase
+        )
+        return (self.beam_counts * exposure * gain) * profile * fringes
+
+    def _trigger_loop(self):
+        interval = 1 / self.rate
+        next_time = time.monotonic() + interval
+        with self.trigger_cond:
+            while self.streaming:
+                remaining = next_time - time.monotonic()
+                if remaining > 0:
+                    self.trigger_cond.wait(remaining)
+                    continue
+                self.triggers += 1
+                self.trigger_cond.notify_all()
+                next_time += interval
+
+    def _read(self, nodename):
+        if nodename in DEVICE_INFO:
+            return DEVICE_INFO[nodename]
+        if nodename not in self.nodes:
+            logging.info("Node %s is not available", nodename)
+        return self.nodes.get(nodename)
+
+    def _write(self, nodename, value):
+        if nodename == "TriggerSoftware":
+            self.trigger()
+            return True
+        if nodename not in self.nodes:
+            logging.info("Node %s is not available", nodename)
+            return False
+        if self.streaming and nodename in STREAM_LOCKED:
+            logging.info("Node %s can't be written while streaming", nodename)
+            return False
+
+        current = self.nodes[nodename]
+        try:
+            if isinstance(current, bool):
+                value = bool(value)
+            elif isinstance(current, int):
+                value = int(value)
+            elif isinstance(current, float):
+                value = float(value)
+            elif value not in ENUM_ENTRIES.get(nodename, (value,)):
+                raise ValueError(value)
+        except (TypeError, ValueError):
+            logging.info("Value %s is not valid.", value)
+            return False
+
+        self.nodes[nodename] = value
+        return True
@@ -0,0 +1,216 @@
+"""
+Camera backend of FLIR cameras through the Spinnaker SDK (PySpin)
+"""
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+import PySpin as ps
+
+from worker.camera import CameraBackend, CameraError
+
+# Node types tried, in order, to cast the node of a name to a typed handle
+NODE_TYPES = (ps.CEnumerationPtr, ps.CIntegerPtr, ps.CFloatPtr, ps.CBooleanPtr, ps.CStringPtr)
+
+
+class SpinnakerCamera(CameraBackend):
+    """Session with the first Spinnaker camera. The system, the camera and the typed node
+    handles are acquired once by open() and kept until close()."""
+
+    def __init__(self):
+        super().__init__()
+        self.system = None
+        self.cam_list = None
+        self.cam = None
+        self.nodemap = None
+        self.tldevice_nodemap = None
+        self.nodes = {}
+
+        # Create ImageProcessor instance for post processing images
+        self.processor = ps.ImageProcessor()
+        # By default, if no specific color processing algorithm is set, the image
+        # processor will default to NEAREST_NEIGHBOR method.
+        self.processor.SetColorProcessing(ps.SPINNAKER_COLOR_PROCESSING_ALGORITHM_HQ_LINEAR)
+
+    @property
+    def is_open(self):
+        return self.cam is not None
+
+    @property
+    def connected(self):
+        if self.cam is None:
+            return False
+        try:
+            return self.cam.IsValid() and self.cam.IsInitialized()
+        except ps.SpinnakerException:
+            return False
+
+    def open(self):
+        with self.lock:
+            if self.cam is not None:
+                return True
+
+            logging.info("============= open camera session =============")
+            try:
+                self.system = ps.System.GetInstance()
+                version = self.system.GetLibraryVersion()
+                logging.info(
+                    "Library version: %d.%d.%d.%d",
+                    version.major, version.minor, version.type, version.build,
+                )
+                self.cam_list = self.system.GetCameras()
+                logging.info("Number of cameras detected: %i", self.cam_list.GetSize())
+                if self.cam_list.GetSize() == 0:
+                    logging.info("Not enough cameras!")
+                    self.close()
+                    return False
+
+                self.cam = self.cam_list.GetByIndex(0)
+                self.cam.Init()
+                self.nodemap = self.cam.GetNodeMap()
+                self.tldevice_nodemap = self.cam.GetTLDeviceNodeMap()
+            except ps.SpinnakerException as ex:
+                logging.info("Error: %s", ex)
+                self.close()
+                return False
+
+            logging.info("Camera is open.")
+            return True
+
+    def close(self):
+        with self.lock:
+            if self.cam is not None:
+                try:
+                    if self.cam.IsStreaming():
+                        self.cam.EndAcquisition()
+                    self.cam.DeInit()
+                except ps.SpinnakerException:
+                    logging.info("Camera is not available to close.")
+
+            # The handles hold references to the camera, which must be gone before the system
+            # instance is released
+            self.nodes.clear()
+            self.applied.clear()
+            self.nodemap = None
+            self.tldevice_nodemap = None
+            self.cam = None
+            if self.cam_list is not None:
+                self.cam_list.Clear()
+                self.cam_list = None
+            if self.system is not None:
+                self.system.ReleaseInstance()
+                self.system = None
+            logging.info("Camera is closed.")
+
+    def device_info(self):
+        info = {}
+        if self.nodemap is None:
+            return info
+
+        try:
+            node_device_information = ps.CCategoryPtr(self.nodemap.GetNode("DeviceInformation"))
+            if not ps.IsReadable(node_device_information):
+                logging.info("Device control information not available.")
+                return info
+            for feature in node_device_information.GetFeatures():
+                if ps.IsReadable(feature):
+                    node_feature = ps.CValuePtr(feature)
+                    info[node_feature.GetName()] = node_feature.ToString()
+        except ps.SpinnakerException as ex:
+            logging.info("Error: %s", ex)
+        return info
+
+    def begin_acquisition(self):
+        try:
+            self.cam.BeginAcquisition()
+        except ps.SpinnakerException as ex:
+            raise CameraError(ex) from ex
+
+    def end_acquisition(self):
+        try:
+            if self.connected and self.cam.IsStreaming():
+                self.cam.EndAcquisition()
+        except ps.SpinnakerException as ex:
+            raise CameraError(ex) from ex
+
+    @contextmanager
+    def grab(self, timeout):
+        try:
+            image_result = self.cam.GetNextImage(timeout)
+        except ps.SpinnakerException as ex:
+            raise CameraError(ex) from ex
+
+        try:
+            if image_result.IsIncomplete():
+                raise CameraError(
+                    "Image incomplete with image status %d" % image_result.GetImageStatus()
+                )
+            image = image_result
+            if image.GetPixelFormat() != ps.PixelFormat_Mono8:
+                image = self.processor.Convert(image_result, ps.PixelFormat_Mono8)
+            yield np.asarray(image.GetNDArray(), dtype=np.uint8)
+        except ps.SpinnakerException as ex:
+            raise CameraError(ex) from ex
+        finally:
+            image_result.Release()
+
+    def reset(self):
+        try:
+            self.cam.UserSetSelector.SetValue(ps.UserSetSelector_Default)
+            self.cam.UserSetLoad()
+        except ps.SpinnakerException as ex:
+            raise CameraError(ex) from ex
+        super().reset()
+
+    def node(self, nodename):
+        """Get the typed handle of a node, looked up once per session. Returns None if the node
+        isn't available (which may depend on other settings) or its type isn't supported."""
+        if self.nodemap is None:
+            return None
+
+        handle = self.nodes.get(nodename)
+        if handle is None:
+            node_address = self.nodemap.GetNode(nodename)
+            if not ps.IsAvailable(node_address):
+                logging.info("Node %s is not available", nodename)
+                return None
+            for node_type in NODE_TYPES:
+                if node_type(node_address).IsValid():
+                    handle = self.nodes[nodename] = node_type(node_address)
+                    break
+            else:
+                logging.info("Type of node is not supported temporarily.")
+        return handle
+
+    def _read(self, nodename):
+        node = self.node(nodename)
+        if node is None:
+            return None
+        if not ps.IsReadable(node):
+            logging.info("Unable to get %s", nodename)
+            return None
+
+        if isinstance(node, ps.CEnumerationPtr):
+            return node.GetCurrentEntry().GetSymbolic()
+        return node.GetValue()
+
+    def _write(self, nodename, value):
+        node = self.node(nodename)
+        if node is None:
+            return False
+        try:
+            if isinstance(node, ps.CEnumerationPtr):
+                node.SetIntValue(ps.CEnumEntryPtr(node.GetEntryByName(value)).GetValue())
+            elif isinstance(node, ps.CIntegerPtr):
+                node.SetValue(int(value))
+            elif isinstance(node, ps.CFloatPtr):
+                node.SetValue(float(value))
+            elif isinstance(node, ps.CBooleanPtr):
+                node.SetValue(bool(value))
+            else:
+                logging.info("Type of node is not supported temporarily.")
+                return False
+        except ps.SpinnakerException:
+            logging.info("Value %s is not valid.", value)
+            return False
+        return True
@@ -1,76 +1,166 @@
 import re
+import time
 import logging
 import traceback
 
-from collections import defaultdict
+from collections import OrderedDict
 from pathlib import Path
 from datetime import date
+from threading import Lock
 
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
 
+# Shot images are named <shot name>-<idx> or <shot name>_<idx>
+SHOT_PATTERN = re.compile(r"^(.*)(?:-|_)(\d)$")
+
 class FileWatcher(Observer):
     """Wrap watchdog.observers.Observer to handle Shot BMP observation."""
 
-    def __init__(self, directory, *, process_shot):
+    def __init__(self, directory, *, process_shot, timeout=60.0):
         """
         Args:directory: directory to watch for bmp files 
-            process_shot: function to process the shots"""
+            process_shot: function(name, paths, release) to process the shots,
+                release(paths, failed) moves the images once they have been read
+            timeout: seconds after which an incomplete shot is dropped"""
         super().__init__()
         
         # process_shot pass function to process the shots 
         # before moving the images to the Raw Data folder
         self.process_shot = process_shot
         self.directory = directory  
+        self.assembler = ShotAssembler(timeout=timeout)
 
-        self.event_handler = _create_handler(self._check_and_dispatch)
+        self.event_handler = _create_handler(self._on_created, self._on_deleted)
         self.schedule(self.event_handler, directory, recursive=False)
 
     def start(self):
         super().start()
         logging.info("Watching for new files in %s", self.directory)
 
-    def _check_and_dispatch(self, bmp_paths):
-        shot_bmps = defaultdict(int)
-        all_paths = {}
-
-        for path in map(Path, bmp_paths):
-            if path.is_file():  # check for existence
-                match = re.match(r"^(.*)(?:-|_)(\d)$", path.stem)
-                if match:
-                    name, idx = match.groups()
-                    shot_bmps[name] += int(idx)
-                    all_paths[f"{name}-{idx}"] = path
-
-        for name, num in shot_bmps.items():
-            if num == 6:  # Crude determination that all 3 images exist: 1 + 2 + 3
-                # If additional shot -0, ignores
-                paths = [all_paths[f"{name}-{num}"] for num in range(1, 4)]
-                try:
-                    self.process_shot(name, paths)
-                    _move_raw_images(paths, failed=False)
-                except Exception as e:
-                    logging.error(traceback.format_exc())
-                    _move_raw_images(paths, failed=True)
-
-
-def _create_handler(callback):
-    """Wrapper for the watchdog EventHandler to store file paths in a set"""
-    bmp_paths = set()
-
-    def on_created(e):
-        bmp_paths.add(e.src_path)
-        callback(bmp_paths)
-
-    def on_deleted(e):
-        bmp_paths.discard(e.src_path)
-
+    def _on_created(self, src_path):
+        parsed = parse_shot_path(src_path)
+        if parsed:
+            name, idx = parsed
+            paths = self.assembler.add(name, idx, Path(src_path))
+            if paths:
+                self._check_and_dispatch(name, paths)
+
+    def _on_deleted(self, src_path):
+        parsed = parse_shot_path(src_path)
+        if parsed:
+            self.assembler.discard(*parsed)
+
+    def _check_and_dispatch(self, name, paths):
+        if not all(path.is_file() for path in paths):  # check for existence
+            logging.warning("Images of shot %s disappeared before processing", name)
+            return
+
+        try:
+            # The images are moved once they have been read
+            self.process_shot(name, paths, release=_move_raw_images)
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            _move_raw_images(paths, failed=True)
+
+
+class ShotAssembler:
+    """Groups shot images by shot name as they arrive. Every image is handled in constant time:
+    complete shots are released immediately and incomplete ones expire after the timeout."""
+
+    def __init__(self, timeout=60.0, indexes=(1, 2, 3)):
+        self.timeout = timeout
+        self.indexes = tuple(indexes)
+
+        # Shot name -> (time first seen, {idx: item}), ordered by time first seen
+        self.pending = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, name, idx, item, now=None):
+        """Adds an image of a shot. Returns the items ordered by index once the shot is complete,
+        otherwise None. Indexes outside of self.indexes (e.g. an additional shot -0) are ignored."""
+        if idx not in self.indexes:
+            return None
+
+        if now is None:
+            now = time.monotonic()
+
+        with self.lock:
+            self._expire(now)
+
+            if name not in self.pending:
+                self.pending[name] = (now, {})
+            items = self.pending[name][1]
+            items[idx] = item
+
+            if len(items) < len(self.indexes):
+                return None
+
+            del self.pending[name]
+            return [items[i] for i in self.indexes]
+
+    def discard(self, name, idx):
+        """Removes an image of a pending shot (e.g. the file was deleted)."""
+        with self.lock:
+            if name in self.pending:
+                items = self.pending[name][1]
+                items.pop(idx, None)
+                if not items:
+                    del self.pending[name]
+
+    def _expire(self, now):
+        """Drops the incomplete shots that are older than the timeout."""
+        while self.pending:
+            name, (first_seen, items) = next(iter(self.pending.items()))
+            if now - first_seen < self.timeout:
+                break
+
+            del self.pending[name]
+            logging.warning(
+                "Shot %s timed out with images %s only", name, sorted(items.keys())
+            )
+
+
+def parse_shot_path(path):
+    """Returns the (name, idx) of a shot image path or None if it does not follow the
+    naming rules."""
+    match = SHOT_PATTERN.match(Path(path).stem)
+    if match:
+        name, idx = match.groups()
+        return name, int(idx)
+    return None
+
+
+def find_shots(directory):
+    """Returns the (name, paths) of the complete shots among the images in the directory,
+    ordered by name. Images are grouped with the naming rules of the file watcher."""
+    assembler = ShotAssembler(timeout=float("inf"))
+    shots = []
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() != ".bmp" or not path.is_file():
+            continue
+        parsed = parse_shot_path(path)
+        if parsed:
+            paths = assembler.add(*parsed, path)
+            if paths:
+                shots.append((parsed[0], paths))
+
+    if len(assembler):
+        logging.warning("Skipping %i incomplete shot(s) in %s", len(assembler), directory)
+    return sorted(shots, key=lambda shot: shot[0])
+
+
+def _create_handler(on_created, on_deleted):
+    """Wrapper for the watchdog EventHandler to forward created and deleted file paths"""
     event_handler = PatternMatchingEventHandler(
         patterns=["*.bmp"], ignore_directories=True, case_sensitive=False
     )
     event_handler.on_any_event = lambda e: logging.debug(e.src_path)
-    event_handler.on_created = on_created
-    event_handler.on_deleted = on_deleted
+    event_handler.on_created = lambda e: on_created(e.src_path)
+    event_handler.on_deleted = lambda e: on_deleted(e.src_path)
 
     return event_handler
 